@@ -11,30 +11,41 @@ import numpy as np
 class BrowseNPY(bpy.types.Operator, ImportHelper):
   bl_idname = 'deep_blender.browse_npy'
   bl_label = "Import NPY..."
-  bl_description = "Import an NPY as texture/image."
+  bl_description = "Import an NPY as texture/image. Each render pass of an NPZ is imported as separate image."
 
   filename_ext = ".npy"
 
   filter_glob = StringProperty(
-      default="*.npy",
+      default="*.npy;*.npz",
       options={'HIDDEN'},
       maxlen=255)
 
   def execute(self, context):
-    npy_image = np.load(self.filepath)
+    if self.filepath.endswith('.npz'):
+      npz_images = np.load(self.filepath)
+      for image_name in npz_images.files:
+        BrowseNPY._add_image(image_name, npz_images[image_name])
+    else:
+      image_name = os.path.basename(self.filepath)
+      image_name = os.path.splitext(image_name)[0]
+      BrowseNPY._add_image(image_name, np.load(self.filepath))
+
+    return{'FINISHED'}
+
+  @staticmethod
+  def _add_image(image_name, npy_image):
+    if len(npy_image.shape) == 2:
+      npy_image = np.stack((npy_image, npy_image, npy_image), axis=2)
+    elif npy_image.shape[2] == 1:
+      npy_image = np.concatenate((npy_image, npy_image, npy_image), axis=2)
     if npy_image.shape[2] == 3:
       ones = np.ones((npy_image.shape[0], npy_image.shape[1], 1))
       npy_image = np.concatenate((npy_image, ones), axis=2)
     npy_image = np.flip(npy_image, axis=0)
-
-    image_name = os.path.basename(self.filepath)
-    image_name = os.path.splitext(image_name)[0]
     
     image = bpy.data.images.new(image_name, width=npy_image.shape[1], height=npy_image.shape[0], float_buffer=True)
     image.pixels = npy_image.ravel()
 
-    return{'FINISHED'}
-
 
 class NPYImporterPanel(bpy.types.Panel):
   bl_label = "NPY Importer"
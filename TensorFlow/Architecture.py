@@ -250,9 +250,10 @@ class KernelPredictor:
 
   def __init__(
       self, use_kernel_prediction, kernel_size, use_standardized_source_for_kernel_prediction,
-      source_data_format='channels_last', data_format='channels_first'):
+      source_data_format='channels_last', data_format='channels_first', implementation='stacked'):
     self.use_kernel_prediction = use_kernel_prediction
     self.kernel_size = kernel_size
+    self.implementation = implementation
     self.use_standardized_source_for_kernel_prediction = use_standardized_source_for_kernel_prediction
     self.source_data_format = source_data_format
     self.data_format = data_format
@@ -285,7 +286,7 @@ class KernelPredictor:
           
           prediction = KernelPrediction.kernel_prediction(
               scaled_source, kernel,
-              self.kernel_size, data_format=self.data_format)
+              self.kernel_size, data_format=self.data_format, implementation=self.implementation)
         feature_prediction.add_prediction(scale_index, prediction)
 
 
@@ -526,7 +527,8 @@ class Architecture:
 
     self.kernel_predictor = KernelPredictor(
         self.use_kernel_prediction, kernel_prediction_json['kernel_size'], kernel_prediction_json['use_standardized_source_for_kernel_prediction'],
-        source_data_format=self.source_data_format, data_format=self.data_format)
+        source_data_format=self.source_data_format, data_format=self.data_format,
+        implementation=kernel_prediction_json.get('implementation', 'stacked'))
     
     self.multiscale_predictor = MultiScalePredictor(
         self.use_multiscale_predictions, multiscale_prediction_json['invert_standardization_after_multiscale_predictions'],
@@ -555,49 +557,56 @@ class Architecture:
         auxiliary_feature.standardize()
     
     with tf.name_scope('feature_predictions'):
-      reuse_core_architecture = False
       multiscale_combine_reuse = False
-
-      for feature_prediction_tuple in self.feature_prediction_tuples:
-
-        with tf.name_scope('prepare_network_input'):
-          inputs = self.source_encoder.prepare_neural_network_input(feature_prediction_tuple, features)
-
-        with tf.name_scope('core_architecture'):
-          with tf.variable_scope('reused_core_architecture', reuse=reuse_core_architecture):
-            inputs = self.core_architecture.predict(inputs, is_training)
-            
-            # Reuse the variables after the first pass.
-            reuse_core_architecture = True
-            
-            with tf.name_scope('Postprocess'):
-              for index in range(len(inputs)):
-                inputs[index] = self.core_architecture_postprocess.predict(inputs[index])
-
-            if self.use_multiscale_predictions:
-              # Reverse the inputs, such that it is sorted from largest to smallest.
-              inputs = list(reversed(inputs))
+      
+      # The core architecture is shared by all the feature prediction tuples. Their inputs are stacked along the
+      # batch dimension, such that it only runs once for all of them.
+      with tf.name_scope('prepare_network_input'):
+        inputs = []
+        for feature_prediction_tuple in self.feature_prediction_tuples:
+          inputs.append(self.source_encoder.prepare_neural_network_input(feature_prediction_tuple, features))
+        inputs = tf.concat(inputs, axis=0)
+
+      with tf.name_scope('core_architecture'):
+        with tf.variable_scope('reused_core_architecture'):
+          inputs = self.core_architecture.predict(inputs, is_training)
           
-          channel_axis = Conv2dUtilities.channel_axis(inputs[0], self.data_format)
-          for scale_index in range(len(inputs)):
-            predictions = tf.split(inputs[scale_index], len(feature_prediction_tuple.feature_predictions), channel_axis)
+          with tf.name_scope('Postprocess'):
+            for index in range(len(inputs)):
+              inputs[index] = self.core_architecture_postprocess.predict(inputs[index])
 
-            for index, prediction in enumerate(predictions):
-              feature_prediction = feature_prediction_tuple.feature_predictions[index]
-              feature_prediction.add_prediction(scale_index, prediction)
-          
-          with tf.name_scope(Naming.tensorboard_name('kernel_prediction_' + feature_prediction_tuple.name)):
-            for feature_prediction in feature_prediction_tuple.feature_predictions:
-              self.kernel_predictor.predict(feature_prediction)
-          
+          if self.use_multiscale_predictions:
+            # Reverse the inputs, such that it is sorted from largest to smallest.
+            inputs = list(reversed(inputs))
+      
+      # Split the results of the feature prediction tuples again.
+      feature_prediction_tuples_inputs = []
+      for scale_index in range(len(inputs)):
+        feature_prediction_tuples_inputs.append(tf.split(inputs[scale_index], len(self.feature_prediction_tuples), axis=0))
+      
+      for feature_prediction_tuple_index, feature_prediction_tuple in enumerate(self.feature_prediction_tuples):
+        channel_axis = Conv2dUtilities.channel_axis(inputs[0], self.data_format)
+        for scale_index in range(len(inputs)):
+          predictions = tf.split(
+              feature_prediction_tuples_inputs[scale_index][feature_prediction_tuple_index],
+              len(feature_prediction_tuple.feature_predictions), channel_axis)
+
+          for index, prediction in enumerate(predictions):
+            feature_prediction = feature_prediction_tuple.feature_predictions[index]
+            feature_prediction.add_prediction(scale_index, prediction)
+        
+        with tf.name_scope(Naming.tensorboard_name('kernel_prediction_' + feature_prediction_tuple.name)):
           for feature_prediction in feature_prediction_tuple.feature_predictions:
-            self.multiscale_predictor.predict(feature_prediction, multiscale_combine_reuse)
-            multiscale_combine_reuse = True
-          
-          # Convert back to the source data format if needed.
-          with tf.name_scope('revert_data_format_conversion'):
-            for feature_prediction in feature_prediction_tuple.feature_predictions:
-              self.data_format_reverter.predict(feature_prediction)
+            self.kernel_predictor.predict(feature_prediction)
+        
+        for feature_prediction in feature_prediction_tuple.feature_predictions:
+          self.multiscale_predictor.predict(feature_prediction, multiscale_combine_reuse)
+          multiscale_combine_reuse = True
+        
+        # Convert back to the source data format if needed.
+        with tf.name_scope('revert_data_format_conversion'):
+          for feature_prediction in feature_prediction_tuple.feature_predictions:
+            self.data_format_reverter.predict(feature_prediction)
 
     # Create the prediction dictionaries to be returned
     target_feature_prediction = None
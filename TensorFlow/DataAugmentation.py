@@ -124,6 +124,41 @@ class DataAugmentation:
     
     return inputs
   
+  # The fused variants work on batches in 'channels_last' format, in which the channels of many features are
+  # concatenated. Adjustments of individual channels, like those for the screen space normals, are expressed
+  # with channel indices and signs, such that each transformation is applied once to the whole stack.
+  # The random values like flip contain one value per example. All the variants are computed for the whole batch
+  # and the ones of each example are selected with tf.where, which is a lot cheaper than conditionals per example.
+  
+  @staticmethod
+  def flip_left_right_fused(inputs, flip, channel_signs):
+    flipped_inputs = tf.multiply(tf.reverse(inputs, [2]), channel_signs)
+    return tf.where(tf.greater(flip, 0), flipped_inputs, inputs)
+  
+  @staticmethod
+  def rotate_90_fused(inputs, k, channel_indices_list, channel_signs_list):
+    # The lists contain the channel indices and signs for the rotations by 90, 180 and 270 degrees.
+    transposed_inputs = tf.transpose(inputs, [0, 2, 1, 3])
+    rotated_inputs = [
+        tf.reverse(transposed_inputs, [1]),
+        tf.reverse(inputs, [1, 2]),
+        tf.reverse(transposed_inputs, [2])]
+    
+    result = inputs
+    for index in range(3):
+      rotated = tf.gather(rotated_inputs[index], channel_indices_list[index], axis=3)
+      rotated = tf.multiply(rotated, channel_signs_list[index])
+      result = tf.where(tf.equal(k, index + 1), rotated, result)
+    return result
+  
+  @staticmethod
+  def permute_fused(inputs, permute, channel_indices_list):
+    # The list contains the channel indices for each permutation, except the identity.
+    result = inputs
+    for index, channel_indices in enumerate(channel_indices_list):
+      result = tf.where(tf.equal(permute, index + 1), tf.gather(inputs, channel_indices, axis=3), result)
+    return result
+  
   def random_rotation_matrix(random_vector):
     #assert len(random_vector) == 3
     #assert 0. <= random_vector[0] and random_vector[0] <= 1.
@@ -178,7 +213,10 @@ class DataAugmentation:
     # This equals Vz * Vz - 1.0
     result.append(tf.subtract(1., z))
     
-    result = tf.reshape(result, [3, 3])
+    # For a batch of random vectors with shape [3, batch_size], the result are rotation matrices
+    # with shape [batch_size, 3, 3].
+    result = tf.stack(result, axis=-1)
+    result = tf.reshape(result, tf.concat([tf.shape(result)[:-1], [3, 3]], 0))
     return result
   
   @staticmethod
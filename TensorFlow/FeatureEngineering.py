@@ -12,9 +12,7 @@ class FeatureEngineering:
     kernel_size = 3
     padding_mode='symmetric'
     
-    channel_axis = Conv2dUtilities.channel_axis(inputs, data_format)
-    height_axis, width_axis = Conv2dUtilities.height_width_axis(inputs, data_format)
-    number_of_channels = Conv2dUtilities.number_of_channels(inputs, data_format)
+    number_of_channels = int(Conv2dUtilities.number_of_channels(inputs, data_format))
     is_batched = Conv2dUtilities.is_batched(inputs)
     pad = (kernel_size - 1) // 2
     
@@ -24,8 +22,8 @@ class FeatureEngineering:
       short_data_format = 'NCHW'
     
     padded_inputs = Conv2dUtilities.pad_equally(inputs, pad, mode=padding_mode, data_format=data_format)
-    padded_inputs_split = tf.split(padded_inputs, number_of_channels, axis=channel_axis)
-    joined_inputs = []
+    if not is_batched:
+      padded_inputs = tf.stack([padded_inputs])
     
     filter_shape = [kernel_size, kernel_size, 1, 1]
     if variance_mode == 'uniform':
@@ -39,32 +37,30 @@ class FeatureEngineering:
       
     filter = tf.divide(filter, tf.reduce_sum(filter))
     
-    for index in range(number_of_channels):
-      padded_input = padded_inputs_split[index]
-      if not is_batched:
-        padded_input = tf.stack([padded_input])
-      
-      input = tf.nn.conv2d(padded_input, filter=filter, strides=[1, 1, 1, 1], padding='VALID', data_format=short_data_format)
-      
-      if not is_batched:
-        input = input[0]
-      joined_inputs.append(input)
+    # The same filter is applied to each channel on its own, all of them in one depthwise convolution.
+    filter = tf.tile(filter, [1, 1, number_of_channels, 1])
+    inputs = tf.nn.depthwise_conv2d(
+        padded_inputs, filter=filter, strides=[1, 1, 1, 1], padding='VALID', data_format=short_data_format)
     
-    inputs = tf.concat(joined_inputs, axis=channel_axis)
+    if not is_batched:
+      inputs = inputs[0]
     
     return inputs
   
   def variance(inputs, variance_mode='uniform', relative_variance=False, compress_to_one_channel=False, epsilon=1e-4, data_format='channels_last'):
-    mean_of_inputs = FeatureEngineering._local_mean(inputs, variance_mode=variance_mode, data_format=data_format)
+    # The mean and the mean of the squares are computed together, by stacking the inputs and their squares.
+    channel_axis = Conv2dUtilities.channel_axis(inputs, data_format)
+    number_of_channels = int(Conv2dUtilities.number_of_channels(inputs, data_format))
+    means = FeatureEngineering._local_mean(
+        tf.concat([inputs, tf.square(inputs)], axis=channel_axis), variance_mode=variance_mode, data_format=data_format)
+    mean_of_inputs, mean_of_squared_inputs = tf.split(means, [number_of_channels, number_of_channels], axis=channel_axis)
     squared_mean_of_inputs = tf.square(mean_of_inputs)
-    mean_of_squared_inputs = FeatureEngineering._local_mean(tf.square(inputs), variance_mode=variance_mode, data_format=data_format)
     result = tf.subtract(mean_of_squared_inputs, squared_mean_of_inputs)
     
     if relative_variance:
       result = tf.divide(result, tf.maximum(squared_mean_of_inputs, epsilon))
     
     if compress_to_one_channel:
-      channel_axis = Conv2dUtilities.channel_axis(inputs, data_format)
       result = tf.reduce_mean(result, axis=channel_axis, keepdims=True)
     
     return result
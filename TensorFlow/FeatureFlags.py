@@ -68,7 +68,7 @@ class FeatureFlags:
 
       return result
 
-  def add_to_source_dictionary(self, sources, height, width):
+  def add_to_source_dictionary(self, sources, height, width, batch_size=None):
     if self.feature_flag_mode == FeatureFlagMode.ONE_HOT_ENCODING:
       for feature_flag_name in self.feature_flag_names:
         result = self.feature_flag_name_to_feature_flags[feature_flag_name]
@@ -78,4 +78,6 @@ class FeatureFlags:
           result = tf.tile(result, [height, width, 1])
         else:
           result = tf.tile(result, [1, height, width])
+        if batch_size != None:
+          result = tf.tile(tf.expand_dims(result, 0), [batch_size, 1, 1, 1])
         sources[Naming.feature_flags_name(feature_flag_name)] = result
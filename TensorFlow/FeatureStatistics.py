@@ -1,3 +1,7 @@
+import math
+
+import numpy as np
+
 class FeatureStatistics:
   def __init__(self, number_of_channels, statistics, statistics_log1p):
     self.number_of_channels = number_of_channels
@@ -5,9 +9,276 @@ class FeatureStatistics:
     self.statistics_log1p = statistics_log1p
 
 class Statistics:
-  def __init__(self, minimum, maximum, mean, variance, coverage):
+  def __init__(
+      self, minimum, maximum, mean, variance, coverage, percentiles=None,
+      mean_confidence_interval=None, coverage_confidence_interval=None):
     self.minimum = minimum
     self.maximum = maximum
     self.mean = mean
     self.variance = variance
     self.coverage = coverage
+    self.percentiles = percentiles
+    self.mean_confidence_interval = mean_confidence_interval
+    self.coverage_confidence_interval = coverage_confidence_interval
+
+  def __json__(self):
+    # The optional parts are only stored if they were computed.
+    result = {}
+    for key, value in self.__dict__.items():
+      if value != None:
+        result[key] = value
+    return result
+
+class RunningStatistics:
+
+  # Running count, mean and sum of squared differences from the mean (M2), from which the variance follows.
+  # The values are added in chunks and two running statistics can be merged, using the pairwise update of
+  # Chan et al. Like that, the statistics are computed in a single pass, no matter in which order or in how
+  # many parts the values are visited.
+  # The coverage counts the pixels which are not zero.
+
+  def __init__(self):
+    self.count = 0
+    self.mean = 0.
+    self.m2 = 0.
+    self.minimum = math.inf
+    self.maximum = -math.inf
+    self.pixels = 0
+    self.covered_pixels = 0
+
+  def add(self, values):
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+      return
+    mean = np.mean(values)
+    self.merge_moments(values.size, mean, np.sum(np.square(values - mean)), np.min(values), np.max(values))
+
+  def add_coverage(self, pixels, covered_pixels):
+    self.pixels = self.pixels + int(pixels)
+    self.covered_pixels = self.covered_pixels + int(covered_pixels)
+
+  def merge(self, other):
+    if other.count > 0:
+      self.merge_moments(other.count, other.mean, other.m2, other.minimum, other.maximum)
+    self.add_coverage(other.pixels, other.covered_pixels)
+
+  def merge_moments(self, count, mean, m2, minimum, maximum):
+    count = int(count)
+    total_count = self.count + count
+    delta = float(mean) - self.mean
+    self.mean = self.mean + delta * count / total_count
+    self.m2 = self.m2 + float(m2) + delta * delta * self.count * count / total_count
+    self.count = total_count
+    self.minimum = min(self.minimum, float(minimum))
+    self.maximum = max(self.maximum, float(maximum))
+
+  def variance(self):
+    if self.count == 0:
+      return 0.
+    return self.m2 / self.count
+
+  def coverage(self):
+    if self.pixels == 0:
+      return 0.
+    return self.covered_pixels / self.pixels
+
+  def statistics(self):
+    if self.count == 0:
+      return Statistics(0., 0., 0., 0., self.coverage())
+    return Statistics(self.minimum, self.maximum, self.mean, self.variance(), self.coverage())
+
+
+class QuantileSketch:
+
+  # Histogram with a fixed range and bin width, from which the quantiles can be estimated. It is meant for
+  # log1p values, where a bin width of 1/128 corresponds to a relative error below 1% of the original values.
+  # Zeros are very common and counted on their own, such that they don't get spread over a bin. The memory
+  # does not depend on the number of values and two sketches are merged by adding the counts.
+
+  LIMIT = 20.
+  BINS_PER_UNIT = 128
+
+  def __init__(self):
+    self.counts = np.zeros([int(2 * QuantileSketch.LIMIT * QuantileSketch.BINS_PER_UNIT)], dtype=np.int64)
+    self.zeros = 0
+    self.minimum = math.inf
+    self.maximum = -math.inf
+
+  def add(self, values):
+    values = np.ravel(values)
+    if values.size == 0:
+      return
+    self.minimum = min(self.minimum, float(np.min(values)))
+    self.maximum = max(self.maximum, float(np.max(values)))
+    zeros = values == 0.
+    self.zeros = self.zeros + int(np.count_nonzero(zeros))
+    values = np.clip(values[~zeros], -QuantileSketch.LIMIT, QuantileSketch.LIMIT)
+    indices = np.floor((values + QuantileSketch.LIMIT) * QuantileSketch.BINS_PER_UNIT).astype(np.int64)
+    indices = np.minimum(indices, len(self.counts) - 1)
+    self.counts = self.counts + np.bincount(indices, minlength=len(self.counts))
+
+  def merge(self, other):
+    self.counts = self.counts + other.counts
+    self.zeros = self.zeros + other.zeros
+    self.minimum = min(self.minimum, other.minimum)
+    self.maximum = max(self.maximum, other.maximum)
+
+  def quantile(self, q):
+    # The zeros are a bin without width between the negative and positive bins.
+    middle = len(self.counts) // 2
+    counts = np.concatenate([self.counts[:middle], [self.zeros], self.counts[middle:]])
+    bin_width = 1. / QuantileSketch.BINS_PER_UNIT
+    lower_edges = np.concatenate([
+        np.arange(middle) * bin_width - QuantileSketch.LIMIT, [0.],
+        np.arange(len(self.counts) - middle) * bin_width])
+    widths = np.concatenate([np.full([middle], bin_width), [0.], np.full([len(self.counts) - middle], bin_width)])
+    
+    total = np.sum(counts)
+    if total == 0:
+      return 0.
+    cumulative_counts = np.cumsum(counts)
+    target = q * total
+    index = min(int(np.searchsorted(cumulative_counts, target, side='left')), len(counts) - 1)
+    
+    # Linear interpolation within the bin.
+    previous_count = 0 if index == 0 else cumulative_counts[index - 1]
+    fraction = 0.
+    if counts[index] > 0:
+      fraction = (target - previous_count) / counts[index]
+    result = lower_edges[index] + fraction * widths[index]
+    return min(max(result, self.minimum), self.maximum)
+
+  def percentiles(self, percentiles):
+    result = {}
+    for percentile in percentiles:
+      result[str(percentile)] = float(self.quantile(percentile / 100.))
+    return result
+
+
+class RatioStatistics:
+
+  # Running statistics of pairs (x, y) of sampling units, like tiles or shards, for the ratio estimator
+  # sum(y) / sum(x). For a mean, x is the number of values and y their sum. For a coverage, x is the number of
+  # pixels and y the covered ones. The means, the sums of squared differences and the co-moment are merged like
+  # in RunningStatistics.
+
+  def __init__(self):
+    self.count = 0
+    self.mean_x = 0.
+    self.mean_y = 0.
+    self.m2_x = 0.
+    self.m2_y = 0.
+    self.c_xy = 0.
+
+  def add(self, x, y):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.size == 0:
+      return
+    other = RatioStatistics()
+    other.count = x.size
+    other.mean_x = float(np.mean(x))
+    other.mean_y = float(np.mean(y))
+    other.m2_x = float(np.sum(np.square(x - other.mean_x)))
+    other.m2_y = float(np.sum(np.square(y - other.mean_y)))
+    other.c_xy = float(np.sum((x - other.mean_x) * (y - other.mean_y)))
+    self.merge(other)
+
+  def merge(self, other):
+    if other.count == 0:
+      return
+    total_count = self.count + other.count
+    delta_x = other.mean_x - self.mean_x
+    delta_y = other.mean_y - self.mean_y
+    factor = self.count * other.count / total_count
+    self.mean_x = self.mean_x + delta_x * other.count / total_count
+    self.mean_y = self.mean_y + delta_y * other.count / total_count
+    self.m2_x = self.m2_x + other.m2_x + delta_x * delta_x * factor
+    self.m2_y = self.m2_y + other.m2_y + delta_y * delta_y * factor
+    self.c_xy = self.c_xy + other.c_xy + delta_x * delta_y * factor
+    self.count = total_count
+
+  def ratio(self):
+    if self.mean_x == 0.:
+      return 0.
+    return self.mean_y / self.mean_x
+
+  def confidence_interval(self, z):
+    # The variance of the ratio follows from the residuals y - ratio * x, whose mean is zero.
+    ratio = self.ratio()
+    if self.count < 2 or self.mean_x == 0.:
+      return [ratio, ratio]
+    residual_variance = max(
+        (self.m2_y - 2. * ratio * self.c_xy + ratio * ratio * self.m2_x) / (self.count - 1), 0.)
+    half_width = z * math.sqrt(residual_variance / self.count) / self.mean_x
+    return [ratio - half_width, ratio + half_width]
+
+
+class FeatureRunningStatistics:
+
+  # Everything which is accumulated for a feature: the running statistics of the values and their log1p, the
+  # quantile sketch of the log1p values and the ratio statistics of the means and coverages per tile and per
+  # shard. The latter provide the confidence intervals when only a sample is used. The values within a tile or
+  # shard are strongly correlated, that's why the tiles or shards which are sampled are the units of the
+  # estimate and not the individual values.
+
+  PERCENTILES = [0.1, 1, 5, 25, 50, 75, 95, 99, 99.9]
+
+  # Two-sided 95% confidence.
+  CONFIDENCE_Z = 1.96
+
+  def __init__(self):
+    self.statistics = RunningStatistics()
+    self.statistics_log1p = RunningStatistics()
+    self.sketch_log1p = QuantileSketch()
+    self.tile_means = RatioStatistics()
+    self.tile_coverages = RatioStatistics()
+    self.shard_means = RatioStatistics()
+    self.shard_coverages = RatioStatistics()
+    self.shard_sums = np.zeros([4])
+
+  def add(self, values, values_log1p, covered, tile_value_counts, tile_sums, tile_pixel_counts, tile_covered_counts):
+    self.statistics.add(values)
+    self.statistics.add_coverage(np.size(covered), np.count_nonzero(covered))
+    self.statistics_log1p.add(values_log1p)
+    self.sketch_log1p.add(values_log1p)
+    self.tile_means.add(tile_value_counts, tile_sums)
+    self.tile_coverages.add(tile_pixel_counts, tile_covered_counts)
+    self.shard_sums = self.shard_sums + [
+        np.sum(tile_value_counts), np.sum(tile_sums), np.sum(tile_pixel_counts), np.sum(tile_covered_counts)]
+
+  def end_shard(self):
+    # All the tiles of the current shard were added.
+    self.shard_means.add([self.shard_sums[0]], [self.shard_sums[1]])
+    self.shard_coverages.add([self.shard_sums[2]], [self.shard_sums[3]])
+    self.shard_sums = np.zeros([4])
+
+  def merge(self, other):
+    self.statistics.merge(other.statistics)
+    self.statistics_log1p.merge(other.statistics_log1p)
+    self.sketch_log1p.merge(other.sketch_log1p)
+    self.tile_means.merge(other.tile_means)
+    self.tile_coverages.merge(other.tile_coverages)
+    self.shard_means.merge(other.shard_means)
+    self.shard_coverages.merge(other.shard_coverages)
+
+  def feature_statistics(self, number_of_channels, sampling=None):
+    # The confidence intervals are only computed if the tiles or shards were sampled.
+    statistics = self.statistics.statistics()
+    statistics_log1p = self.statistics_log1p.statistics()
+    
+    # The log1p statistics share the coverage.
+    statistics_log1p.coverage = statistics.coverage
+    statistics_log1p.percentiles = self.sketch_log1p.percentiles(FeatureRunningStatistics.PERCENTILES)
+    
+    if sampling == 'tiles':
+      statistics.mean_confidence_interval = self.tile_means.confidence_interval(
+          FeatureRunningStatistics.CONFIDENCE_Z)
+      statistics.coverage_confidence_interval = self.tile_coverages.confidence_interval(
+          FeatureRunningStatistics.CONFIDENCE_Z)
+    elif sampling == 'shards':
+      statistics.mean_confidence_interval = self.shard_means.confidence_interval(
+          FeatureRunningStatistics.CONFIDENCE_Z)
+      statistics.coverage_confidence_interval = self.shard_coverages.confidence_interval(
+          FeatureRunningStatistics.CONFIDENCE_Z)
+    return FeatureStatistics(number_of_channels, statistics, statistics_log1p)
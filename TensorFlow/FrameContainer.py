@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import struct
+
+import numpy as np
+
+class FrameContainer:
+
+  # A frame container stores all the render passes of a frame uncompressed in one file, which can be memory
+  # mapped to access each render pass directly. It is built like a tile container with a single tile:
+  #
+  # magic (8 bytes) | header size (8 bytes, little endian) | json header | padding | render passes
+  #
+  # The json header contains the layout with the name, shape and data type of each render pass, which are
+  # stored one after the other in that order.
+
+  MAGIC = b'DDFRAME1'
+  EXTENSION = '.frame'
+  ALIGNMENT = 64
+
+  @staticmethod
+  def write(filename, images):
+    layout = []
+    for name in sorted(images.keys()):
+      layout.append({'name': name, 'shape': list(images[name].shape), 'dtype': 'float32'})
+    header_content = json.dumps({'layout': layout}, sort_keys=True).encode('utf-8')
+
+    # The render passes start aligned.
+    header_size = len(FrameContainer.MAGIC) + 8 + len(header_content)
+    padding = (FrameContainer.ALIGNMENT - header_size % FrameContainer.ALIGNMENT) % FrameContainer.ALIGNMENT
+    header_content = header_content + b' ' * padding
+
+    with open(filename, 'wb') as frame_container_file:
+      frame_container_file.write(FrameContainer.MAGIC)
+      frame_container_file.write(struct.pack('<Q', len(header_content)))
+      frame_container_file.write(header_content)
+      for entry in layout:
+        frame_container_file.write(np.ascontiguousarray(images[entry['name']], dtype=entry['dtype']).tobytes())
+
+  @staticmethod
+  def read(filename):
+    # Dictionary with the memory mapped render passes.
+    with open(filename, 'rb') as frame_container_file:
+      magic = frame_container_file.read(len(FrameContainer.MAGIC))
+      if magic != FrameContainer.MAGIC:
+        raise Exception('Not a frame container: ' + filename)
+      header_size = struct.unpack('<Q', frame_container_file.read(8))[0]
+      header = json.loads(frame_container_file.read(header_size).decode('utf-8'))
+    data_offset = len(FrameContainer.MAGIC) + 8 + header_size
+
+    dtype = np.dtype([(entry['name'], entry['dtype'], tuple(entry['shape'])) for entry in header['layout']])
+    frame = np.memmap(filename, dtype=dtype, mode='r', offset=data_offset, shape=(1,))[0]
+    result = {}
+    for entry in header['layout']:
+      result[entry['name']] = frame[entry['name']]
+    return result
@@ -7,23 +7,64 @@ from Conv2dUtilities import Conv2dUtilities
 
 class KernelPrediction:
 
+  # per_channel applies the kernels to one channel after the other, stacked applies them to all the channels at
+  # once. Both compute the same sums in the same order.
+  IMPLEMENTATIONS = ['stacked', 'per_channel']
+
   @staticmethod
-  def kernel_prediction(inputs, kernel_inputs, kernel_size, use_softmax=True, mode='symmetric', data_format='channels_last'):
+  def kernel_prediction(
+      inputs, kernel_inputs, kernel_size, use_softmax=True, mode='symmetric', data_format='channels_last',
+      implementation='stacked'):
 
     assert Conv2dUtilities.has_valid_shape(inputs)
     assert Conv2dUtilities.height_width(inputs, data_format) == Conv2dUtilities.height_width(kernel_inputs, data_format)
     assert Conv2dUtilities.number_of_channels(kernel_inputs, data_format) == kernel_size ** 2
-  
+    
+    channel_axis = Conv2dUtilities.channel_axis(inputs, data_format)
+    
+    if use_softmax:
+      kernel_inputs = tf.nn.softmax(kernel_inputs, axis=channel_axis)
+    
+    if implementation == 'stacked':
+      return KernelPrediction._stacked_kernel_prediction(inputs, kernel_inputs, kernel_size, mode, data_format)
+    elif implementation == 'per_channel':
+      return KernelPrediction._per_channel_kernel_prediction(inputs, kernel_inputs, kernel_size, mode, data_format)
+    raise Exception('Unknown kernel prediction implementation: ' + str(implementation))
+
+  @staticmethod
+  def _stacked_kernel_prediction(inputs, kernel_inputs, kernel_size, mode, data_format):
+    channel_axis = Conv2dUtilities.channel_axis(inputs, data_format)
+    height_axis, width_axis = Conv2dUtilities.height_width_axis(inputs, data_format)
+    pad = (kernel_size - 1) // 2
+    
+    # All the channels are padded and shifted together. The shifted inputs are stacked right after the channel
+    # axis, such that each channel is multiplied with the same kernel and the sum runs over the innermost
+    # kernel axis, just like for a single channel.
+    padded_inputs = Conv2dUtilities.pad_equally(inputs, pad, mode=mode, data_format=data_format)
+    height = padded_inputs.shape[height_axis] - 2 * pad
+    width = padded_inputs.shape[width_axis] - 2 * pad
+    
+    inputs_stack = []
+    for i in range(kernel_size):
+      for j in range(kernel_size):
+        slices = [slice(None)] * len(padded_inputs.shape)
+        slices[height_axis] = slice(i, i + height)
+        slices[width_axis] = slice(j, j + width)
+        inputs_stack.append(padded_inputs[tuple(slices)])
+    inputs_stack = tf.stack(inputs_stack, axis=channel_axis + 1)
+    
+    kernel_inputs = tf.expand_dims(kernel_inputs, axis=channel_axis)
+    return tf.reduce_sum(tf.multiply(inputs_stack, kernel_inputs), axis=channel_axis + 1)
+
+  @staticmethod
+  def _per_channel_kernel_prediction(inputs, kernel_inputs, kernel_size, mode, data_format):
     channel_axis = Conv2dUtilities.channel_axis(inputs, data_format)
     height_axis, width_axis = Conv2dUtilities.height_width_axis(inputs, data_format)
     number_of_channels = Conv2dUtilities.number_of_channels(inputs, data_format)
     pad = (kernel_size - 1) // 2
     
-    if use_softmax:
-      kernel_inputs = tf.nn.softmax(kernel_inputs, axis=channel_axis)
     inputs_split = tf.split(inputs, number_of_channels, axis=channel_axis)
 
-    # TODO: Check whether there is a more efficient way than iterating through the channels one by one (DeepBlender)
     for index in range(number_of_channels):
       input = inputs_split[index]
       
@@ -3,6 +3,7 @@ from __future__ import division
 from __future__ import print_function
 
 import os
+import hashlib
 
 from OpenEXRDirectory import OpenEXRDirectory
 
@@ -55,12 +56,12 @@ class OpenEXRDirectories:
       if self.logger != None:
         self.logger.error(self.base_directory + ' does not have a subdirectory for ' + str(samples_per_pixel) + ' samples per pixel.')
 
-  def load_images(self, samples_per_pixel, render_passes_usage):
+  def load_images(self, samples_per_pixel, render_passes_usage, threads=1):
     if samples_per_pixel in self.samples_per_pixel_to_exr_directories:
       exr_directories = self.samples_per_pixel_to_exr_directories[samples_per_pixel]
       for index, exr_directory in enumerate(exr_directories):
         if index < self.number_of_sources_per_example:
-          exr_directory.load_images(render_passes_usage)
+          exr_directory.load_images(render_passes_usage, threads=threads)
           if not exr_directory.is_valid:
             self.is_valid = False
             break
@@ -101,6 +102,20 @@ class OpenEXRDirectories:
       for exr_directory in exr_directories:
         exr_directory.unload_images()
   
+  def fingerprint(self):
+    # Identifies the state of the exr files by their names, sizes and modification times, which is far
+    # cheaper than hashing their content.
+    fingerprint = hashlib.sha1()
+    for samples_per_pixel in sorted(self.samples_per_pixel_to_exr_directories):
+      exr_directories = self.samples_per_pixel_to_exr_directories[samples_per_pixel]
+      for exr_directory in exr_directories:
+        for exr_file in sorted(OpenEXRDirectory._exr_files(exr_directory.directory)):
+          exr_file_stat = os.stat(exr_file)
+          fingerprint.update((
+              os.path.relpath(exr_file, self.base_directory) + ' ' +
+              str(exr_file_stat.st_size) + ' ' + str(exr_file_stat.st_mtime_ns) + '\n').encode('utf-8'))
+    return fingerprint.hexdigest()
+  
   def ground_truth_samples_per_pixel(self):
     result = 0
     for samples_per_pixel in self.samples_per_pixel_to_exr_directories:
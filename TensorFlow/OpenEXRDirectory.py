@@ -3,6 +3,8 @@ from __future__ import division
 from __future__ import print_function
 
 import os
+import mmap
+import concurrent.futures
 import cv2
 import numpy as np
 
@@ -12,6 +14,7 @@ class OpenEXRDirectory:
 
   def __init__(self, directory, logger=None):
     self.directory = directory
+    self._render_pass_to_exr_files = None
     self.unload_images()
     self.logger = logger
     self.is_valid = True
@@ -27,62 +30,55 @@ class OpenEXRDirectory:
 
   def ensure_required_files_exist(self, render_passes_usage):
     required_render_passes = render_passes_usage.render_passes()
-    exr_files = OpenEXRDirectory._exr_files(self.directory)
+    render_pass_to_exr_files = self.render_pass_to_exr_files()
     for render_pass in required_render_passes:
-      render_pass_exists = False
-      is_render_pass_file_unique = True
-      for exr_file in exr_files:
-        # HACK: We add the _ to distinguish between the normal and screen space normal pass.
-        if '_' + render_pass + '_' in exr_file:
-          if render_pass_exists:
-            is_render_pass_file_unique = False
-            break
-          else:
-            render_pass_exists = True
-      if not render_pass_exists:
+      exr_files = render_pass_to_exr_files.get(render_pass, [])
+      if len(exr_files) == 0:
         self.is_valid = False
         if self.logger != None:
           self.logger.error(self.directory + ' does not contain an exr file for ' + render_pass + '.')
         break
-      if not is_render_pass_file_unique:
+      if len(exr_files) > 1:
         self.is_valid = False
         if self.logger != None:
           self.logger.error(
               'There is more than one file in ' + self.directory + ' which could be used for the ' +
               render_pass + ' pass.')
 
-  def load_images(self, render_passes_usage):
+  def render_pass_to_exr_files(self):
+    # The directory is only listed once and the index is reused afterwards.
+    if self._render_pass_to_exr_files == None:
+      self._render_pass_to_exr_files = OpenEXRDirectory._render_pass_to_exr_files_index(self.directory)
+    return self._render_pass_to_exr_files
+
+  def load_images(self, render_passes_usage, threads=1):
     self.render_passes_usage = render_passes_usage
     self.render_pass_to_image = {}
     render_passes = self.render_passes_usage.render_passes()
-    exr_files = OpenEXRDirectory._exr_files(self.directory)
+    render_pass_to_exr_files = self.render_pass_to_exr_files()
+    
+    render_pass_exr_files = []
     for render_pass in render_passes:
-      exr_loaded = False
-      for exr_file in exr_files:
-        # HACK: We add the _ to distinguish between the normal and screen space normal pass.
-        if '_' + render_pass + '_' in exr_file:
-          image = OpenEXRDirectory._load_exr(exr_file)
-          
-          # Special cases: Alpha and depth passes only have one channel.
-          if RenderPasses.number_of_channels(render_pass) == 1:
-            image = image[:, :, 0]
-          
-          self.render_pass_to_image[render_pass] = image
-
-          # Neither NaN, nor infinity is valid.
-          if not np.isfinite(image).all():
-            self.is_valid = False
-            if self.logger != None:
-              self.logger.error('There is at least one value in ' + exr_file + ' which is not finite.')
-
-          exr_loaded = True
-          break
-      if not self.is_valid:
-        break
-      
-      if not exr_loaded:
+      if not render_pass in render_pass_to_exr_files:
         # This should never happen, because we ensure_required_files_exist. (DeepBlender)
         raise Exception('Image for \'' + render_pass + '\' could not be loaded or does not exist.')
+      render_pass_exr_files.append(render_pass_to_exr_files[render_pass][0])
+    
+    images = OpenEXRDirectory._load_exrs(render_pass_exr_files, threads=threads)
+    for render_pass, exr_file, image in zip(render_passes, render_pass_exr_files, images):
+      
+      # Special cases: Alpha and depth passes only have one channel.
+      if RenderPasses.number_of_channels(render_pass) == 1:
+        image = image[:, :, 0]
+      
+      self.render_pass_to_image[render_pass] = image
+
+      # Neither NaN, nor infinity is valid.
+      if not np.isfinite(image).all():
+        self.is_valid = False
+        if self.logger != None:
+          self.logger.error('There is at least one value in ' + exr_file + ' which is not finite.')
+        break
 
   def is_loaded(self):
     return self.render_passes_usage != None
@@ -122,6 +118,35 @@ class OpenEXRDirectory:
         result.append(os.path.join(directory, filename))
     return result
 
+  @staticmethod
+  def _render_pass_to_exr_files_index(directory):
+    # The Blender scripts name the files '<blend>_<spp>_<frame>_<seed>_<render pass>_<frame number>.exr'.
+    # Render pass names don't contain an underscore, which allows to parse them directly.
+    result = {}
+    for exr_file in OpenEXRDirectory._exr_files(directory):
+      render_pass = OpenEXRDirectory._render_pass_of_exr_file(exr_file)
+      if render_pass != None:
+        if render_pass in result:
+          result[render_pass].append(exr_file)
+        else:
+          result[render_pass] = [exr_file]
+    return result
+
+  @staticmethod
+  def _render_pass_of_exr_file(exr_file):
+    filename_parts = os.path.splitext(os.path.basename(exr_file))[0].split('_')
+    if len(filename_parts) < 2:
+      return None
+    return filename_parts[-2]
+
+  @staticmethod
+  def _load_exrs(exr_paths, threads=1):
+    # OpenCV releases the GIL while decoding, which allows to overlap the reading and decoding of several files.
+    if threads <= 1 or len(exr_paths) <= 1:
+      return [OpenEXRDirectory._load_exr(exr_path) for exr_path in exr_paths]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+      return list(executor.map(OpenEXRDirectory._load_exr, exr_paths))
+
   @staticmethod
   def _load_exr(exr_path):
     try:
@@ -131,22 +156,37 @@ class OpenEXRDirectory:
 
 
       # Images have to be loaded indirectly to allow utf-8 paths.
+      # The file is memory mapped to avoid copies of the encoded bytes.
 
-      stream = open(exr_path, "rb")
-      bytes = bytearray(stream.read())
-      np_array = np.asarray(bytes, dtype=np.uint8)
-      
       image_type = cv2.IMREAD_UNCHANGED
-      image = cv2.imdecode(np_array, image_type)
+      with open(exr_path, "rb") as stream:
+        if os.fstat(stream.fileno()).st_size == 0:
+          # Empty files can't be memory mapped.
+          image = cv2.imdecode(np.fromfile(stream, dtype=np.uint8), image_type)
+        else:
+          with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as memory_map:
+            np_array = np.frombuffer(memory_map, dtype=np.uint8)
+            try:
+              image = cv2.imdecode(np_array, image_type)
+            finally:
+              # The view has to be released before the memory map can be closed.
+              del np_array
+      if image is None:
+        raise Exception('Unable to decode the exr file.')
 
       
       # REMARK: This dummy call avoids an error message (Assertion Failed)
       shape = image.shape
       
-      image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+      if len(shape) == 3 and shape[2] == 3:
+        # Swap the channels in place instead of allocating another image.
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+      else:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
       if image.dtype != 'float32':
         image = image.astype(np.float32)
     except Exception:
       # TODO: Proper error handling (DeepBlender)
       print(exr_path)
+      raise
     return image
\ No newline at end of file
@@ -3,9 +3,13 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
+import concurrent.futures
+import glob
 import os
 import sys
 import json
+import queue
+import tempfile
 
 import cv2
 import numpy as np
@@ -18,7 +22,9 @@ from Architecture import FeaturePredictionType
 
 from RenderPasses import RenderPasses
 from Naming import Naming
+from FrameContainer import FrameContainer
 from OpenEXRDirectory import OpenEXRDirectory
+from Tiling import Tiling
 
 parser = argparse.ArgumentParser(description='Prediction for the DeepDenoiser.')
 
@@ -30,6 +36,19 @@ parser.add_argument(
     '--input', type=str,
     help='Make a prediction for the files in this directory.')
 
+parser.add_argument(
+    '--inputs', type=str,
+    help='Make a prediction for all the directories matching this glob pattern.')
+
+parser.add_argument(
+    '--manifest', type=str,
+    help='Make a prediction for all the directories listed in this file, one per line. '
+         'Relative directories are relative to the directory of the file.')
+
+parser.add_argument(
+    '--recursive', action="store_true",
+    help='Make a prediction for all the directories within --input which contain exr files.')
+
 
 parser.add_argument(
     '--tile_size', default=128,
@@ -40,10 +59,40 @@ parser.add_argument(
     help='Border size of the tiles that is overlapping to avoid artifacts.')
 
 
+parser.add_argument(
+    '--tile_blending', type=str, default='crop',
+    choices=['crop', 'linear', 'cosine'],
+    help='How the overlapping borders of the tiles are combined. crop cuts them in the middle, while linear '
+         'and cosine blend the tiles with feathered weights across the overlap.')
+
+parser.add_argument(
+    '--tile_batch_size', type=int, default=8,
+    help='Number of tiles which are denoised together in one step.')
+
+parser.add_argument(
+    '--tile_feeder', type=str, default='in_memory',
+    choices=['in_memory', 'tfrecords'],
+    help='How the tiles are fed to the estimator. in_memory streams the stacked tiles without any '
+         'serialization, tfrecords goes through a temporary tfrecords file and only works for a single input.')
+
+parser.add_argument(
+    '--output_format', type=str, default='npy',
+    choices=['npy', 'npz', 'frame'],
+    help='npy stores one file per render pass, npz stores all of them in one uncompressed Prediction.npz and '
+         'frame in one Prediction.frame container, which can be memory mapped.')
+
+parser.add_argument(
+    '--combined_only', action="store_true",
+    help='Only store the combined image and not the individual render passes.')
+
 parser.add_argument(
     '--threads', default=multiprocessing.cpu_count() + 1,
     help='Number of threads to use.')
 
+parser.add_argument(
+    '--exr_loading_threads', type=int, default=8,
+    help='Number of threads which are loading the exr files concurrently.')
+
 parser.add_argument(
     '--data_format', type=str, default='channels_first',
     choices=['channels_first', 'channels_last'],
@@ -69,6 +118,16 @@ class FeatureLoader:
       #internal_source = tf.reshape(internal_source, [height, width, self.feature_prediction.number_of_channels])
       internal_source = tf.reshape(internal_source, [height, width, 3])
       self.source = internal_source
+
+  def add_to_tiles_signature(self, output_types, output_shapes, height, width):
+    if self.feature_prediction.load_data:
+      tile_name = Naming.source_feature_name(self.feature_prediction.name, index=0)
+      output_types[tile_name] = tf.float32
+      output_shapes[tile_name] = tf.TensorShape([height, width, 3])
+
+  def initialize_from_tiles(self, tiles):
+    if self.feature_prediction.load_data:
+      self.source = tiles[Naming.source_feature_name(self.feature_prediction.name, index=0)]
   
   def add_to_sources_dictionary(self, sources, height, width):
     if self.feature_prediction.load_data:
@@ -153,28 +212,63 @@ def input_fn_tfrecords(
   return features
 
 
-def slow_direct_input_fn_predict(features_list, height, width):
-  
-  dataset = None
-  for features in features_list:
-    for feature_name in features:
-      image = features[feature_name]
-      image = tf.convert_to_tensor(image, np.float32)
-      if len(image.shape) == 2:
-        image = tf.reshape(image, [-1, height, width, 1])
-      else:
-        image = tf.reshape(image, [-1, height, width, 3])
-      features[feature_name] = image
-    current_dataset = tf.data.Dataset.from_tensor_slices(features)
-    if dataset == None:
-      dataset = current_dataset
-    else:
-      dataset = dataset.concatenate(current_dataset)
+def input_fn_tiles(
+    tiles_queue, features_loader, feature_flags,
+    tiles_height_width, batch_size, threads, data_format='channels_last'):
+
+  # Each element of the queue is a dictionary of tiles, stacked per feature in arrays of shape
+  # [count, height, width, channels]. They are streamed from memory, which avoids the serialization,
+  # a temporary file and the parsing. None signals that there are no more tiles.
+  # The input only ends once that happens, which keeps the graph and the checkpoint alive in between.
+  output_types = {}
+  output_shapes = {}
+  for feature_loader in features_loader:
+    feature_loader.add_to_tiles_signature(output_types, output_shapes, tiles_height_width, tiles_height_width)
+
+  def tiles_generator():
+    while True:
+      tiles = tiles_queue.get()
+      if tiles is None:
+        break
+      
+      # The last tile is repeated to fill the last batch. This way, a batch never waits for tiles
+      # of the next queue element and all batches have the same shape.
+      tiles_count = tiles[next(iter(output_types))].shape[0]
+      padded_tiles_count = padded_count(tiles_count, batch_size)
+      for index in range(padded_tiles_count):
+        index = min(index, tiles_count - 1)
+        yield {tile_name: tiles[tile_name][index] for tile_name in output_types}
+
+  def feature_setup(tile):
+    for feature_loader in features_loader:
+      feature_loader.initialize_from_tiles(tile)
+
+    sources = {}
+    for feature_loader in features_loader:
+      feature_loader.add_to_sources_dictionary(sources, tiles_height_width, tiles_height_width)
+
+    if feature_flags != None:
+      feature_flags.add_to_source_dictionary(sources, tiles_height_width, tiles_height_width)
+
+    return sources
+
+  dataset = tf.data.Dataset.from_generator(tiles_generator, output_types, output_shapes=output_shapes)
+  dataset = dataset.map(map_func=feature_setup, num_parallel_calls=threads)
+
+  # All tiles have the same size, which allows to pack several of them into one step.
+  dataset = dataset.batch(batch_size)
+
+  prefetch_buffer_size = 5
+  dataset = dataset.prefetch(buffer_size=prefetch_buffer_size)
 
-  dataset = dataset.batch(1)
   iterator = dataset.make_one_shot_iterator()
-  result = iterator.get_next()
-  return result
+
+  features = iterator.get_next()
+  return features
+
+
+def padded_count(count, batch_size):
+  return int(math.ceil(count / batch_size)) * batch_size
 
 
 def model_fn(features, labels, mode, params):
@@ -185,338 +279,467 @@ def model_fn(features, labels, mode, params):
     return tf.estimator.EstimatorSpec(mode=mode, predictions=predictions)
 
 
-def main(parsed_arguments):
-  # Eager execution was faster, but the reason was no clear. (DeepBlender)
-  tf.enable_eager_execution()
+def create_estimator(architecture):
+  if architecture.data_format == 'channels_first':
+    use_CPU_only = False
+  else:
+    use_CPU_only = True
 
-  if not isinstance(parsed_arguments.threads, int):
-    parsed_arguments.threads = int(parsed_arguments.threads)
+  if use_CPU_only:
+    session_config = tf.ConfigProto(device_count = {'GPU': 0})
+  else:
+    session_config = tf.ConfigProto()
 
-  try:
-    architecture_json_filename = parsed_arguments.json_filename
-    architecture_json_content = open(architecture_json_filename, 'r').read()
-    parsed_architecture_json = json.loads(architecture_json_content)
-  except:
-    print('Expected a valid architecture json file.')
+  use_XLA = True
+  if use_XLA:
+    session_config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
   
-  assert os.path.isdir(parsed_arguments.input)
+  run_config = tf.estimator.RunConfig(session_config=session_config)
+  
+  estimator = tf.estimator.Estimator(
+      model_fn=model_fn,
+      model_dir=architecture.model_directory,
+      config=run_config,
+      params={'architecture': architecture})
+  return estimator
 
-  if not isinstance(parsed_arguments.tile_size, int):
-    parsed_arguments.tile_size = int(parsed_arguments.tile_size)
-  if not isinstance(parsed_arguments.tile_overlap_size, int):
-    parsed_arguments.tile_overlap_size = int(parsed_arguments.tile_overlap_size)
 
-  tile_size = parsed_arguments.tile_size
-  tile_overlap_size = parsed_arguments.tile_overlap_size
+def create_features_loader(architecture):
+  features_loader = []
+  required_features = architecture.auxiliary_features + architecture.feature_predictions
+  for feature_prediction in required_features:
+    features_loader.append(FeatureLoader(feature_prediction))
+  return features_loader
 
-  data_format = parsed_arguments.data_format
 
-  architecture = Architecture(parsed_architecture_json, source_data_format='channels_last', data_format=data_format)
-  if architecture.data_format == 'channels_first':
-    use_CPU_only = False
-  else:
-    use_CPU_only = True
+class TilePredictor:
 
-  height = None
-  width = None
+  # The estimator only builds the graph and restores the checkpoint when its predict generator is started.
+  # A single generator is kept alive and fed with the tiles through a queue, such that this only
+  # happens once for any number of predictions.
+  # If anything goes wrong during a prediction, the generator is finished or still contains predictions of the
+  # failed tiles. The predictor is marked as failed and has to be replaced by a new one.
+
+  def __init__(self, architecture, tile_size, batch_size, threads):
+    self.tile_size = tile_size
+    self.batch_size = batch_size
+    self.tiles_queue = queue.Queue()
+    self.started = False
+    self.failed = False
+    
+    estimator = create_estimator(architecture)
+    features_loader = create_features_loader(architecture)
+    self.predictions = estimator.predict(input_fn=lambda:
+        input_fn_tiles(
+            self.tiles_queue, features_loader, architecture.feature_flags,
+            self.tile_size, self.batch_size, threads))
+
+  def predict(self, tiles):
+    if self.failed:
+      raise Exception('The tile predictor failed before and can not be used anymore.')
+    self.started = True
+    try:
+      self.tiles_queue.put(tiles)
+      tiles_count = tiles[next(iter(tiles))].shape[0]
+      
+      tiled_predictions = []
+      for index in range(padded_count(tiles_count, self.batch_size)):
+        prediction = next(self.predictions)
+        if index < tiles_count:
+          tiled_predictions.append(prediction)
+    except StopIteration:
+      self.failed = True
+      raise Exception('The predictions ended unexpectedly.')
+    except:
+      self.failed = True
+      raise
+    return tiled_predictions
+
+  def close(self):
+    # Iterating a generator which was never started would only build the graph and restore the checkpoint.
+    if not self.started:
+      return
+    self.tiles_queue.put(None)
+    if self.failed:
+      self.predictions.close()
+      return
+    for _ in self.predictions:
+      pass
+
+
+def load_architecture(json_filename, data_format):
+  try:
+    architecture_json_content = open(json_filename, 'r').read()
+    parsed_architecture_json = json.loads(architecture_json_content)
+  except:
+    print('Expected a valid architecture json file.')
   
-  exr_files = OpenEXRDirectory._exr_files(parsed_arguments.input)
-  features = {}
+  architecture = Architecture(parsed_architecture_json, source_data_format='channels_last', data_format=data_format)
+  return architecture
+
+
+def load_features(input_directory, architecture, exr_loading_threads=1):
+  render_pass_to_exr_files = OpenEXRDirectory._render_pass_to_exr_files_index(input_directory)
+  feature_names = []
+  feature_exr_files = []
   required_features = architecture.auxiliary_features + architecture.feature_predictions
   for feature_prediction in required_features:
     exr_loaded = False
 
     if feature_prediction.load_data:
-      for exr_file in exr_files:
-        if feature_prediction.name in exr_file:
-          image = OpenEXRDirectory._load_exr(exr_file)
-          
-          # HACK: Assume just one source input!
-          features[Naming.source_feature_name(feature_prediction.name, index=0)] = image
-          exr_loaded = True
-          
-          if height == None:
-            height = image.shape[0]
-            width = image.shape[1]
-          else:
-            assert height == image.shape[0]
-            assert width == image.shape[1]
-          break
+      exr_files = render_pass_to_exr_files.get(feature_prediction.name, [])
+      if len(exr_files) > 1:
+        raise Exception(
+            'There is more than one file in ' + input_directory + ' which could be used for \'' +
+            feature_prediction.name + '\'.')
+      if len(exr_files) == 1:
+        # HACK: Assume just one source input!
+        feature_names.append(Naming.source_feature_name(feature_prediction.name, index=0))
+        feature_exr_files.append(exr_files[0])
+        exr_loaded = True
 
     else:
-      image = tf.ones([height, width, feature_prediction.number_of_channels])
-      if feature_prediction.feature_prediction_type != FeaturePredictionType.COLOR:
-        # Direct and indirect need to be 0.5.
-        image = tf.scalar_mul(0.5, image)
-      features[Naming.source_feature_name(feature_prediction.name, index=0)] = image
+      # The FeatureLoader provides the constant source for features which are not loaded.
       exr_loaded = True
     
     if not exr_loaded:
       # TODO: Improve (DeepBlender)
       raise Exception('Image for \'' + feature_prediction.name + '\' could not be loaded or does not exist.')
 
+  height = None
+  width = None
+  features = {}
+  images = OpenEXRDirectory._load_exrs(feature_exr_files, threads=exr_loading_threads)
+  for feature_name, image in zip(feature_names, images):
+    features[feature_name] = image
+    if height == None:
+      height = image.shape[0]
+      width = image.shape[1]
+    else:
+      assert height == image.shape[0]
+      assert width == image.shape[1]
 
   smaller_side_length = min(height, width)
   if smaller_side_length < 16:
     raise Exception('The image needs to have at least a side length of 16 pixels.')
-  
-  if smaller_side_length < tile_size:
-    ratio = tile_overlap_size / tile_size
-    tile_size = smaller_side_length
-    tile_overlap_size = int(tile_size * ratio)
 
+  return features, height, width
 
-  # Split the images into tiles.
-  iteration_delta = tile_size - (2 * tile_overlap_size)
 
-  width_count = width - (2 * tile_overlap_size) - (2 * iteration_delta)
-  width_count = width_count / iteration_delta
-  width_count = math.ceil(width_count) + 2
+def stitch_predictions(
+    tiled_predictions, architecture, height, width, tiles_bounds,
+    height_count, width_count, tile_size, tile_overlap_size, tile_blending='crop'):
+  prediction_names = []
+  for feature_prediction_tuple in architecture.feature_prediction_tuples:
+    for feature_prediction in feature_prediction_tuple.feature_predictions:
+      if feature_prediction.load_data:
+        prediction_names.append(Naming.feature_prediction_name(feature_prediction.name))
+  return Tiling.stitch(
+      tiled_predictions, prediction_names, height, width, tiles_bounds,
+      height_count, width_count, tile_size, tile_overlap_size, tile_blending)
 
-  height_count = height - (2 * tile_overlap_size) - (2 * iteration_delta)
-  height_count = height_count / iteration_delta
-  height_count = math.ceil(height_count) + 2
 
-  tiled_features_grid = [[None for _ in range(width_count) ] for _ in range(height_count)]
+class PredictionOutput:
 
-  for height_index in range(height_count):
-    if height_index == 0:
-      lower_height = 0
-      upper_height = tile_size
-    elif height_index == height_count - 1:
-      upper_height = height
-      lower_height = upper_height - tile_size
-    else:
-      lower_height = height_index * iteration_delta
-      upper_height = lower_height + tile_size
+  NPZ_FILENAME = 'Prediction.npz'
+  FRAME_FILENAME = 'Prediction' + FrameContainer.EXTENSION
+
+  def __init__(self, output_format='npy', combined_only=False):
+    self.output_format = output_format
+    self.combined_only = combined_only
+
+  def combine_and_save(self, predictions, output_directory):
+    diffuse_direct = predictions[Naming.feature_prediction_name(RenderPasses.DIFFUSE_DIRECT)]
+    diffuse_indirect = predictions[Naming.feature_prediction_name(RenderPasses.DIFFUSE_INDIRECT)]
+    diffuse_color = predictions[Naming.feature_prediction_name(RenderPasses.DIFFUSE_COLOR)]
     
-    for width_index in range(width_count):
-      if width_index == 0:
-        lower_width = 0
-        upper_width = tile_size
-      elif width_index == width_count - 1:
-        upper_width = width
-        lower_width = upper_width - tile_size
-      else:
-        lower_width = width_index * iteration_delta
-        upper_width = lower_width + tile_size
-
-      tiled_features = {}
-      for feature_name in features:
-        feature = features[feature_name]
-        tiled_feature = feature[lower_height:upper_height, lower_width:upper_width]
-        tiled_features[feature_name] = tiled_feature
-
-      tiled_features_grid[height_index][width_index] = tiled_features
-  
-  # We don't need the features anymore.
-  features = None
+    glossy_direct = predictions[Naming.feature_prediction_name(RenderPasses.GLOSSY_DIRECT)]
+    glossy_indirect = predictions[Naming.feature_prediction_name(RenderPasses.GLOSSY_INDIRECT)]
+    glossy_color = predictions[Naming.feature_prediction_name(RenderPasses.GLOSSY_COLOR)]
+    
+    subsurface_direct = predictions[Naming.feature_prediction_name(RenderPasses.SUBSURFACE_DIRECT)]
+    subsurface_indirect = predictions[Naming.feature_prediction_name(RenderPasses.SUBSURFACE_INDIRECT)]
+    subsurface_color = predictions[Naming.feature_prediction_name(RenderPasses.SUBSURFACE_COLOR)]
+    
+    transmission_direct = predictions[Naming.feature_prediction_name(RenderPasses.TRANSMISSION_DIRECT)]
+    transmission_indirect = predictions[Naming.feature_prediction_name(RenderPasses.TRANSMISSION_INDIRECT)]
+    transmission_color = predictions[Naming.feature_prediction_name(RenderPasses.TRANSMISSION_COLOR)]
+    
+    volume_direct = predictions[Naming.feature_prediction_name(RenderPasses.VOLUME_DIRECT)]
+    volume_indirect = predictions[Naming.feature_prediction_name(RenderPasses.VOLUME_INDIRECT)]
 
-  
-  # Directly predicting the results by creating a dataset from the tiled features resulted
-  # in a huge computational overhead.
-  # Converting the tiled features to tfrecords and predicting with a tfrecords dataset
-  # is a questionable approach, but it is significantly faster.
-  use_tfrecords = True
-
-  if use_tfrecords:
-    temporary_tfrecords_filename = './tmp.tfrecords'
-    tfrecords_writer =  tf.python_io.TFRecordWriter(temporary_tfrecords_filename)
-    for height_index in range(height_count):
-      for width_index in range(width_count):
-        tiled_features = tiled_features_grid[height_index][width_index]
-        serializable_features = {}
-
-        for tiled_feature_name in tiled_features:
-          tiled_feature = tiled_features[tiled_feature_name]
-          tiled_feature = tf.train.Feature(
-              bytes_list=tf.train.BytesList(value=[tf.compat.as_bytes(tiled_feature.tostring())]))
-          serializable_features[tiled_feature_name] = tiled_feature
-
-        example = tf.train.Example(features=tf.train.Features(feature=serializable_features))
-        tfrecords_writer.write(example.SerializeToString())
-    tfrecords_writer.close()
+    environment = predictions[Naming.feature_prediction_name(RenderPasses.ENVIRONMENT)]
+    emission = predictions[Naming.feature_prediction_name(RenderPasses.EMISSION)]
 
-  if use_CPU_only:
-    session_config = tf.ConfigProto(device_count = {'GPU': 0})
-  else:
-    session_config = tf.ConfigProto()
+    alpha = predictions[Naming.feature_prediction_name(RenderPasses.ALPHA)]
 
-  use_XLA = True
-  if use_XLA:
-    session_config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
-  
-  run_config = tf.estimator.RunConfig(session_config=session_config)
-  
-  estimator = tf.estimator.Estimator(
-      model_fn=model_fn,
-      model_dir=architecture.model_directory,
-      config=run_config,
-      params={'architecture': architecture})
-  
-  if use_tfrecords:
-    features_loader = []
-    required_features = architecture.auxiliary_features + architecture.feature_predictions
-    for feature_prediction in required_features:
-      features_loader.append(FeatureLoader(feature_prediction))
 
-    tfrecords_files = [os.path.abspath(temporary_tfrecords_filename)]
-    batch_size = 1
-    threads = 1
-    predictions = estimator.predict(input_fn=lambda: 
-        input_fn_tfrecords(
-            tfrecords_files, features_loader, architecture.feature_flags,
-            tile_size, batch_size, threads))
-  else:
-    tiled_features_list = []
-    for height_index in range(height_count):
-      for width_index in range(width_count):
-        tiled_features = tiled_features_grid[height_index][width_index]
-        tiled_features_list.append(tiled_features)
+    # Combined features
+    diffuse = np.multiply(diffuse_color, np.add(diffuse_direct, diffuse_indirect))
+    glossy = np.multiply(glossy_color, np.add(glossy_direct, glossy_indirect))
+    subsurface = np.multiply(subsurface_color, np.add(subsurface_direct, subsurface_indirect))
+    transmission = np.multiply(transmission_color, np.add(transmission_direct, transmission_indirect))
+    
+    # Combined image
+    image = np.add(diffuse, glossy)
+    image = np.add(image, subsurface)
+    image = np.add(image, transmission)
+    image = np.add(image, volume_direct)
+    image = np.add(image, volume_indirect)
+    image = np.add(image, environment)
+    image = np.add(image, emission)
+    
+    
+    # TODO: Alpha currently ignored for the combined image. (DeepBlender)
+
+    outputs = {}
+    outputs[RenderPasses.COMBINED] = image
+
+    if not self.combined_only:
+      outputs[RenderPasses.DIFFUSE_DIRECT] = diffuse_direct
+      outputs[RenderPasses.DIFFUSE_INDIRECT] = diffuse_indirect
+      outputs[RenderPasses.DIFFUSE_COLOR] = diffuse_color
+
+      outputs[RenderPasses.GLOSSY_DIRECT] = glossy_direct
+      outputs[RenderPasses.GLOSSY_INDIRECT] = glossy_indirect
+      outputs[RenderPasses.GLOSSY_COLOR] = glossy_color
+
+      outputs[RenderPasses.SUBSURFACE_DIRECT] = subsurface_direct
+      outputs[RenderPasses.SUBSURFACE_INDIRECT] = subsurface_indirect
+      outputs[RenderPasses.SUBSURFACE_COLOR] = subsurface_color
+
+      outputs[RenderPasses.TRANSMISSION_DIRECT] = transmission_direct
+      outputs[RenderPasses.TRANSMISSION_INDIRECT] = transmission_indirect
+      outputs[RenderPasses.TRANSMISSION_COLOR] = transmission_color
+
+      outputs[RenderPasses.VOLUME_DIRECT] = volume_direct
+      outputs[RenderPasses.VOLUME_INDIRECT] = volume_indirect
+
+      outputs[RenderPasses.ENVIRONMENT] = environment
+      outputs[RenderPasses.EMISSION] = emission
+      
+      outputs[RenderPasses.ALPHA] = alpha
+
+    if self.output_format == 'npz':
+      # One uncompressed file, in which each render pass is stored under its name.
+      np.savez(output_directory + '/' + PredictionOutput.NPZ_FILENAME, **outputs)
+    elif self.output_format == 'frame':
+      # One uncompressed file with a header, such that each render pass can be memory mapped.
+      FrameContainer.write(output_directory + '/' + PredictionOutput.FRAME_FILENAME, outputs)
+    else:
+      # Store as npy to open in Blender.
+      for render_pass in outputs:
+        np.save(output_directory + '/' + render_pass + '.npy', outputs[render_pass])
 
-    predictions = estimator.predict(input_fn=lambda:
-        slow_direct_input_fn_predict(tiled_features_list, tile_size, tile_size))
 
-  for height_index in range(height_count):
-    for width_index in range(width_count):
-      tiled_features_grid[height_index][width_index] = next(predictions)
+    # HACK: Temporary output as png. (DeepBlender)
+    # image = 255. * image
+    # image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    # cv2.imwrite(output_directory + '/combined.png', image, [int(cv2.IMWRITE_PNG_COMPRESSION), 9])
 
-  predictions = {}
-  for feature_prediction_tuple in architecture.feature_prediction_tuples:
-    for feature_prediction in feature_prediction_tuple.feature_predictions:
-      if feature_prediction.load_data:
-        horizontal_feature_stripes = []
-        for height_index in range(height_count):
-          horizontal_feature_elements = []
-          for width_index in range(width_count):
-            tiled_predictions = tiled_features_grid[height_index][width_index]
-            prediction_name = Naming.feature_prediction_name(feature_prediction.name)
-            prediction = tiled_predictions[prediction_name]
-
-            lower_height = 0
-            upper_height = tile_size
-            lower_width = 0
-            upper_width = tile_size
-
-            if width_index != 0 and width_index != width_count - 1:
-              lower_width = tile_overlap_size
-              upper_width = upper_width - tile_overlap_size
-            elif width_index == 0 and width_index == width_count - 1:
-              pass
-            elif width_index == 0:
-              upper_width = upper_width - tile_overlap_size
-            else:
-              assert width_index == width_count - 1
-              existing_width = tile_overlap_size + ((width_count - 1) * (tile_size - (2 * tile_overlap_size)))
-              remaining_width = width - existing_width
-              lower_width = upper_width - remaining_width
-            
-            if height_index != 0 and height_index != height_count - 1:
-              lower_height = tile_overlap_size
-              upper_height = upper_height - tile_overlap_size
-            elif height_index == 0 and height_index == height_count - 1:
-              pass
-            elif height_index == 0:
-              upper_height = upper_height - tile_overlap_size
-            else:
-              assert height_index == height_count - 1
-              existing_height = tile_overlap_size + ((height_count - 1) * (tile_size - (2 * tile_overlap_size)))
-              remaining_height = height - existing_height
-              lower_height = upper_height - remaining_height
-
-            prediction = prediction[lower_height:upper_height, lower_width:upper_width]
-
-            horizontal_feature_elements.append(prediction)
-          if len(horizontal_feature_elements) > 1:
-            horizontal_feature_stripe = np.concatenate(horizontal_feature_elements, 1)
-          else:
-            horizontal_feature_stripe = horizontal_feature_elements[0]
-          horizontal_feature_stripes.append(horizontal_feature_stripe)
-        
-        if len(horizontal_feature_stripes) > 1:
-          prediction = np.concatenate(horizontal_feature_stripes, 0)
-        else:
-          prediction = horizontal_feature_stripes[0]
-        prediction_name = Naming.feature_prediction_name(feature_prediction.name)
-        predictions[prediction_name] = prediction
-
-  diffuse_direct = predictions[Naming.feature_prediction_name(RenderPasses.DIFFUSE_DIRECT)]
-  diffuse_indirect = predictions[Naming.feature_prediction_name(RenderPasses.DIFFUSE_INDIRECT)]
-  diffuse_color = predictions[Naming.feature_prediction_name(RenderPasses.DIFFUSE_COLOR)]
-  
-  glossy_direct = predictions[Naming.feature_prediction_name(RenderPasses.GLOSSY_DIRECT)]
-  glossy_indirect = predictions[Naming.feature_prediction_name(RenderPasses.GLOSSY_INDIRECT)]
-  glossy_color = predictions[Naming.feature_prediction_name(RenderPasses.GLOSSY_COLOR)]
-  
-  subsurface_direct = predictions[Naming.feature_prediction_name(RenderPasses.SUBSURFACE_DIRECT)]
-  subsurface_indirect = predictions[Naming.feature_prediction_name(RenderPasses.SUBSURFACE_INDIRECT)]
-  subsurface_color = predictions[Naming.feature_prediction_name(RenderPasses.SUBSURFACE_COLOR)]
+
+class TiledFrame:
+
+  def __init__(self, directory, tiles, height, width, tiles_bounds, height_count, width_count):
+    self.directory = directory
+    self.tiles = tiles
+    self.tiles_bounds = tiles_bounds
+    self.height = height
+    self.width = width
+    self.height_count = height_count
+    self.width_count = width_count
+
+
+def load_tiled_frame(input_directory, architecture, tile_size, tile_overlap_size, exr_loading_threads=1):
+  features, height, width = load_features(input_directory, architecture, exr_loading_threads)
+  if min(height, width) < tile_size:
+    raise Exception(
+        'The image in ' + input_directory + ' needs to have at least a side length of ' +
+        str(tile_size) + ' pixels.')
+
+  tiles_bounds, height_count, width_count = Tiling.bounds_and_counts(height, width, tile_size, tile_overlap_size)
+  tiles = Tiling.split(features, tiles_bounds)
+  return TiledFrame(input_directory, tiles, height, width, tiles_bounds, height_count, width_count)
+
+
+def predict_tiled_frame(
+    tiled_frame, architecture, tile_predictor, prediction_output,
+    tile_size, tile_overlap_size, tile_blending='crop'):
+  tiled_predictions = tile_predictor.predict(tiled_frame.tiles)
   
-  transmission_direct = predictions[Naming.feature_prediction_name(RenderPasses.TRANSMISSION_DIRECT)]
-  transmission_indirect = predictions[Naming.feature_prediction_name(RenderPasses.TRANSMISSION_INDIRECT)]
-  transmission_color = predictions[Naming.feature_prediction_name(RenderPasses.TRANSMISSION_COLOR)]
+  # We don't need the tiles anymore.
+  tiled_frame.tiles = None
   
-  volume_direct = predictions[Naming.feature_prediction_name(RenderPasses.VOLUME_DIRECT)]
-  volume_indirect = predictions[Naming.feature_prediction_name(RenderPasses.VOLUME_INDIRECT)]
+  predictions = stitch_predictions(
+      tiled_predictions, architecture, tiled_frame.height, tiled_frame.width, tiled_frame.tiles_bounds,
+      tiled_frame.height_count, tiled_frame.width_count, tile_size, tile_overlap_size, tile_blending)
+  prediction_output.combine_and_save(predictions, tiled_frame.directory)
 
-  environment = predictions[Naming.feature_prediction_name(RenderPasses.ENVIRONMENT)]
-  emission = predictions[Naming.feature_prediction_name(RenderPasses.EMISSION)]
 
-  alpha = predictions[Naming.feature_prediction_name(RenderPasses.ALPHA)]
+def predict_directory(
+    input_directory, architecture, tile_predictor, prediction_output,
+    tile_size, tile_overlap_size, tile_blending='crop', exr_loading_threads=1):
+  tiled_frame = load_tiled_frame(input_directory, architecture, tile_size, tile_overlap_size, exr_loading_threads)
+  predict_tiled_frame(
+      tiled_frame, architecture, tile_predictor, prediction_output,
+      tile_size, tile_overlap_size, tile_blending)
 
 
-  # Combined features
-  diffuse = np.multiply(diffuse_color, np.add(diffuse_direct, diffuse_indirect))
-  glossy = np.multiply(glossy_color, np.add(glossy_direct, glossy_indirect))
-  subsurface = np.multiply(subsurface_color, np.add(subsurface_direct, subsurface_indirect))
-  transmission = np.multiply(transmission_color, np.add(transmission_direct, transmission_indirect))
+def predict_directories(
+    input_directories, architecture, tile_predictor, prediction_output,
+    tile_size, tile_overlap_size, tile_blending='crop', exr_loading_threads=1):
   
-  # Combined image
-  image = np.add(diffuse, glossy)
-  image = np.add(image, subsurface)
-  image = np.add(image, transmission)
-  image = np.add(image, volume_direct)
-  image = np.add(image, volume_indirect)
-  image = np.add(image, environment)
-  image = np.add(image, emission)
+  # The next frame is loaded in the background, while the current one is predicted.
+  with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+    next_tiled_frame = executor.submit(
+        load_tiled_frame, input_directories[0], architecture, tile_size, tile_overlap_size, exr_loading_threads)
+    for index, input_directory in enumerate(input_directories):
+      try:
+        tiled_frame = next_tiled_frame.result()
+      except Exception as exception:
+        tiled_frame = None
+        print('Unable to load ' + input_directory + ': ' + str(exception))
+      
+      if index + 1 < len(input_directories):
+        next_tiled_frame = executor.submit(
+            load_tiled_frame, input_directories[index + 1], architecture,
+            tile_size, tile_overlap_size, exr_loading_threads)
+      
+      if tiled_frame != None:
+        predict_tiled_frame(
+            tiled_frame, architecture, tile_predictor, prediction_output,
+            tile_size, tile_overlap_size, tile_blending)
+        print('Predicted ' + input_directory + ' (' + str(index + 1) + '/' + str(len(input_directories)) + ').')
+
+
+def input_directories_from_arguments(parsed_arguments):
+  input_directories = []
+  if parsed_arguments.inputs != None:
+    for input_directory in sorted(glob.glob(parsed_arguments.inputs)):
+      if os.path.isdir(input_directory):
+        input_directories.append(input_directory)
   
+  if parsed_arguments.manifest != None:
+    absolute_manifest_directory = os.path.dirname(os.path.abspath(parsed_arguments.manifest))
+    with open(parsed_arguments.manifest, 'r', encoding='utf-8') as manifest_file:
+      for line in manifest_file:
+        input_directory = line.strip()
+        if input_directory == '':
+          continue
+        if not os.path.isabs(input_directory):
+          input_directory = os.path.join(absolute_manifest_directory, input_directory)
+        assert os.path.isdir(input_directory)
+        input_directories.append(input_directory)
   
-  # TODO: Alpha currently ignored for the combined image. (DeepBlender)
+  if parsed_arguments.recursive:
+    assert os.path.isdir(parsed_arguments.input)
+    for directory, _, filenames in sorted(os.walk(parsed_arguments.input)):
+      for filename in filenames:
+        if filename.endswith('.exr'):
+          input_directories.append(directory)
+          break
+  
+  return input_directories
+
+
+def main(parsed_arguments):
+  # Eager execution was faster, but the reason was no clear. (DeepBlender)
+  tf.enable_eager_execution()
 
-  # Store as npy to open in Blender.
-  np.save(parsed_arguments.input + '/' + RenderPasses.COMBINED + '.npy', image)
+  if not isinstance(parsed_arguments.threads, int):
+    parsed_arguments.threads = int(parsed_arguments.threads)
 
-  np.save(parsed_arguments.input + '/' + RenderPasses.DIFFUSE_DIRECT + '.npy', diffuse_direct)
-  np.save(parsed_arguments.input + '/' + RenderPasses.DIFFUSE_INDIRECT + '.npy', diffuse_indirect)
-  np.save(parsed_arguments.input + '/' + RenderPasses.DIFFUSE_COLOR + '.npy', diffuse_color)
+  if not isinstance(parsed_arguments.tile_size, int):
+    parsed_arguments.tile_size = int(parsed_arguments.tile_size)
+  if not isinstance(parsed_arguments.tile_overlap_size, int):
+    parsed_arguments.tile_overlap_size = int(parsed_arguments.tile_overlap_size)
+  if parsed_arguments.tile_batch_size < 1:
+    raise Exception('The tile batch size needs to be at least 1.')
 
-  np.save(parsed_arguments.input + '/' + RenderPasses.GLOSSY_DIRECT + '.npy', glossy_direct)
-  np.save(parsed_arguments.input + '/' + RenderPasses.GLOSSY_INDIRECT + '.npy', glossy_indirect)
-  np.save(parsed_arguments.input + '/' + RenderPasses.GLOSSY_COLOR + '.npy', glossy_color)
+  tile_size = parsed_arguments.tile_size
+  tile_overlap_size = parsed_arguments.tile_overlap_size
+  batch_size = parsed_arguments.tile_batch_size
+  tile_blending = parsed_arguments.tile_blending
+  threads = parsed_arguments.threads
+  exr_loading_threads = parsed_arguments.exr_loading_threads
+  prediction_output = PredictionOutput(parsed_arguments.output_format, parsed_arguments.combined_only)
+
+  architecture = load_architecture(parsed_arguments.json_filename, parsed_arguments.data_format)
+
+  is_sequence = (
+      parsed_arguments.inputs != None or parsed_arguments.manifest != None or parsed_arguments.recursive)
+  if is_sequence:
+    # The tfrecords feeder would restore the model for every frame.
+    if parsed_arguments.tile_feeder != 'in_memory':
+      raise Exception('Several directories can only be predicted with the in_memory tile feeder.')
+    
+    input_directories = input_directories_from_arguments(parsed_arguments)
+    if len(input_directories) == 0:
+      raise Exception('There are no directories to make a prediction for.')
+    
+    # All the frames share one predictor, which requires the same tile size for all of them.
+    tile_predictor = TilePredictor(architecture, tile_size, batch_size, threads)
+    predict_directories(
+        input_directories, architecture, tile_predictor, prediction_output,
+        tile_size, tile_overlap_size, tile_blending, exr_loading_threads)
+    tile_predictor.close()
+    return
 
-  np.save(parsed_arguments.input + '/' + RenderPasses.SUBSURFACE_DIRECT + '.npy', subsurface_direct)
-  np.save(parsed_arguments.input + '/' + RenderPasses.SUBSURFACE_INDIRECT + '.npy', subsurface_indirect)
-  np.save(parsed_arguments.input + '/' + RenderPasses.SUBSURFACE_COLOR + '.npy', subsurface_color)
+  assert os.path.isdir(parsed_arguments.input)
 
-  np.save(parsed_arguments.input + '/' + RenderPasses.TRANSMISSION_DIRECT + '.npy', transmission_direct)
-  np.save(parsed_arguments.input + '/' + RenderPasses.TRANSMISSION_INDIRECT + '.npy', transmission_indirect)
-  np.save(parsed_arguments.input + '/' + RenderPasses.TRANSMISSION_COLOR + '.npy', transmission_color)
+  features, height, width = load_features(parsed_arguments.input, architecture, exr_loading_threads)
 
-  np.save(parsed_arguments.input + '/' + RenderPasses.VOLUME_DIRECT + '.npy', volume_direct)
-  np.save(parsed_arguments.input + '/' + RenderPasses.VOLUME_INDIRECT + '.npy', volume_indirect)
+  smaller_side_length = min(height, width)
+  if smaller_side_length < tile_size:
+    ratio = tile_overlap_size / tile_size
+    tile_size = smaller_side_length
+    tile_overlap_size = int(tile_size * ratio)
 
-  np.save(parsed_arguments.input + '/' + RenderPasses.ENVIRONMENT + '.npy', environment)
-  np.save(parsed_arguments.input + '/' + RenderPasses.EMISSION + '.npy', emission)
+  tiles_bounds, height_count, width_count = Tiling.bounds_and_counts(height, width, tile_size, tile_overlap_size)
+  tiles = Tiling.split(features, tiles_bounds)
   
-  np.save(parsed_arguments.input + '/' + RenderPasses.ALPHA + '.npy', alpha)
+  # We don't need the features anymore.
+  features = None
 
+  tile_feeder = parsed_arguments.tile_feeder
+
+  if tile_feeder == 'tfrecords':
+    # A unique temporary file, such that several predictions can run in the same working directory.
+    temporary_tfrecords_file_descriptor, temporary_tfrecords_filename = tempfile.mkstemp(suffix='.tfrecords')
+    os.close(temporary_tfrecords_file_descriptor)
+    tfrecords_writer =  tf.python_io.TFRecordWriter(temporary_tfrecords_filename)
+    for tile_index in range(len(tiles_bounds)):
+      serializable_features = {}
+
+      for tile_name in tiles:
+        tile = tiles[tile_name][tile_index]
+        tile = tf.train.Feature(
+            bytes_list=tf.train.BytesList(value=[tf.compat.as_bytes(tile.tostring())]))
+        serializable_features[tile_name] = tile
+
+      example = tf.train.Example(features=tf.train.Features(feature=serializable_features))
+      tfrecords_writer.write(example.SerializeToString())
+    tfrecords_writer.close()
+
+    estimator = create_estimator(architecture)
+    features_loader = create_features_loader(architecture)
+    tfrecords_files = [os.path.abspath(temporary_tfrecords_filename)]
+    predictions = estimator.predict(input_fn=lambda: 
+        input_fn_tfrecords(
+            tfrecords_files, features_loader, architecture.feature_flags,
+            tile_size, batch_size, threads))
+    tiled_predictions = [next(predictions) for _ in tiles_bounds]
+  else:
+    tile_predictor = TilePredictor(architecture, tile_size, batch_size, threads)
+    tiled_predictions = tile_predictor.predict(tiles)
+    tile_predictor.close()
 
-  # HACK: Temporary output as png. (DeepBlender)
-  # image = 255. * image
-  # image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-  # cv2.imwrite(parsed_arguments.input + '/combined.png', image, [int(cv2.IMWRITE_PNG_COMPRESSION), 9])
+  predictions = stitch_predictions(
+      tiled_predictions, architecture, height, width, tiles_bounds,
+      height_count, width_count, tile_size, tile_overlap_size, tile_blending)
+  prediction_output.combine_and_save(predictions, parsed_arguments.input)
 
-  if use_tfrecords:
+  if tile_feeder == 'tfrecords':
     os.remove(temporary_tfrecords_filename)
 
 if __name__ == '__main__':
@@ -0,0 +1,161 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import socketserver
+
+import tensorflow as tf
+import multiprocessing
+
+import Prediction
+from Prediction import TilePredictor
+from Prediction import PredictionOutput
+
+parser = argparse.ArgumentParser(description='Prediction server for the DeepDenoiser.')
+
+parser.add_argument(
+    'json_filename',
+    help='The json specifying all the relevant details.')
+
+parser.add_argument(
+    '--host', type=str, default='localhost',
+    help='Host name on which the server is listening.')
+
+parser.add_argument(
+    '--port', type=int, default=8642,
+    help='Port on which the server is listening.')
+
+parser.add_argument(
+    '--tile_size', type=int, default=128,
+    help='Width and heights of the tiles into which the image is split before denoising.')
+
+parser.add_argument(
+    '--tile_overlap_size', type=int, default=14,
+    help='Border size of the tiles that is overlapping to avoid artifacts.')
+
+parser.add_argument(
+    '--tile_blending', type=str, default='crop',
+    choices=['crop', 'linear', 'cosine'],
+    help='How the overlapping borders of the tiles are combined. crop cuts them in the middle, while linear '
+         'and cosine blend the tiles with feathered weights across the overlap.')
+
+parser.add_argument(
+    '--tile_batch_size', type=int, default=8,
+    help='Number of tiles which are denoised together in one step.')
+
+parser.add_argument(
+    '--output_format', type=str, default='npy',
+    choices=['npy', 'npz', 'frame'],
+    help='npy stores one file per render pass, npz stores all of them in one uncompressed Prediction.npz and '
+         'frame in one Prediction.frame container, which can be memory mapped.')
+
+parser.add_argument(
+    '--combined_only', action="store_true",
+    help='Only store the combined image and not the individual render passes.')
+
+parser.add_argument(
+    '--threads', type=int, default=multiprocessing.cpu_count() + 1,
+    help='Number of threads to use.')
+
+parser.add_argument(
+    '--exr_loading_threads', type=int, default=8,
+    help='Number of threads which are loading the exr files concurrently.')
+
+parser.add_argument(
+    '--data_format', type=str, default='channels_first',
+    choices=['channels_first', 'channels_last'],
+    help='A flag to override the data format used in the model. channels_first '
+         'provides a performance boost on GPU but is not always compatible '
+         'with CPU. If left unspecified, the data format will be chosen '
+         'automatically based on whether TensorFlow was built for CPU or GPU.')
+
+
+class PredictionServer(socketserver.TCPServer):
+
+  # The model is loaded once and kept alive for all the jobs.
+  # A job is a line containing a directory with the exr files of a frame. The predictions are stored in
+  # that directory and the server answers with a line starting with 'done' or 'error'.
+  # Connections are handled one after the other, such that only one job is predicted at a time.
+  # If a job fails within the tile predictor, it is replaced by a new one, such that the following jobs
+  # still work.
+
+  allow_reuse_address = True
+
+  def __init__(
+      self, server_address, architecture, prediction_output,
+      tile_size, tile_overlap_size, tile_blending, tile_batch_size, threads, exr_loading_threads):
+    self.architecture = architecture
+    self.prediction_output = prediction_output
+    self.tile_size = tile_size
+    self.tile_overlap_size = tile_overlap_size
+    self.tile_blending = tile_blending
+    self.exr_loading_threads = exr_loading_threads
+    self.tile_batch_size = tile_batch_size
+    self.threads = threads
+    self.tile_predictor = self._create_tile_predictor()
+    socketserver.TCPServer.__init__(self, server_address, PredictionRequestHandler)
+
+  def predict_directory(self, input_directory):
+    try:
+      Prediction.predict_directory(
+          input_directory, self.architecture, self.tile_predictor, self.prediction_output,
+          self.tile_size, self.tile_overlap_size, self.tile_blending, self.exr_loading_threads)
+    finally:
+      if self.tile_predictor.failed:
+        self.tile_predictor.close()
+        self.tile_predictor = self._create_tile_predictor()
+
+  def server_close(self):
+    socketserver.TCPServer.server_close(self)
+    self.tile_predictor.close()
+
+  def _create_tile_predictor(self):
+    return TilePredictor(self.architecture, self.tile_size, self.tile_batch_size, self.threads)
+
+
+class PredictionRequestHandler(socketserver.StreamRequestHandler):
+
+  def handle(self):
+    for line in self.rfile:
+      input_directory = line.decode('utf-8').strip()
+      if input_directory == '':
+        continue
+
+      try:
+        if not os.path.isdir(input_directory):
+          raise Exception('Directory does not exist: ' + input_directory)
+        self.server.predict_directory(input_directory)
+        response = 'done ' + input_directory
+      except Exception as exception:
+        response = 'error ' + input_directory + ': ' + str(exception)
+      print(response)
+      self.wfile.write((response + '\n').encode('utf-8'))
+
+
+def main(parsed_arguments):
+  # Eager execution was faster, but the reason was no clear. (DeepBlender)
+  tf.enable_eager_execution()
+
+  if parsed_arguments.tile_batch_size < 1:
+    raise Exception('The tile batch size needs to be at least 1.')
+
+  architecture = Prediction.load_architecture(parsed_arguments.json_filename, parsed_arguments.data_format)
+  prediction_output = PredictionOutput(parsed_arguments.output_format, parsed_arguments.combined_only)
+
+  server = PredictionServer(
+      (parsed_arguments.host, parsed_arguments.port), architecture, prediction_output, parsed_arguments.tile_size,
+      parsed_arguments.tile_overlap_size, parsed_arguments.tile_blending, parsed_arguments.tile_batch_size,
+      parsed_arguments.threads, parsed_arguments.exr_loading_threads)
+  print('Listening on ' + parsed_arguments.host + ':' + str(parsed_arguments.port) + '.')
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+
+if __name__ == '__main__':
+  parsed_arguments, unparsed = parser.parse_known_args()
+  main(parsed_arguments)
@@ -0,0 +1,86 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+class RenderPassesPrecision:
+
+  # Precision in which each render pass is stored in the tfrecords and tile containers. float32 keeps the values
+  # as they are, float16 halves the size. log_float16 stores sign(x) * log1p(|x|) as float16, which keeps the
+  # relative precision of the high dynamic range direct and indirect passes.
+  # Render passes which are not listed are stored as float32. The values are always upcast to float32 on load.
+
+  FLOAT32 = 'float32'
+  FLOAT16 = 'float16'
+  LOG_FLOAT16 = 'log_float16'
+  PRECISIONS = [FLOAT32, FLOAT16, LOG_FLOAT16]
+
+  def __init__(self, render_pass_to_precision=None):
+    if render_pass_to_precision == None:
+      render_pass_to_precision = {}
+    for render_pass in render_pass_to_precision:
+      if render_pass_to_precision[render_pass] not in RenderPassesPrecision.PRECISIONS:
+        raise Exception(
+            'Unknown precision ' + str(render_pass_to_precision[render_pass]) + ' for ' + render_pass + '.')
+    self.render_pass_to_precision = render_pass_to_precision
+
+  def precision(self, render_pass):
+    return self.render_pass_to_precision.get(render_pass, RenderPassesPrecision.FLOAT32)
+
+  def feature_precision(self, feature_name):
+    # The render pass is the last part of the source and target feature names.
+    return self.precision(feature_name.split('/')[-1])
+
+  @staticmethod
+  def numpy_dtype(precision):
+    if precision == RenderPassesPrecision.FLOAT32:
+      return np.float32
+    return np.float16
+
+  @staticmethod
+  def tensorflow_dtype(precision):
+    # TensorFlow is only imported for the tensors, such that the tile containers do not need it.
+    import tensorflow as tf
+    if precision == RenderPassesPrecision.FLOAT32:
+      return tf.float32
+    return tf.float16
+
+  @staticmethod
+  def encode(image, precision):
+    # numpy array in the stored precision.
+    if precision == RenderPassesPrecision.FLOAT32:
+      return np.asarray(image, dtype=np.float32)
+    image = np.asarray(image, dtype=np.float32)
+    if precision == RenderPassesPrecision.LOG_FLOAT16:
+      image = np.sign(image) * np.log1p(np.abs(image))
+    # Values beyond the float16 range would become infinite.
+    float16_max = np.finfo(np.float16).max
+    return np.clip(image, -float16_max, float16_max).astype(np.float16)
+
+  @staticmethod
+  def decode_numpy(image, precision):
+    image = np.asarray(image).astype(np.float32)
+    if precision == RenderPassesPrecision.LOG_FLOAT16:
+      image = np.sign(image) * np.expm1(np.abs(image))
+    return image
+
+  @staticmethod
+  def decode(image, precision):
+    # Tensor in the stored precision, upcast to float32.
+    if precision == RenderPassesPrecision.FLOAT32:
+      return image
+    import tensorflow as tf
+    image = tf.cast(image, tf.float32)
+    if precision == RenderPassesPrecision.LOG_FLOAT16:
+      image = tf.sign(image) * tf.expm1(tf.abs(image))
+    return image
+
+  @staticmethod
+  def decode_raw(serialized, precision):
+    import tensorflow as tf
+    image = tf.decode_raw(serialized, RenderPassesPrecision.tensorflow_dtype(precision))
+    return RenderPassesPrecision.decode(image, precision)
+
+  def __json__(self):
+    return self.render_pass_to_precision
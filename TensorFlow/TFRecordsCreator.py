@@ -4,16 +4,22 @@ from __future__ import print_function
 
 import argparse
 import os
+import hashlib
 import logging
+import multiprocessing
 
 import tensorflow as tf
 
 import json
-import gzip
 
 from Naming import Naming
+import Utilities
 from RenderPasses import RenderPassesUsage
+from RenderPassesPrecision import RenderPassesPrecision
 from TFRecordsStatistics import TFRecordsStatistics
+from TFRecordsManifest import TFRecordsManifest
+from TileContainer import TileContainer
+from TileContainer import TileContainerWriter
 from OpenEXRDirectories import OpenEXRDirectories
 
 
@@ -27,6 +33,35 @@ parser.add_argument(
     '--statistics', action="store_true",
     help='Only recalculate the statistics.')
 
+parser.add_argument(
+    '--statistics_sample_fraction', type=float, default=1.,
+    help='Fraction of the data which is used for the statistics. Below 1, the statistics are approximated on a '
+         'random sample and the means and coverages come with confidence intervals.')
+
+parser.add_argument(
+    '--statistics_sampling', type=str, default='shards',
+    choices=['shards', 'tiles'],
+    help='Whether a random subset of the tfrecords files or tile containers or of the tiles is used for the '
+         'approximated statistics. Sampling the shards is faster, sampling the tiles is more representative.')
+
+parser.add_argument(
+    '--statistics_seed', type=int, default=0,
+    help='Seed for the sampling of the statistics.')
+
+parser.add_argument(
+    '--processes', type=int, default=1,
+    help='Number of processes creating the tfrecords and computing the statistics.')
+
+parser.add_argument(
+    '--rebuild', action="store_true",
+    help='Remove all the existing tfrecords and recreate them for all scenes, instead of only for those which '
+         'are new or have changed. This is needed after the settings changed or if there are tfrecords which '
+         'are not in the manifest.')
+
+parser.add_argument(
+    '--exr_loading_threads', type=int, default=8,
+    help='Number of threads which are loading the exr files concurrently.')
+
 class TFRecordsCreator:
 
   def __init__(
@@ -34,9 +69,12 @@ class TFRecordsCreator:
       source_samples_per_pixel_list, source_render_passes_usage, number_of_sources_per_example,
       target_samples_per_pixel, target_render_passes_usage,
       tiles_height_width, examples_per_tfrecords,
-      group_by_samples_per_pixel):
+      group_by_samples_per_pixel, compression_type='GZIP', compression_level=6,
+      output_format='tfrecords', tiles_dtype='float32', render_passes_precision=None,
+      exr_loading_threads=1, processes=1):
     self.name = name
     self.base_tfrecords_directory = base_tfrecords_directory
+    self.base_exr_directory = base_exr_directory
     self.source_samples_per_pixel_list = source_samples_per_pixel_list
     self.source_render_passes_usage = source_render_passes_usage
     self.number_of_sources_per_example = number_of_sources_per_example
@@ -45,6 +83,15 @@ class TFRecordsCreator:
     self.tiles_height_width = tiles_height_width
     self.examples_per_tfrecords = examples_per_tfrecords
     self.group_by_samples_per_pixel = group_by_samples_per_pixel
+    self.compression_type = compression_type
+    self.compression_level = compression_level
+    self.output_format = output_format
+    self.tiles_dtype = tiles_dtype
+    if render_passes_precision == None:
+      render_passes_precision = RenderPassesPrecision()
+    self.render_passes_precision = render_passes_precision
+    self.exr_loading_threads = exr_loading_threads
+    self.processes = processes
 
     if not os.path.exists(self.base_tfrecords_directory):
       os.makedirs(self.base_tfrecords_directory)
@@ -86,7 +133,7 @@ class TFRecordsCreator:
         if new_exr_directories.is_valid:
           self.exr_directories_list.append(new_exr_directories)
   
-  def create_tfrecords(self):
+  def create_tfrecords(self, rebuild=False):
     source_samples_per_pixel_lists = []
     if self.group_by_samples_per_pixel:
       for source_samples_per_pixel_list in self.source_samples_per_pixel_list:
@@ -95,70 +142,22 @@ class TFRecordsCreator:
       source_samples_per_pixel_lists.append(self.source_samples_per_pixel_list)
 
     for source_samples_per_pixel_list in source_samples_per_pixel_lists:
-      tfrecords_writer = TFRecordsWriter(
-          self.name, self.base_tfrecords_directory, self.examples_per_tfrecords,
-          self.group_by_samples_per_pixel, source_samples_per_pixel_list)
-
-      for exr_directories in self.exr_directories_list:
-        target_samples_per_pixel = self.target_samples_per_pixel
-        if target_samples_per_pixel == 'best':
-          target_samples_per_pixel = exr_directories.ground_truth_samples_per_pixel()
-        
-        for source_samples_per_pixel in source_samples_per_pixel_list:
-          exr_directories.load_images(source_samples_per_pixel, self.source_render_passes_usage)
-          if not exr_directories.is_valid:
-            break
-        if exr_directories.is_valid:
-          exr_directories.load_images(target_samples_per_pixel, self.target_render_passes_usage)
-        
-        # Simple validity checks.
-        if exr_directories.is_valid:
-          exr_directories.ensure_loaded_images_identical_sizes()
-        
-        if exr_directories.is_valid:
+      name = self.name
+      if self.group_by_samples_per_pixel:
+        name = self.name + '_' + str(source_samples_per_pixel_list[0])
 
-          # TODO: Maybe which image parts are contained in which tfrecords. (DeepBlender)
+      manifest = TFRecordsManifest(
+          os.path.join(self.base_tfrecords_directory, name + '_manifest.json'),
+          self._manifest_settings(source_samples_per_pixel_list), rebuild)
+      pending_exr_directories_indices = self._prepare_manifest(manifest, source_samples_per_pixel_list, rebuild)
 
-          height, width = exr_directories.size_of_loaded_images()
-          
-          # Split the images into tiles.
-          tiles_x_count = height // self.tiles_height_width
-          tiles_y_count = width // self.tiles_height_width
-          
-          for i in range(tiles_x_count):
-            for j in range (tiles_y_count):
-              x1 = i * self.tiles_height_width
-              x2 = (i + 1) * self.tiles_height_width
-              y1 = j * self.tiles_height_width
-              y2 = (j + 1) * self.tiles_height_width
-              
-              features = {}
-              
-              # Prepare the source image tile.
-              for source_samples_per_pixel in source_samples_per_pixel_list:
-                for index, source_exr_directory in enumerate(
-                    exr_directories.samples_per_pixel_to_exr_directories[source_samples_per_pixel]):
-                  if index < self.number_of_sources_per_example:
-                    for source_render_pass in source_exr_directory.render_pass_to_image:
-                      source_feature_name = Naming.source_feature_name(
-                          source_render_pass,
-                          samples_per_pixel=source_samples_per_pixel,
-                          index=index)
-                      image = source_exr_directory.render_pass_to_image[source_render_pass]
-                      features[source_feature_name] = TFRecordsCreator._bytes_feature(
-                              tf.compat.as_bytes(image[x1:x2, y1:y2].tostring()))
-          
-              # Prepare the target image tiles.
-              target_exr_directory = exr_directories.samples_per_pixel_to_exr_directories[target_samples_per_pixel][0]
-              for target_render_pass in target_exr_directory.render_pass_to_image:
-                image = target_exr_directory.render_pass_to_image[target_render_pass]
-                features[Naming.target_feature_name(target_render_pass)] = TFRecordsCreator._bytes_feature(
-                    tf.compat.as_bytes(image[x1:x2, y1:y2].tostring()))
-              
-              tfrecords_writer.write(features)
-        
-        exr_directories.unload_images()
-      tfrecords_writer.close()
+      if self.processes > 1:
+        self._create_tfrecords_in_processes(
+            pending_exr_directories_indices, source_samples_per_pixel_list, manifest)
+      else:
+        for exr_directories_index in pending_exr_directories_indices:
+          scene = self._create_scene_tfrecords(exr_directories_index, source_samples_per_pixel_list)
+          TFRecordsCreator._add_scene_to_manifest(manifest, scene)
 
 
       # Save the settings.
@@ -167,18 +166,213 @@ class TFRecordsCreator:
       settings['tiles_height_width'] = self.tiles_height_width
       settings['number_of_sources_per_example'] = self.number_of_sources_per_example
       settings['source_samples_per_pixel_list'] = source_samples_per_pixel_list
+      settings['compression_type'] = self.compression_type
+      settings['render_passes_precision'] = self.render_passes_precision
 
-      filename = self.name + '.json'
-      if self.group_by_samples_per_pixel:
-        filename = self.name + '_' + str(source_samples_per_pixel_list[0]) + '.json'
+      filename = name + '.json'
 
       settings_json_filename = os.path.join(self.base_tfrecords_directory, filename)
       settings_json_content = json.dumps(settings, cls=DataSettingsEncoder, sort_keys=True, indent=2)
       with open(settings_json_filename, 'w+', encoding='utf-8') as settings_json_file:
         settings_json_file.write(settings_json_content)
   
-  def create_statistics(self):
-    tfrecords_statistics = TFRecordsStatistics(self)
+  def _write_examples(self, exr_directories, source_samples_per_pixel_list, tfrecords_writer):
+    target_samples_per_pixel = self.target_samples_per_pixel
+    if target_samples_per_pixel == 'best':
+      target_samples_per_pixel = exr_directories.ground_truth_samples_per_pixel()
+    
+    for source_samples_per_pixel in source_samples_per_pixel_list:
+      exr_directories.load_images(
+          source_samples_per_pixel, self.source_render_passes_usage, threads=self.exr_loading_threads)
+      if not exr_directories.is_valid:
+        break
+    if exr_directories.is_valid:
+      exr_directories.load_images(
+          target_samples_per_pixel, self.target_render_passes_usage, threads=self.exr_loading_threads)
+    
+    # Simple validity checks.
+    if exr_directories.is_valid:
+      exr_directories.ensure_loaded_images_identical_sizes()
+    
+    if exr_directories.is_valid:
+
+      # TODO: Maybe which image parts are contained in which tfrecords. (DeepBlender)
+
+      height, width = exr_directories.size_of_loaded_images()
+      
+      # Split the images into tiles.
+      tiles_x_count = height // self.tiles_height_width
+      tiles_y_count = width // self.tiles_height_width
+      
+      for i in range(tiles_x_count):
+        for j in range (tiles_y_count):
+          x1 = i * self.tiles_height_width
+          x2 = (i + 1) * self.tiles_height_width
+          y1 = j * self.tiles_height_width
+          y2 = (j + 1) * self.tiles_height_width
+          
+          features = {}
+          
+          # Prepare the source image tile.
+          for source_samples_per_pixel in source_samples_per_pixel_list:
+            for index, source_exr_directory in enumerate(
+                exr_directories.samples_per_pixel_to_exr_directories[source_samples_per_pixel]):
+              if index < self.number_of_sources_per_example:
+                for source_render_pass in source_exr_directory.render_pass_to_image:
+                  source_feature_name = Naming.source_feature_name(
+                      source_render_pass,
+                      samples_per_pixel=source_samples_per_pixel,
+                      index=index)
+                  image = source_exr_directory.render_pass_to_image[source_render_pass]
+                  features[source_feature_name] = image[x1:x2, y1:y2]
+      
+          # Prepare the target image tiles.
+          target_exr_directory = exr_directories.samples_per_pixel_to_exr_directories[target_samples_per_pixel][0]
+          for target_render_pass in target_exr_directory.render_pass_to_image:
+            image = target_exr_directory.render_pass_to_image[target_render_pass]
+            features[Naming.target_feature_name(target_render_pass)] = image[x1:x2, y1:y2]
+          
+          tfrecords_writer.write(features)
+    
+    exr_directories.unload_images()
+
+  def _manifest_settings(self, source_samples_per_pixel_list):
+    # Everything which has an influence on the content of the tfrecords files. The round trip through json
+    # makes them comparable with the settings of a loaded manifest.
+    settings = {}
+    settings['source_samples_per_pixel_list'] = source_samples_per_pixel_list
+    settings['source_render_passes_usage'] = self.source_render_passes_usage
+    settings['number_of_sources_per_example'] = self.number_of_sources_per_example
+    settings['target_samples_per_pixel'] = self.target_samples_per_pixel
+    settings['target_render_passes_usage'] = self.target_render_passes_usage
+    settings['tiles_height_width'] = self.tiles_height_width
+    settings['examples_per_tfrecords'] = self.examples_per_tfrecords
+    settings['compression_type'] = self.compression_type
+    settings['compression_level'] = self.compression_level
+    settings['output_format'] = self.output_format
+    settings['tiles_dtype'] = self.tiles_dtype
+    settings['render_passes_precision'] = self.render_passes_precision
+    return json.loads(json.dumps(settings, cls=DataSettingsEncoder, sort_keys=True))
+
+  def _prepare_manifest(self, manifest, source_samples_per_pixel_list, rebuild):
+    # Removes the scenes which are gone or changed from the manifest, together with their tfrecords files and
+    # those of scenes which did not finish. Files which were not written for the manifest are never removed,
+    # unless everything is rebuilt. The indices of the scenes which have to be written are returned.
+    tfrecords_directory = TFRecordsWriter.directory(
+        self.base_tfrecords_directory, self.name, self.group_by_samples_per_pixel, source_samples_per_pixel_list)
+    existing_filenames = []
+    if os.path.isdir(tfrecords_directory):
+      existing_filenames = [
+          filename for filename in sorted(os.listdir(tfrecords_directory))
+          if TFRecordsWriter.is_tfrecords_filename(filename)]
+
+    if rebuild:
+      for filename in existing_filenames:
+        os.remove(os.path.join(tfrecords_directory, filename))
+      if len(existing_filenames) > 0:
+        self.logger.info('Removed ' + str(len(existing_filenames)) + ' files for the rebuild.')
+      existing_filenames = []
+    elif manifest.settings_changed and len(existing_filenames) > 0:
+      raise Exception(
+          'The settings changed since the tfrecords in ' + tfrecords_directory + ' were created. '
+          'Use --rebuild to recreate all of them.')
+
+    fingerprints = {}
+    pending_exr_directories_indices = []
+    for exr_directories_index, exr_directories in enumerate(self.exr_directories_list):
+      scene_name = self._shard_name(exr_directories)
+      if scene_name in fingerprints:
+        raise Exception('The scene ' + exr_directories.base_directory + ' is used more than once.')
+      fingerprints[scene_name] = exr_directories.fingerprint()
+      if not manifest.is_up_to_date(scene_name, fingerprints[scene_name]):
+        pending_exr_directories_indices.append(exr_directories_index)
+
+    # The files of the manifest are those of its scenes and those written for its pending scenes.
+    manifest_filenames = manifest.tfrecords_filenames()
+    pending_scene_names = manifest.pending_scene_names()
+    for filename in existing_filenames:
+      for scene_name in pending_scene_names:
+        if TFRecordsWriter.is_shard_filename(filename, self.name, scene_name):
+          manifest_filenames.add(filename)
+    unknown_filenames = [filename for filename in existing_filenames if not filename in manifest_filenames]
+    if len(unknown_filenames) > 0:
+      raise Exception(
+          str(len(unknown_filenames)) + ' files in ' + tfrecords_directory + ' are not in the manifest, e.g. ' +
+          unknown_filenames[0] + '. Use --rebuild to recreate all the tfrecords.')
+
+    for scene_name in manifest.scene_names():
+      if not scene_name in fingerprints or not manifest.is_up_to_date(scene_name, fingerprints[scene_name]):
+        manifest.remove_scene(scene_name)
+    up_to_date_filenames = manifest.tfrecords_filenames()
+    for filename in existing_filenames:
+      if not filename in up_to_date_filenames:
+        os.remove(os.path.join(tfrecords_directory, filename))
+
+    manifest.clear_pending_scenes()
+    for exr_directories_index in pending_exr_directories_indices:
+      manifest.start_scene(self._shard_name(self.exr_directories_list[exr_directories_index]))
+    manifest.save()
+
+    self.logger.info(
+        str(len(self.exr_directories_list) - len(pending_exr_directories_indices)) + ' of ' +
+        str(len(self.exr_directories_list)) + ' scenes are up to date.')
+    return pending_exr_directories_indices
+
+  @staticmethod
+  def _add_scene_to_manifest(manifest, scene):
+    # Scenes which failed are not added, such that they are tried again in the next build.
+    if scene != None:
+      scene_name, fingerprint, tfrecords_filenames, tiles = scene
+      manifest.add_scene(scene_name, fingerprint, tfrecords_filenames, tiles)
+      manifest.save()
+
+  def _create_tfrecords_in_processes(
+      self, exr_directories_indices, source_samples_per_pixel_list, manifest):
+    # Each scene is handled by one process. The creator is handed to each process once by the initializer, such
+    # that only the indices of the scenes are sent per task, no matter which start method is used. The manifest
+    # is only updated by this process, whenever a scene is done.
+    arguments = [
+        (exr_directories_index, source_samples_per_pixel_list)
+        for exr_directories_index in exr_directories_indices]
+    pool = multiprocessing.Pool(
+        processes=self.processes, initializer=_initialize_tfrecords_creator, initargs=(self,))
+    try:
+      for scene in pool.imap_unordered(_create_scene_tfrecords, arguments, chunksize=1):
+        TFRecordsCreator._add_scene_to_manifest(manifest, scene)
+    finally:
+      pool.close()
+      pool.join()
+
+  def _create_scene_tfrecords(self, exr_directories_index, source_samples_per_pixel_list):
+    # Each scene is written into its own tfrecords files, which are named after the scene. Like that, they
+    # neither depend on the order nor on the scheduling of the scenes.
+    exr_directories = self.exr_directories_list[exr_directories_index]
+    scene_name = self._shard_name(exr_directories)
+    fingerprint = exr_directories.fingerprint()
+    tfrecords_writer = TFRecordsWriter(
+        self.name, self.base_tfrecords_directory, self.examples_per_tfrecords,
+        self.group_by_samples_per_pixel, source_samples_per_pixel_list,
+        shard_name=scene_name,
+        compression_type=self.compression_type, compression_level=self.compression_level,
+        output_format=self.output_format, tiles_dtype=self.tiles_dtype,
+        render_passes_precision=self.render_passes_precision)
+    self._write_examples(exr_directories, source_samples_per_pixel_list, tfrecords_writer)
+    tfrecords_writer.close()
+
+    if not exr_directories.is_valid:
+      return None
+    return scene_name, fingerprint, tfrecords_writer.tfrecords_filenames, tfrecords_writer.tiles
+
+  def _shard_name(self, exr_directories):
+    # The separators are replaced to get a flat name, which is only unique with the hash of the relative directory,
+    # e.g. for a/b_c and a_b/c.
+    relative_directory = os.path.relpath(exr_directories.base_directory, self.base_exr_directory)
+    relative_directory = relative_directory.replace(os.sep, '/')
+    relative_directory_hash = hashlib.sha1(relative_directory.encode('utf-8')).hexdigest()[:8]
+    return relative_directory.replace('/', '_') + '_' + relative_directory_hash
+  
+  def create_statistics(self, sample_fraction=1., sampling='shards', seed=0):
+    tfrecords_statistics = TFRecordsStatistics(self, sample_fraction, sampling, seed)
     tfrecords_statistics.compute_and_save_statistics()
   
   @staticmethod
@@ -199,57 +393,134 @@ class TFRecordsCreator:
 
 
 class TFRecordsWriter:
+
+  EXTENSIONS = {
+      'GZIP': '.tfrecords.gz',
+      'ZLIB': '.tfrecords.zz',
+      'NONE': '.tfrecords'}
+
   def __init__(
       self, name, base_directory, examples_per_tfrecords,
-      group_by_samples_per_pixel, source_samples_per_pixel_list):
+      group_by_samples_per_pixel, source_samples_per_pixel_list, shard_name=None,
+      compression_type='GZIP', compression_level=6, output_format='tfrecords', tiles_dtype='float32',
+      render_passes_precision=None):
     self.name = name
+    self.shard_name = shard_name
+    
+    # With 'tiles', all the tiles are written into one tile container instead of tfrecords files.
+    self.output_format = output_format
+    self.tiles_dtype = tiles_dtype
+    
+    # Each render pass is stored in its own precision, which is upcast again when it is loaded.
+    if render_passes_precision == None:
+      render_passes_precision = RenderPassesPrecision()
+    self.render_passes_precision = render_passes_precision
+    
+    # The records are compressed while they are written.
+    self.options = tf.python_io.TFRecordOptions(
+        compression_type=Utilities.tfrecords_compression_type(compression_type),
+        compression_level=compression_level)
+    self.extension = TFRecordsWriter.EXTENSIONS[compression_type]
     self.base_directory = base_directory
     self.examples_per_tfrecords = examples_per_tfrecords
     self.group_by_samples_per_pixel = group_by_samples_per_pixel
     self.source_samples_per_pixel_list = source_samples_per_pixel_list
-    self.tfrecords_directory = os.path.join(self.base_directory, self.name)
-    if self.group_by_samples_per_pixel:
-      assert len(self.source_samples_per_pixel_list) == 1
-      self.tfrecords_directory = os.path.join(
-          self.tfrecords_directory, str(self.source_samples_per_pixel_list[0]))
-    if not os.path.exists(self.tfrecords_directory):
-      os.makedirs(self.tfrecords_directory)
+    self.tfrecords_directory = TFRecordsWriter.directory(
+        self.base_directory, self.name, self.group_by_samples_per_pixel, self.source_samples_per_pixel_list)
+    # Several processes might create the directory at the same time.
+    os.makedirs(self.tfrecords_directory, exist_ok=True)
     self.writer = None
     self.tfrecords_index = 0
     self.added_tiles = 0
+    self.tiles = 0
+    self.tfrecords_filenames = []
   
+  @staticmethod
+  def directory(base_directory, name, group_by_samples_per_pixel, source_samples_per_pixel_list):
+    result = os.path.join(base_directory, name)
+    if group_by_samples_per_pixel:
+      assert len(source_samples_per_pixel_list) == 1
+      result = os.path.join(result, str(source_samples_per_pixel_list[0]))
+    return result
+  
+  @staticmethod
+  def is_tfrecords_filename(filename):
+    return filename.endswith(tuple(TFRecordsWriter.EXTENSIONS.values()) + (TileContainer.EXTENSION,))
+
+  @staticmethod
+  def is_shard_filename(filename, name, shard_name):
+    # Either the tile container or one of the numbered tfrecords files of the shard.
+    shard_prefix = name + '_' + shard_name
+    if filename == shard_prefix + TileContainer.EXTENSION:
+      return True
+    for extension in TFRecordsWriter.EXTENSIONS.values():
+      if filename.startswith(shard_prefix + '_') and filename.endswith(extension):
+        if filename[len(shard_prefix) + 1:-len(extension)].isdigit():
+          return True
+    return False
+
   def write(self, features):
+    if self.output_format == 'tiles':
+      self._write_to_tile_container(features)
+      return
+    
     if self.writer == None:
+      tfrecords_name = self.name
+      if self.shard_name != None:
+        tfrecords_name = tfrecords_name + '_' + self.shard_name
       self.tfrecords_filename = os.path.join(
-          self.tfrecords_directory, self.name + '_' + str(self.tfrecords_index) + '.tfrecords')
-      self.writer = tf.python_io.TFRecordWriter(self.tfrecords_filename)
+          self.tfrecords_directory, tfrecords_name + '_' + str(self.tfrecords_index) + self.extension)
+      self.writer = tf.python_io.TFRecordWriter(self.tfrecords_filename, options=self.options)
+      self.tfrecords_filenames.append(os.path.basename(self.tfrecords_filename))
     
-    example = tf.train.Example(features=tf.train.Features(feature=features))
+    serialized_features = {}
+    for name in features:
+      feature = RenderPassesPrecision.encode(
+          features[name], self.render_passes_precision.feature_precision(name))
+      serialized_features[name] = TFRecordsCreator._bytes_feature(tf.compat.as_bytes(feature.tostring()))
+    example = tf.train.Example(features=tf.train.Features(feature=serialized_features))
     self.writer.write(example.SerializeToString())
     self.added_tiles = self.added_tiles + 1
+    self.tiles = self.tiles + 1
     
     if self.added_tiles >= self.examples_per_tfrecords:
       self.close()
   
+  def _write_to_tile_container(self, features):
+    # The tile container allows random access to the tiles, that's why it is not split into several files.
+    if self.writer == None:
+      tile_container_name = self.name
+      if self.shard_name != None:
+        tile_container_name = tile_container_name + '_' + self.shard_name
+      self.tfrecords_filename = os.path.join(self.tfrecords_directory, tile_container_name + TileContainer.EXTENSION)
+      self.writer = TileContainerWriter(
+          self.tfrecords_filename, features[next(iter(features))].shape[0], self.tiles_dtype,
+          {'source_samples_per_pixel_list': self.source_samples_per_pixel_list},
+          self.render_passes_precision)
+      self.tfrecords_filenames.append(os.path.basename(self.tfrecords_filename))
+    
+    self.writer.write(features)
+    self.tiles = self.tiles + 1
+  
   def close(self):
     if self.writer != None:
       self.writer.close()
-      TFRecordsWriter._compress(self.tfrecords_filename)
     self.added_tiles = 0
     self.tfrecords_filename = None
     self.writer = None
     self.tfrecords_index = self.tfrecords_index + 1
   
-  @staticmethod
-  def _compress(filename, delete_uncompressed=True):
-    gzip_filename = filename + '.gz'
-    original_file = open(filename, 'rb')
-    gzip_file = gzip.open(gzip_filename, 'wb')
-    gzip_file.writelines(original_file)
-    gzip_file.close()
-    original_file.close()
-    if delete_uncompressed:
-      os.remove(filename)
+
+# The creator which is used by the processes of TFRecordsCreator._create_tfrecords_in_processes.
+_tfrecords_creator = None
+
+def _initialize_tfrecords_creator(tfrecords_creator):
+  global _tfrecords_creator
+  _tfrecords_creator = tfrecords_creator
+
+def _create_scene_tfrecords(arguments):
+  exr_directories_index, source_samples_per_pixel_list = arguments
+  return _tfrecords_creator._create_scene_tfrecords(exr_directories_index, source_samples_per_pixel_list)
 
 class DataSettingsEncoder(json.JSONEncoder):
   def default(self, obj):
@@ -294,6 +565,8 @@ def main(parsed_arguments):
   target_samples_per_pixel = target['samples_per_pixel']
   target_render_passes_usage = RenderPassesUsage()
   target_render_passes_usage.__dict__ = target['features']
+  
+  render_passes_precision = RenderPassesPrecision(parsed_json.get('precision', {}))
 
   # Central error logger
   logger_filename = os.path.join(base_tfrecords_directory, 'Error.log')
@@ -312,16 +585,22 @@ def main(parsed_arguments):
         source_samples_per_pixel, source_render_passes_usage, number_of_sources_per_example,
         target_samples_per_pixel, target_render_passes_usage,
         mode_settings['tiles_height_width'], mode_settings['examples_per_tfrecords'],
-        mode_settings['group_by_samples_per_pixel'])
+        mode_settings['group_by_samples_per_pixel'],
+        mode_settings.get('compression_type', 'GZIP'), mode_settings.get('compression_level', 6),
+        mode_settings.get('output_format', 'tfrecords'), mode_settings.get('tiles_dtype', 'float32'),
+        render_passes_precision,
+        parsed_arguments.exr_loading_threads,
+        parsed_arguments.processes)
     tfrecords_creators.append(tfrecords_creator)
   
   if not parsed_arguments.statistics:
     for tfrecords_creator in tfrecords_creators:
-      tfrecords_creator.create_tfrecords()
+      tfrecords_creator.create_tfrecords(parsed_arguments.rebuild)
   
-  tf.enable_eager_execution()
   for tfrecords_creator in tfrecords_creators:
-    tfrecords_creator.create_statistics()
+    tfrecords_creator.create_statistics(
+        parsed_arguments.statistics_sample_fraction, parsed_arguments.statistics_sampling,
+        parsed_arguments.statistics_seed)
   
 if __name__ == '__main__':
   parsed_arguments, unparsed = parser.parse_known_args()
@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+
+class TFRecordsManifest:
+
+  # Keeps track of which scene produced which tfrecords files, such that only new or changed scenes
+  # have to be written again. The scenes are identified by their shard name and carry the fingerprint of
+  # their exr files. If the settings which determine the content of the tfrecords change, the manifest
+  # starts empty and settings_changed is set.
+  #
+  # The scenes which are being written are marked as pending, such that the files of a scene which did not
+  # finish are known to belong to the manifest. The manifest is saved after every scene, which allows to resume
+  # a build which did not finish.
+
+  def __init__(self, filename, settings, rebuild=False):
+    self.filename = filename
+    self.settings = settings
+    self.scenes = {}
+    self.pending_scenes = []
+    self.settings_changed = False
+
+    if not rebuild and os.path.isfile(self.filename):
+      with open(self.filename, 'r', encoding='utf-8') as manifest_file:
+        manifest = json.loads(manifest_file.read())
+      if manifest['settings'] == self.settings:
+        self.scenes = manifest['scenes']
+        self.pending_scenes = manifest.get('pending_scenes', [])
+      else:
+        self.settings_changed = True
+
+  def is_up_to_date(self, scene_name, fingerprint):
+    return scene_name in self.scenes and self.scenes[scene_name]['fingerprint'] == fingerprint
+
+  def start_scene(self, scene_name):
+    if not scene_name in self.pending_scenes:
+      self.pending_scenes.append(scene_name)
+
+  def add_scene(self, scene_name, fingerprint, tfrecords_filenames, tiles):
+    self.scenes[scene_name] = {
+        'fingerprint': fingerprint,
+        'tfrecords_filenames': tfrecords_filenames,
+        'tiles': tiles}
+    if scene_name in self.pending_scenes:
+      self.pending_scenes.remove(scene_name)
+
+  def remove_scene(self, scene_name):
+    del self.scenes[scene_name]
+
+  def scene_names(self):
+    return list(self.scenes.keys())
+
+  def pending_scene_names(self):
+    return list(self.pending_scenes)
+
+  def clear_pending_scenes(self):
+    self.pending_scenes = []
+
+  def tfrecords_filenames(self):
+    result = set()
+    for scene_name in self.scenes:
+      result.update(self.scenes[scene_name]['tfrecords_filenames'])
+    return result
+
+  def save(self):
+    manifest = {}
+    manifest['settings'] = self.settings
+    manifest['scenes'] = self.scenes
+    manifest['pending_scenes'] = self.pending_scenes
+    manifest_content = json.dumps(manifest, sort_keys=True, indent=2)
+
+    # Replacing the previous manifest at once ensures it is never left half written.
+    temporary_filename = self.filename + '.tmp'
+    with open(temporary_filename, 'w+', encoding='utf-8') as manifest_file:
+      manifest_file.write(manifest_content)
+    os.replace(temporary_filename, self.filename)
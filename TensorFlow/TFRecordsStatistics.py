@@ -5,23 +5,40 @@ from __future__ import print_function
 import os
 
 import tensorflow as tf
-import tensorflow.contrib.eager as tfe
 import multiprocessing
 
-import math
 import json
+import glob
+import random
+
+import numpy as np
 
 from Naming import Naming
 from RenderPasses import RenderPasses
-from FeatureStatistics import Statistics
-from FeatureStatistics import FeatureStatistics
+from RenderPassesPrecision import RenderPassesPrecision
+from FeatureStatistics import FeatureRunningStatistics
 import Utilities
-from Conv2dUtilities import Conv2dUtilities
+from TileContainer import TileContainer
+from TileContainer import TileContainerReader
 
 class TFRecordsStatistics:
 
-  def __init__(self, tfrecords_creator):
+  # The statistics are computed with NumPy for chunks of tiles at once. Each tfrecords file or tile container
+  # is handled on its own and can be processed by a different process. The running statistics of all the files
+  # are merged at the end.
+  #
+  # With a sample fraction below 1, only a random subset of the shards (tfrecords files or tile containers) or
+  # of the tiles is used. The mean and coverage then come with 95% confidence intervals.
+
+  TILES_PER_CHUNK = 256
+
+  def __init__(self, tfrecords_creator, sample_fraction=1., sampling='shards', seed=0):
+    if sample_fraction <= 0. or sample_fraction > 1.:
+      raise Exception('The sample fraction for the statistics needs to be greater than 0 and at most 1.')
     self.tfrecords_creator = tfrecords_creator
+    self.sample_fraction = sample_fraction
+    self.sampling = sampling
+    self.seed = seed
   
   def compute_and_save_statistics(self):
 
@@ -40,185 +57,39 @@ class TFRecordsStatistics:
       if group_by_samples_per_pixel:
         assert len(source_samples_per_pixel_list) == 1
         samples_per_pixel = source_samples_per_pixel_list[0]
-    
-      # Prepare the data structures.
-    
-      self.minimums = {}
-      self.maximums = {}
-      self.means = {}
-      self.variances = {}
-      self.coverage = {}
-      self.minimums_log1p = {}
-      self.maximums_log1p = {}
-      self.means_log1p = {}
-      self.variances_log1p = {}
-      
-      for source_render_pass in self.tfrecords_creator.source_render_passes_usage.render_passes():
-        source_feature_name = Naming.source_feature_name(source_render_pass)
-        self.minimums[source_feature_name] = math.inf
-        self.maximums[source_feature_name] = -math.inf
-        self.means[source_feature_name] = []
-        self.variances[source_feature_name] = []
-        self.coverage[source_feature_name] = []
-        self.minimums_log1p[source_feature_name] = math.inf
-        self.maximums_log1p[source_feature_name] = -math.inf
-        self.means_log1p[source_feature_name] = []
-        self.variances_log1p[source_feature_name] = []
-        
-        if (
-            RenderPasses.is_direct_or_indirect_render_pass(source_render_pass) and not
-            RenderPasses.is_volume_render_pass(source_render_pass)):
-          source_feature_name = Naming.source_feature_name(source_render_pass, masked=True)
-          self.minimums[source_feature_name] = math.inf
-          self.maximums[source_feature_name] = -math.inf
-          self.means[source_feature_name] = []
-          self.variances[source_feature_name] = []
-          self.coverage[source_feature_name] = []
-          self.minimums_log1p[source_feature_name] = math.inf
-          self.maximums_log1p[source_feature_name] = -math.inf
-          self.means_log1p[source_feature_name] = []
-          self.variances_log1p[source_feature_name] = []
-      
-      for target_render_pass in self.tfrecords_creator.target_render_passes_usage.render_passes():
-        target_feature_name = Naming.target_feature_name(target_render_pass)
-        self.minimums[target_feature_name] = math.inf
-        self.maximums[target_feature_name] = -math.inf
-        self.means[target_feature_name] = []
-        self.variances[target_feature_name] = []
-        self.coverage[target_feature_name] = []
-        self.minimums_log1p[target_feature_name] = math.inf
-        self.maximums_log1p[target_feature_name] = -math.inf
-        self.means_log1p[target_feature_name] = []
-        self.variances_log1p[target_feature_name] = []
-        
-        if (
-            RenderPasses.is_direct_or_indirect_render_pass(target_render_pass) and not
-            RenderPasses.is_volume_render_pass(target_render_pass)):
-          target_feature_name = Naming.target_feature_name(target_render_pass, masked=True)
-          self.minimums[target_feature_name] = math.inf
-          self.maximums[target_feature_name] = -math.inf
-          self.means[target_feature_name] = []
-          self.variances[target_feature_name] = []
-          self.coverage[target_feature_name] = []
-          self.minimums_log1p[target_feature_name] = math.inf
-          self.maximums_log1p[target_feature_name] = -math.inf
-          self.means_log1p[target_feature_name] = []
-          self.variances_log1p[target_feature_name] = []
-      
-      
-      # Iterate through the tfrecords to compute the usual and log1p statistics for minimum, maximum and mean.
       
-      iterator = self._dataset_iterator(group_by_samples_per_pixel, source_samples_per_pixel_list)
-      while True:
-        try:
-          source_features, target_features = iterator.get_next()
-          for samples_per_pixel in source_samples_per_pixel_list:
-            for source_index in range(self.tfrecords_creator.number_of_sources_per_example):
-              for source_render_pass in self.tfrecords_creator.source_render_passes_usage.render_passes():
-                source_feature_name = Naming.source_feature_name(source_render_pass)
-                indexed_source_feature_name = Naming.source_feature_name(source_render_pass, samples_per_pixel=samples_per_pixel, index=source_index)
-                source_feature = source_features[indexed_source_feature_name]
-                self._first_statistics_iteration(source_feature, source_render_pass, source_feature_name, False, target_features)
-                if (
-                    RenderPasses.is_direct_or_indirect_render_pass(source_render_pass) and not
-                    RenderPasses.is_volume_render_pass(source_render_pass)):
-                  
-                  source_feature_name = Naming.source_feature_name(source_render_pass, masked=True)
-                  self._first_statistics_iteration(source_feature, source_render_pass, source_feature_name, True, target_features)
-              
-          for target_render_pass in self.tfrecords_creator.target_render_passes_usage.render_passes():
-            target_feature_name = Naming.target_feature_name(target_render_pass)
-            target_feature = target_features[target_feature_name]
-            self._first_statistics_iteration(source_feature, target_render_pass, target_feature_name, False, target_features)
-            if (
-                RenderPasses.is_direct_or_indirect_render_pass(target_render_pass) and not
-                RenderPasses.is_volume_render_pass(target_render_pass)):
-              target_feature_name = Naming.target_feature_name(target_render_pass, masked=True)
-              self._first_statistics_iteration(target_feature, target_render_pass, target_feature_name, True, target_features)
-
-        except tf.errors.OutOfRangeError:
-          break
-      
-      
-      # The arrays of values need to be joined to get one number.
-      
-      for feature_name in self.minimums:
-        self.minimums[feature_name] = self.minimums[feature_name].numpy().item()
-        self.maximums[feature_name] = self.maximums[feature_name].numpy().item()
-        if len(self.means[feature_name]) == 0:
-          self.means[feature_name].append(0.)
-        self.means[feature_name] = tf.reduce_mean(self.means[feature_name]).numpy().item()
-        if len(self.coverage[feature_name]) == 0:
-          self.coverage[feature_name].append(0.)
-        self.coverage[feature_name] = tf.reduce_mean(self.coverage[feature_name]).numpy().item()
-        
-        self.minimums_log1p[feature_name] = self.minimums_log1p[feature_name].numpy().item()
-        self.maximums_log1p[feature_name] = self.maximums_log1p[feature_name].numpy().item()
-        if len(self.means_log1p[feature_name]) == 0:
-          self.means_log1p[feature_name].append(0.)
-        self.means_log1p[feature_name] = tf.reduce_mean(self.means_log1p[feature_name]).numpy().item()
-      
-      
-      # Iterate again through all the tfrecords to compute the variance, based on the mean.
-      
-      iterator = self._dataset_iterator(group_by_samples_per_pixel, source_samples_per_pixel_list)
-      while True:
-        try:
-          source_features, target_features = iterator.get_next()
-          
-          for samples_per_pixel in source_samples_per_pixel_list:
-            for source_index in range(self.tfrecords_creator.number_of_sources_per_example):
-              for source_render_pass in self.tfrecords_creator.source_render_passes_usage.render_passes():
-                source_feature_name = Naming.source_feature_name(source_render_pass)
-                indexed_source_feature_name = Naming.source_feature_name(source_render_pass, samples_per_pixel=samples_per_pixel, index=source_index)
-                source_feature = source_features[indexed_source_feature_name]
-                self._second_statistics_iteration(source_feature, source_render_pass, source_feature_name, False, target_features)
-                if (
-                    RenderPasses.is_direct_or_indirect_render_pass(source_render_pass) and not
-                    RenderPasses.is_volume_render_pass(source_render_pass)):
-                  source_feature_name = Naming.source_feature_name(source_render_pass, masked=True)
-                  self._second_statistics_iteration(source_feature, source_render_pass, source_feature_name, True, target_features)
-          
-          for target_render_pass in self.tfrecords_creator.target_render_passes_usage.render_passes():
-            target_feature_name = Naming.target_feature_name(target_render_pass)
-            target_feature = target_features[target_feature_name]
-            self._second_statistics_iteration(source_feature, target_render_pass, target_feature_name, False, target_features)
-            if (
-                RenderPasses.is_direct_or_indirect_render_pass(target_render_pass) and not
-                RenderPasses.is_volume_render_pass(target_render_pass)):
-              target_feature_name = Naming.target_feature_name(target_render_pass, masked=True)
-              self._second_statistics_iteration(target_feature, target_render_pass, target_feature_name, True, target_features)
-
-        except tf.errors.OutOfRangeError:
-          break
-      
-      
-      # Join the results again.
+      directory = os.path.join(self.tfrecords_creator.base_tfrecords_directory, self.tfrecords_creator.name)
+      if group_by_samples_per_pixel:
+        directory = os.path.join(directory, str(samples_per_pixel))
+      filenames = self._statistics_filenames(directory)
+      
+      # Each file gets its own seed, such that the sampled tiles don't depend on the scheduling of the processes.
+      files_arguments = [
+          (filename, source_samples_per_pixel_list, self.seed + index) for index, filename in enumerate(filenames)]
+      if self.sample_fraction < 1. and self.sampling == 'shards':
+        number_of_sampled_files = max(1, int(round(self.sample_fraction * len(files_arguments))))
+        files_arguments = random.Random(self.seed).sample(files_arguments, min(number_of_sampled_files, len(files_arguments)))
+    
+      # Only the running moments and sketches are kept for each feature, independent of the size of the dataset.
       
-      for feature_name in self.variances:
-        if len(self.variances[feature_name]) == 0:
-          self.variances[feature_name].append(0.)
-        self.variances[feature_name] = tf.reduce_mean(self.variances[feature_name]).numpy().item()
-        
-        if len(self.variances_log1p[feature_name]) == 0:
-          self.variances_log1p[feature_name].append(0.)
-        self.variances_log1p[feature_name] = tf.reduce_mean(self.variances_log1p[feature_name]).numpy().item()
+      running_statistics = self._empty_running_statistics()
+      if self.tfrecords_creator.processes > 1 and len(files_arguments) > 1:
+        files_statistics = self._files_statistics_in_processes(files_arguments)
+      else:
+        files_statistics = (self._file_statistics(*file_arguments) for file_arguments in files_arguments)
+      for file_running_statistics in files_statistics:
+        for feature_name in running_statistics:
+          running_statistics[feature_name].merge(file_running_statistics[feature_name])
       
       
       # Integrate the results into statistics.
       
-      for feature_name in self.minimums:
-        
-        # REMARK: The 'current_' prefix is only used to avoid a name clash.
-        current_statistics = Statistics(
-            self.minimums[feature_name], self.maximums[feature_name],
-            self.means[feature_name], self.variances[feature_name], self.coverage[feature_name])
-        current_statistics_log1p = Statistics(
-            self.minimums_log1p[feature_name], self.maximums_log1p[feature_name],
-            self.means_log1p[feature_name], self.variances_log1p[feature_name], self.coverage[feature_name])
-        feature_statistics = FeatureStatistics(
-            RenderPasses.number_of_channels(feature_name.split('/')[-1]), current_statistics, current_statistics_log1p)
-        statistics[feature_name] = feature_statistics
+      for feature_name in running_statistics:
+        sampling = None
+        if self.sample_fraction < 1.:
+          sampling = self.sampling
+        statistics[feature_name] = running_statistics[feature_name].feature_statistics(
+            RenderPasses.number_of_channels(feature_name.split('/')[-1]), sampling)
       
       
       # Save the statistics.
@@ -232,139 +103,187 @@ class TFRecordsStatistics:
       with open(statistics_json_filename, 'w+', encoding='utf-8') as statistics_json_file:
         statistics_json_file.write(statistics_json_content)
 
-      
-  def _first_statistics_iteration(self, feature, render_pass_name, feature_name, use_mask, target_features):
+  def _statistics_filenames(self, directory):
+    if self.tfrecords_creator.output_format == 'tiles':
+      return sorted(glob.glob(os.path.join(directory, '*' + TileContainer.EXTENSION)))
+    return sorted(filename for filename in glob.glob(os.path.join(directory, '*')) if os.path.isfile(filename))
+
+  def _empty_running_statistics(self):
+    running_statistics = {}
+    for feature_name, _, _ in self._statistics_features():
+      running_statistics[feature_name] = FeatureRunningStatistics()
+    return running_statistics
+
+  def _files_statistics_in_processes(self, files_arguments):
+    # Like for the creation of the tfrecords, this object is handed to each process once by the initializer.
+    pool = multiprocessing.Pool(
+        processes=self.tfrecords_creator.processes, initializer=_initialize_tfrecords_statistics, initargs=(self,))
+    try:
+      for file_statistics in pool.imap_unordered(_file_statistics, files_arguments, chunksize=1):
+        yield file_statistics
+    finally:
+      pool.close()
+      pool.join()
+
+  def _file_statistics(self, filename, source_samples_per_pixel_list, seed):
+    running_statistics = self._empty_running_statistics()
+    for features in self._file_tiles(filename, source_samples_per_pixel_list, seed):
+      self._add_tiles_to_statistics(features, source_samples_per_pixel_list, running_statistics)
+    for feature_name in running_statistics:
+      running_statistics[feature_name].end_shard()
+    return running_statistics
+
+  def _file_tiles(self, filename, source_samples_per_pixel_list, seed):
+    # Chunks of tiles as dictionaries from the feature names to float32 arrays of shape [tiles, height, width, channels].
+    tiles_height_width = self.tfrecords_creator.tiles_height_width
+    feature_names = self._tiles_feature_names(source_samples_per_pixel_list)
     
-    feature_log1p = Utilities.signed_log1p(feature)
-    channel_axis = Conv2dUtilities.channel_axis(feature, 'channels_last')
+    sample_tiles = self.sample_fraction < 1. and self.sampling == 'tiles'
+    random_state = np.random.RandomState(seed)
     
-    if use_mask:
-      # For direct and indirect passes, we only care about the relevant pixels. We create a mask for this.
-      # It depends on the corresponding ground truth color pass. Whenever that one is not black, the pixels
-      # of the direct and indirect passes matter.
-      
-      corresponding_color_pass = RenderPasses.direct_or_indirect_to_color_render_pass(render_pass_name)
-      corresponding_target_feature = target_features[Naming.target_feature_name(corresponding_color_pass)]
-      mask = Conv2dUtilities.non_zero_mask(corresponding_target_feature, data_format='channels_last')
-      mask_sum = tf.reduce_sum(mask)
-      
-      # Adjust the mask, such that it can be multiplied with the feature.
-      mask = tf.stack([mask, mask, mask], axis=channel_axis)
-      
-      
-      self.minimums[feature_name] = tf.minimum(self.minimums[feature_name], tf.reduce_min(feature))
-      self.maximums[feature_name] = tf.maximum(self.maximums[feature_name], tf.reduce_max(feature))
-      if tf.greater(mask_sum, 0.):
-        self.means[feature_name].append(tf.reduce_sum(tf.divide(tf.multiply(feature, mask), mask_sum)))
-      
-      if tf.greater(mask_sum, 0.):
-        coverage_feature = feature
-        if RenderPasses.ALPHA in feature_name:
-          coverage_feature = tf.subtract(feature, 1.)
-        non_zero_coverage_feature = Conv2dUtilities.non_zero_mask(coverage_feature, data_format='channels_last')
-        self.coverage[feature_name].append(tf.reduce_sum(tf.divide(non_zero_coverage_feature, mask_sum)))
+    if self.tfrecords_creator.output_format == 'tiles':
+      tile_container_reader = TileContainerReader([filename])
+      tiles_indices = np.arange(tile_container_reader.number_of_tiles)
+      if sample_tiles:
+        tiles_indices = tiles_indices[random_state.rand(len(tiles_indices)) < self.sample_fraction]
+      for start in range(0, len(tiles_indices), TFRecordsStatistics.TILES_PER_CHUNK):
+        indices = tiles_indices[start:start + TFRecordsStatistics.TILES_PER_CHUNK]
+        features = {}
+        for feature_name in feature_names:
+          features[feature_name] = tile_container_reader.read(indices, [feature_name]).reshape(
+              [len(indices), tiles_height_width, tiles_height_width, -1])
+        yield features
+      return
+    
+    render_passes_precision = self.tfrecords_creator.render_passes_precision
+    options = tf.python_io.TFRecordOptions(
+        Utilities.tfrecords_compression_type(self.tfrecords_creator.compression_type))
+    
+    def _decode(raw_features):
+      features = {}
+      for feature_name in feature_names:
+        precision = render_passes_precision.feature_precision(feature_name)
+        feature = RenderPassesPrecision.decode_numpy(np.stack(raw_features[feature_name]), precision)
+        features[feature_name] = feature.reshape([-1, tiles_height_width, tiles_height_width, feature_names[feature_name]])
+      return features
+    
+    raw_features = {feature_name: [] for feature_name in feature_names}
+    number_of_raw_tiles = 0
+    for serialized_example in tf.python_io.tf_record_iterator(filename, options=options):
+      # The records still need to be decompressed, but the skipped ones are not parsed and decoded.
+      if sample_tiles and random_state.rand() >= self.sample_fraction:
+        continue
+      example = tf.train.Example.FromString(serialized_example)
+      for feature_name in feature_names:
+        precision = render_passes_precision.feature_precision(feature_name)
+        raw_features[feature_name].append(np.frombuffer(
+            example.features.feature[feature_name].bytes_list.value[0],
+            dtype=RenderPassesPrecision.numpy_dtype(precision)))
+      number_of_raw_tiles = number_of_raw_tiles + 1
+      if number_of_raw_tiles == TFRecordsStatistics.TILES_PER_CHUNK:
+        yield _decode(raw_features)
+        raw_features = {feature_name: [] for feature_name in feature_names}
+        number_of_raw_tiles = 0
+    if number_of_raw_tiles > 0:
+      yield _decode(raw_features)
 
-      self.minimums_log1p[feature_name] = tf.minimum(self.minimums_log1p[feature_name], tf.reduce_min(feature_log1p))
-      self.maximums_log1p[feature_name] = tf.maximum(self.maximums_log1p[feature_name], tf.reduce_max(feature_log1p))
-      if tf.greater(mask_sum, 0.):
-        self.means_log1p[feature_name].append(tf.reduce_sum(tf.divide(tf.multiply(feature_log1p, mask), mask_sum)))
-      
-    else:
-      self.minimums[feature_name] = tf.minimum(self.minimums[feature_name], tf.reduce_min(feature))
-      self.maximums[feature_name] = tf.maximum(self.maximums[feature_name], tf.reduce_max(feature))
-      self.means[feature_name].append(tf.reduce_mean(feature))
-      
-      coverage_feature = feature
-      if RenderPasses.ALPHA in feature_name:
-        coverage_feature = tf.subtract(feature, 1.)
-      non_zero_coverage_feature = Conv2dUtilities.non_zero_mask(coverage_feature, data_format='channels_last')
-      self.coverage[feature_name].append(tf.reduce_mean(non_zero_coverage_feature))
+  def _tiles_feature_names(self, source_samples_per_pixel_list):
+    # The stored features which are needed for the statistics, with their number of channels.
+    result = {}
+    for source_samples_per_pixel in source_samples_per_pixel_list:
+      for source_index in range(self.tfrecords_creator.number_of_sources_per_example):
+        for source_render_pass in self.tfrecords_creator.source_render_passes_usage.render_passes():
+          indexed_source_feature_name = Naming.source_feature_name(
+              source_render_pass, samples_per_pixel=source_samples_per_pixel, index=source_index)
+          result[indexed_source_feature_name] = RenderPasses.number_of_channels(source_render_pass)
+    for target_render_pass in self.tfrecords_creator.target_render_passes_usage.render_passes():
+      result[Naming.target_feature_name(target_render_pass)] = RenderPasses.number_of_channels(target_render_pass)
+    return result
 
-      self.minimums_log1p[feature_name] = tf.minimum(self.minimums_log1p[feature_name], tf.reduce_min(feature_log1p))
-      self.maximums_log1p[feature_name] = tf.maximum(self.maximums_log1p[feature_name], tf.reduce_max(feature_log1p))
-      self.means_log1p[feature_name].append(tf.reduce_mean(feature_log1p))
-  
-  def _second_statistics_iteration(self, feature, render_pass_name, feature_name, use_mask, target_features):
+  def _add_tiles_to_statistics(self, features, source_samples_per_pixel_list, running_statistics):
+    for source_samples_per_pixel in source_samples_per_pixel_list:
+      for source_index in range(self.tfrecords_creator.number_of_sources_per_example):
+        for source_render_pass in self.tfrecords_creator.source_render_passes_usage.render_passes():
+          indexed_source_feature_name = Naming.source_feature_name(
+              source_render_pass, samples_per_pixel=source_samples_per_pixel, index=source_index)
+          source_feature = features[indexed_source_feature_name]
+          feature_name = Naming.source_feature_name(source_render_pass)
+          TFRecordsStatistics._add_to_statistics(
+              source_feature, source_render_pass, feature_name, False, features,
+              running_statistics[feature_name])
+          if TFRecordsStatistics._is_masked_render_pass(source_render_pass):
+            feature_name = Naming.source_feature_name(source_render_pass, masked=True)
+            TFRecordsStatistics._add_to_statistics(
+                source_feature, source_render_pass, feature_name, True, features,
+                running_statistics[feature_name])
+    
+    for target_render_pass in self.tfrecords_creator.target_render_passes_usage.render_passes():
+      target_feature = features[Naming.target_feature_name(target_render_pass)]
+      feature_name = Naming.target_feature_name(target_render_pass)
+      TFRecordsStatistics._add_to_statistics(
+          target_feature, target_render_pass, feature_name, False, features,
+          running_statistics[feature_name])
+      if TFRecordsStatistics._is_masked_render_pass(target_render_pass):
+        feature_name = Naming.target_feature_name(target_render_pass, masked=True)
+        TFRecordsStatistics._add_to_statistics(
+            target_feature, target_render_pass, feature_name, True, features,
+            running_statistics[feature_name])
+
+  def _statistics_features(self):
+    # The names of all the features with statistics, together with their render pass and whether they are masked.
+    result = []
+    for source_render_pass in self.tfrecords_creator.source_render_passes_usage.render_passes():
+      result.append((Naming.source_feature_name(source_render_pass), source_render_pass, False))
+      if TFRecordsStatistics._is_masked_render_pass(source_render_pass):
+        result.append((Naming.source_feature_name(source_render_pass, masked=True), source_render_pass, True))
+    for target_render_pass in self.tfrecords_creator.target_render_passes_usage.render_passes():
+      result.append((Naming.target_feature_name(target_render_pass), target_render_pass, False))
+      if TFRecordsStatistics._is_masked_render_pass(target_render_pass):
+        result.append((Naming.target_feature_name(target_render_pass, masked=True), target_render_pass, True))
+    return result
+
+  @staticmethod
+  def _is_masked_render_pass(render_pass_name):
+    return (
+        RenderPasses.is_direct_or_indirect_render_pass(render_pass_name) and not
+        RenderPasses.is_volume_render_pass(render_pass_name))
+
+  @staticmethod
+  def _add_to_statistics(feature, render_pass_name, feature_name, use_mask, features, feature_running_statistics):
+    # The feature is a batch of tiles as numpy array with the channels last.
+    number_of_tiles = feature.shape[0]
+    number_of_channels = feature.shape[-1]
+    feature_log1p = np.sign(feature) * np.log1p(np.abs(feature))
     
-    mean = self.means[feature_name]
-    mean_log1p = self.means_log1p[feature_name]
-    feature_log1p = Utilities.signed_log1p(feature)
+    coverage_feature = feature
+    if RenderPasses.ALPHA in feature_name:
+      coverage_feature = feature - 1.
+    covered = np.any(coverage_feature != 0., axis=-1)
     
     if use_mask:
       # For direct and indirect passes, we only care about the relevant pixels. We create a mask for this.
       # It depends on the corresponding ground truth color pass. Whenever that one is not black, the pixels
       # of the direct and indirect passes matter.
-      
       corresponding_color_pass = RenderPasses.direct_or_indirect_to_color_render_pass(render_pass_name)
-      corresponding_target_feature = target_features[Naming.target_feature_name(corresponding_color_pass)]
-      mask = Conv2dUtilities.non_zero_mask(corresponding_target_feature, data_format='channels_last')
-      mask_sum = tf.reduce_sum(mask)
+      corresponding_target_feature = features[Naming.target_feature_name(corresponding_color_pass)]
+      mask = np.any(corresponding_target_feature != 0., axis=-1)
       
-      # Adjust the mask, such that it can be multiplied with the feature.
-      mask = tf.stack([mask, mask, mask], axis=2)
-      
-      
-      if tf.greater(mask_sum, 0.):
-        self.variances[feature_name].append(
-            tf.reduce_sum(tf.divide(tf.multiply(tf.square(tf.subtract(feature, mean)), mask), mask_sum)))
-      if tf.greater(mask_sum, 0.):
-        self.variances_log1p[feature_name].append(
-            tf.reduce_sum(tf.divide(tf.multiply(tf.square(tf.subtract(feature_log1p, mean_log1p)), mask), mask_sum)))
+      # Only the relevant pixels count for the means and coverages of the tiles.
+      tile_pixel_counts = np.sum(mask.reshape([number_of_tiles, -1]), axis=1)
+      tile_sums = np.sum((feature * mask[..., np.newaxis]).reshape([number_of_tiles, -1]), axis=1)
+      tile_covered_counts = np.sum((covered & mask).reshape([number_of_tiles, -1]), axis=1)
       
+      feature = feature[mask]
+      feature_log1p = feature_log1p[mask]
+      covered = covered[mask]
     else:
-      self.variances[feature_name].append(tf.reduce_mean(tf.square(tf.subtract(feature, mean))))
-      self.variances_log1p[feature_name].append(tf.reduce_mean(tf.square(tf.subtract(feature_log1p, mean_log1p))))
+      tile_pixel_counts = np.full([number_of_tiles], covered[0].size)
+      tile_sums = np.sum(feature.reshape([number_of_tiles, -1]), axis=1)
+      tile_covered_counts = np.sum(covered.reshape([number_of_tiles, -1]), axis=1)
     
-  def _dataset_iterator(self, group_by_samples_per_pixel, source_samples_per_pixel_list):
-    directory = os.path.join(self.tfrecords_creator.base_tfrecords_directory, self.tfrecords_creator.name)
-    if group_by_samples_per_pixel:
-      assert len(source_samples_per_pixel_list) == 1
-      directory = os.path.join(directory, str(source_samples_per_pixel_list[0]))
-    files = tf.data.Dataset.list_files(directory + '/*')
-
-    threads = multiprocessing.cpu_count()
-    dataset = tf.data.TFRecordDataset(files, compression_type='GZIP', buffer_size=None, num_parallel_reads=threads)
-
-
-    def _feature_parser(serialized_example):
-      features = {}
-
-      for samples_per_pixel in source_samples_per_pixel_list:
-        for source_index in range(self.tfrecords_creator.number_of_sources_per_example):
-          for source_render_pass in self.tfrecords_creator.source_render_passes_usage.render_passes():
-            indexed_source_feature_name = Naming.source_feature_name(source_render_pass, samples_per_pixel=samples_per_pixel, index=source_index)
-            features[indexed_source_feature_name] = tf.FixedLenFeature([], tf.string)
-      for target_render_pass in self.tfrecords_creator.target_render_passes_usage.render_passes():
-        features[Naming.target_feature_name(target_render_pass)] = tf.FixedLenFeature([], tf.string)
-      
-      parsed_features = tf.parse_single_example(serialized_example, features)
-      
-      source_features = {}
-      for samples_per_pixel in source_samples_per_pixel_list:
-        for source_index in range(self.tfrecords_creator.number_of_sources_per_example):
-          for source_render_pass in self.tfrecords_creator.source_render_passes_usage.render_passes():
-            indexed_source_feature_name = Naming.source_feature_name(source_render_pass, samples_per_pixel=samples_per_pixel, index=source_index)
-            source_feature = tf.decode_raw(
-                parsed_features[indexed_source_feature_name], tf.float32)
-            number_of_channels = RenderPasses.number_of_channels(source_render_pass)
-            source_feature = tf.reshape(
-                source_feature, [self.tfrecords_creator.tiles_height_width, self.tfrecords_creator.tiles_height_width, number_of_channels])
-            source_features[indexed_source_feature_name] = source_feature
-      
-      target_features = {}
-      for target_render_pass in self.tfrecords_creator.target_render_passes_usage.render_passes():
-        target_feature = tf.decode_raw(
-            parsed_features[Naming.target_feature_name(target_render_pass)], tf.float32)
-        number_of_channels = RenderPasses.number_of_channels(target_render_pass)
-        target_feature = tf.reshape(
-            target_feature, [self.tfrecords_creator.tiles_height_width, self.tfrecords_creator.tiles_height_width, number_of_channels])
-        target_features[Naming.target_feature_name(target_render_pass)] = target_feature
-      
-      return source_features, target_features
-
-    dataset = dataset.map(map_func=_feature_parser, num_parallel_calls=threads)
-    iterator = tfe.Iterator(dataset)
-    return iterator
+    feature_running_statistics.add(
+        feature, feature_log1p, covered, tile_pixel_counts * number_of_channels, tile_sums,
+        tile_pixel_counts, tile_covered_counts)
 
 class DataStatisticsEncoder(json.JSONEncoder):
   def default(self, obj):
@@ -372,4 +291,15 @@ class DataStatisticsEncoder(json.JSONEncoder):
       return obj.__json__()
     if hasattr(obj, '__dict__'):
       return obj.__dict__
-    return json.JSONEncoder.default(self, obj)
\ No newline at end of file
+    return json.JSONEncoder.default(self, obj)
+
+# The object which is used by the processes of TFRecordsStatistics._files_statistics_in_processes.
+_tfrecords_statistics = None
+
+def _initialize_tfrecords_statistics(tfrecords_statistics):
+  global _tfrecords_statistics
+  _tfrecords_statistics = tfrecords_statistics
+
+def _file_statistics(arguments):
+  filename, source_samples_per_pixel_list, seed = arguments
+  return _tfrecords_statistics._file_statistics(filename, source_samples_per_pixel_list, seed)
@@ -0,0 +1,126 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import hashlib
+import threading
+import collections
+
+import numpy as np
+
+class TileCache:
+
+  # Keeps the decoded tiles of tfrecords files, such that they only have to be decompressed and parsed once.
+  # All the tiles of a tfrecords file are stored as one float32 array with one row per tile, in which the
+  # features are concatenated in a fixed layout.
+  #
+  # The tiles are kept in memory up to ram_size bytes, where the least recently used are evicted first.
+  # If a disk directory is given, the tiles are additionally stored there as npy files, which are loaded into
+  # memory again when they are needed after they were evicted. Each npy file comes with a json file naming the
+  # tfrecords file it was created from. Those which are outdated, because their tfrecords file changed or is
+  # gone, are removed when the cache is opened.
+
+  def __init__(self, number_of_sources_per_example, ram_size, disk_directory=None):
+    # The tiles of all the sources are kept, such that they can be used for any index tuples.
+    self.number_of_sources_per_example = number_of_sources_per_example
+    self.ram_size = ram_size
+    self.disk_directory = disk_directory
+    if self.disk_directory != None:
+      os.makedirs(self.disk_directory, exist_ok=True)
+      self._prune_disk()
+
+    self.lock = threading.Lock()
+    self.ram_tiles = collections.OrderedDict()
+    self.ram_tiles_size = 0
+    
+    # The tfrecords files don't change during the training, that's why their keys are only computed once.
+    self.keys = {}
+
+  def tiles(self, filename, layout, load_tiles):
+    key = self._key(filename, layout)
+
+    with self.lock:
+      if key in self.ram_tiles:
+        self.ram_tiles.move_to_end(key)
+        return self.ram_tiles[key]
+
+    if self.disk_directory != None:
+      disk_filename = os.path.join(self.disk_directory, key + '.npy')
+      if os.path.isfile(disk_filename):
+        tiles = np.load(disk_filename)
+        self._add_to_ram(key, tiles)
+        return tiles
+
+    tiles = load_tiles()
+    if self.disk_directory != None:
+      # Written under a temporary name first, such that an interrupted training never leaves a broken file.
+      # The json file is written last, such that an npy file without it is known to be incomplete.
+      temporary_disk_filename = disk_filename + '.' + str(threading.get_ident()) + '.tmp'
+      with open(temporary_disk_filename, 'wb') as disk_file:
+        np.save(disk_file, tiles)
+      os.replace(temporary_disk_filename, disk_filename)
+      
+      size, mtime_ns = TileCache._stamp(filename)
+      source = {'filename': os.path.abspath(filename), 'size': size, 'mtime_ns': mtime_ns}
+      temporary_source_filename = os.path.join(
+          self.disk_directory, key + '.json.' + str(threading.get_ident()) + '.tmp')
+      with open(temporary_source_filename, 'w', encoding='utf-8') as source_file:
+        source_file.write(json.dumps(source, sort_keys=True))
+      os.replace(temporary_source_filename, os.path.join(self.disk_directory, key + '.json'))
+
+    self._add_to_ram(key, tiles)
+    return tiles
+
+  def _add_to_ram(self, key, tiles):
+    if tiles.nbytes > self.ram_size:
+      return
+    with self.lock:
+      if key in self.ram_tiles:
+        return
+      self.ram_tiles[key] = tiles
+      self.ram_tiles_size = self.ram_tiles_size + tiles.nbytes
+      while self.ram_tiles_size > self.ram_size:
+        _, evicted_tiles = self.ram_tiles.popitem(last=False)
+        self.ram_tiles_size = self.ram_tiles_size - evicted_tiles.nbytes
+
+  def _prune_disk(self):
+    # Removes the temporary files of an interrupted training, the npy files which were not completed and
+    # those whose tfrecords file changed or is gone.
+    filenames = set(os.listdir(self.disk_directory))
+    up_to_date_keys = set()
+    for filename in filenames:
+      if not filename.endswith('.json'):
+        continue
+      key = filename[:-len('.json')]
+      with open(os.path.join(self.disk_directory, filename), 'r', encoding='utf-8') as source_file:
+        source = json.loads(source_file.read())
+      if (
+          os.path.isfile(source['filename']) and
+          TileCache._stamp(source['filename']) == (source['size'], source['mtime_ns'])):
+        up_to_date_keys.add(key)
+    
+    for filename in filenames:
+      if filename.endswith('.json') or filename.endswith('.npy'):
+        if os.path.splitext(filename)[0] in up_to_date_keys:
+          continue
+      elif not filename.endswith('.tmp'):
+        continue
+      os.remove(os.path.join(self.disk_directory, filename))
+
+  def _key(self, filename, layout):
+    layout_key = (filename, tuple(layout))
+    if not layout_key in self.keys:
+      # A tfrecords file which is recreated has a different size or modification time.
+      size, mtime_ns = TileCache._stamp(filename)
+      key = hashlib.sha1()
+      key.update((
+          os.path.abspath(filename) + ' ' + str(size) + ' ' + str(mtime_ns) + ' ' + ' '.join(layout)).encode('utf-8'))
+      self.keys[layout_key] = key.hexdigest()
+    return self.keys[layout_key]
+
+  @staticmethod
+  def _stamp(filename):
+    filename_stat = os.stat(filename)
+    return filename_stat.st_size, filename_stat.st_mtime_ns
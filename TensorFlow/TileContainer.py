@@ -0,0 +1,176 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import struct
+
+import numpy as np
+
+from RenderPassesPrecision import RenderPassesPrecision
+
+class TileContainer:
+
+  # A tile container stores tiles in a fixed layout, which allows to memory map it and to access every tile
+  # directly. It starts with a header, followed by the tiles. Each tile contains all the features one after the
+  # other in the order of the header's layout.
+  #
+  # magic (8 bytes) | header size (8 bytes, little endian) | json header | padding | tile 0 | tile 1 | ...
+  #
+  # The json header contains the tiles_height_width and the layout with the name, number of channels, data
+  # type and precision of each feature, together with the description given by the writer.
+
+  MAGIC = b'DDTILES1'
+  EXTENSION = '.tiles'
+  ALIGNMENT = 64
+
+
+class TileContainerWriter:
+
+  def __init__(self, filename, tiles_height_width, dtype='float32', description=None, render_passes_precision=None):
+    self.filename = filename
+    self.tiles_height_width = tiles_height_width
+    self.dtype = dtype
+    self.description = description
+    if render_passes_precision == None:
+      render_passes_precision = RenderPassesPrecision()
+    self.render_passes_precision = render_passes_precision
+    self.file = None
+    self.layout = None
+
+  def write(self, features):
+    # The features are a dictionary with the name and the tile of each feature.
+    if self.file == None:
+      self.layout = []
+      for name in sorted(features.keys()):
+        precision = self.render_passes_precision.feature_precision(name)
+        dtype = self.dtype
+        if precision != RenderPassesPrecision.FLOAT32:
+          dtype = 'float16'
+        self.layout.append({
+            'name': name,
+            'channels': TileContainerWriter._channels(features[name]),
+            'dtype': dtype,
+            'precision': precision})
+      self.file = open(self.filename, 'wb')
+      self._write_header()
+
+    for entry in self.layout:
+      tile = features[entry['name']]
+      if entry['precision'] != RenderPassesPrecision.FLOAT32:
+        tile = RenderPassesPrecision.encode(tile, entry['precision'])
+      tile = np.ascontiguousarray(tile, dtype=entry['dtype'])
+      if tile.ndim == 2:
+        tile = np.expand_dims(tile, axis=2)
+      self.file.write(tile.tobytes())
+
+  @staticmethod
+  def _channels(tile):
+    # Single channel render passes like alpha and depth are loaded as 2-D arrays.
+    if tile.ndim == 3:
+      return int(tile.shape[2])
+    return 1
+
+  def close(self):
+    if self.file != None:
+      self.file.close()
+      self.file = None
+
+  def _write_header(self):
+    header = {}
+    if self.description != None:
+      header.update(self.description)
+    header['tiles_height_width'] = self.tiles_height_width
+    header['layout'] = self.layout
+    header_content = json.dumps(header, sort_keys=True).encode('utf-8')
+
+    # The tiles start aligned.
+    header_size = len(TileContainer.MAGIC) + 8 + len(header_content)
+    padding = (TileContainer.ALIGNMENT - header_size % TileContainer.ALIGNMENT) % TileContainer.ALIGNMENT
+    header_content = header_content + b' ' * padding
+
+    self.file.write(TileContainer.MAGIC)
+    self.file.write(struct.pack('<Q', len(header_content)))
+    self.file.write(header_content)
+
+
+class TileContainerReader:
+
+  # Memory maps all the given tile containers, which need to have the same layout. The tiles of all the
+  # containers are indexed one after the other.
+
+  def __init__(self, filenames):
+    if len(filenames) == 0:
+      raise Exception('No tile containers are given.')
+    self.filenames = sorted(filenames)
+    self.header = None
+    self.tiles = []
+    for filename in self.filenames:
+      header, data_offset = TileContainerReader._read_header(filename)
+      if self.header == None:
+        self.header = header
+        self.tiles_height_width = header['tiles_height_width']
+        self.layout = header['layout']
+        self.dtype = np.dtype([
+            (entry['name'], entry['dtype'], (self.tiles_height_width, self.tiles_height_width, entry['channels']))
+            for entry in self.layout])
+        self.sizes = {}
+        self.precisions = {}
+        for entry in self.layout:
+          self.sizes[entry['name']] = self.tiles_height_width * self.tiles_height_width * entry['channels']
+          self.precisions[entry['name']] = entry.get('precision', RenderPassesPrecision.FLOAT32)
+      elif header['layout'] != self.layout or header['tiles_height_width'] != self.tiles_height_width:
+        raise Exception('The tile container ' + filename + ' has a different layout.')
+
+      number_of_tiles = (os.path.getsize(filename) - data_offset) // self.dtype.itemsize
+      if number_of_tiles > 0:
+        self.tiles.append(np.memmap(filename, dtype=self.dtype, mode='r', offset=data_offset, shape=(number_of_tiles,)))
+
+    self.tiles_offsets = np.cumsum([0] + [len(tiles) for tiles in self.tiles])
+    self.number_of_tiles = int(self.tiles_offsets[-1])
+
+  def names(self):
+    return [entry['name'] for entry in self.layout]
+
+  def tile(self, index):
+    # Dictionary with the features of the tile, upcast to float32.
+    tiles_index, tile_index = self._locate(index)
+    tile = self.tiles[tiles_index][tile_index]
+    result = {}
+    for entry in self.layout:
+      result[entry['name']] = RenderPassesPrecision.decode_numpy(tile[entry['name']], self._precision(entry['name']))
+    return result
+
+  def read(self, indices, names):
+    # The requested features of the tiles, upcast to float32 and concatenated in the order of the names.
+    # The result has one row per tile.
+    indices = np.asarray(indices)
+    tiles_indices = np.searchsorted(self.tiles_offsets, indices, side='right') - 1
+    result = np.empty([len(indices), sum(self.sizes[name] for name in names)], dtype=np.float32)
+    for tiles_index in np.unique(tiles_indices):
+      mask = tiles_indices == tiles_index
+      tiles = self.tiles[tiles_index][indices[mask] - self.tiles_offsets[tiles_index]]
+      result[mask] = np.concatenate([
+          RenderPassesPrecision.decode_numpy(tiles[name].reshape([len(tiles), -1]), self._precision(name))
+          for name in names], axis=1)
+    return result
+
+  def _precision(self, name):
+    # Containers written before the precision was stored only contain plain values.
+    return self.precisions.get(name, RenderPassesPrecision.FLOAT32)
+
+  def _locate(self, index):
+    tiles_index = int(np.searchsorted(self.tiles_offsets, index, side='right') - 1)
+    return tiles_index, index - int(self.tiles_offsets[tiles_index])
+
+  @staticmethod
+  def _read_header(filename):
+    with open(filename, 'rb') as tile_container_file:
+      magic = tile_container_file.read(len(TileContainer.MAGIC))
+      if magic != TileContainer.MAGIC:
+        raise Exception('Not a tile container: ' + filename)
+      header_size = struct.unpack('<Q', tile_container_file.read(8))[0]
+      header = json.loads(tile_container_file.read(header_size).decode('utf-8'))
+    data_offset = len(TileContainer.MAGIC) + 8 + header_size
+    return header, data_offset
@@ -0,0 +1,154 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+
+import numpy as np
+
+class Tiling:
+
+  # Splits images into overlapping tiles of tile_size and stitches the predicted tiles back together. The
+  # overlapping borders are either cropped or blended with linear or cosine weights.
+
+  @staticmethod
+  def bounds_and_counts(height, width, tile_size, tile_overlap_size):
+    # Split the images into tiles.
+    iteration_delta = tile_size - (2 * tile_overlap_size)
+
+    width_count = width - (2 * tile_overlap_size) - (2 * iteration_delta)
+    width_count = width_count / iteration_delta
+    width_count = math.ceil(width_count) + 2
+
+    height_count = height - (2 * tile_overlap_size) - (2 * iteration_delta)
+    height_count = height_count / iteration_delta
+    height_count = math.ceil(height_count) + 2
+
+    tiles_bounds = []
+    for height_index in range(height_count):
+      if height_index == 0:
+        lower_height = 0
+        upper_height = tile_size
+      elif height_index == height_count - 1:
+        upper_height = height
+        lower_height = upper_height - tile_size
+      else:
+        lower_height = height_index * iteration_delta
+        upper_height = lower_height + tile_size
+
+      for width_index in range(width_count):
+        if width_index == 0:
+          lower_width = 0
+          upper_width = tile_size
+        elif width_index == width_count - 1:
+          upper_width = width
+          lower_width = upper_width - tile_size
+        else:
+          lower_width = width_index * iteration_delta
+          upper_width = lower_width + tile_size
+
+        tiles_bounds.append((lower_height, upper_height, lower_width, upper_width))
+
+    return tiles_bounds, height_count, width_count
+
+  @staticmethod
+  def split(features, tiles_bounds):
+    # All the tiles of a feature are stacked into one array.
+    tiles = {}
+    for feature_name in features:
+      feature = features[feature_name]
+      tiles[feature_name] = np.stack([
+          feature[lower_height:upper_height, lower_width:upper_width]
+          for lower_height, upper_height, lower_width, upper_width in tiles_bounds])
+    return tiles
+
+  @staticmethod
+  def stitching_crop(index, count, tile_size, tile_overlap_size, size):
+    # The part of a tile which ends up in the image, when the overlapping borders are cropped.
+    lower = 0
+    upper = tile_size
+    if index != 0 and index != count - 1:
+      lower = tile_overlap_size
+      upper = upper - tile_overlap_size
+    elif index == 0 and index == count - 1:
+      pass
+    elif index == 0:
+      upper = upper - tile_overlap_size
+    else:
+      assert index == count - 1
+      existing_size = tile_overlap_size + ((count - 1) * (tile_size - (2 * tile_overlap_size)))
+      remaining_size = size - existing_size
+      lower = upper - remaining_size
+    return lower, upper
+
+  @staticmethod
+  def blending_weights(index, count, tile_size, tile_overlap_size, tile_blending):
+    # The weights fade in and out across the overlapping band of 2 * tile_overlap_size. The weights of
+    # two neighboring tiles add up to one and they are never zero, such that they can be normalized.
+    weights = np.ones([tile_size], dtype=np.float32)
+    band_size = 2 * tile_overlap_size
+    if band_size > 0:
+      ramp = (np.arange(band_size, dtype=np.float32) + 0.5) / band_size
+      if tile_blending == 'cosine':
+        ramp = 0.5 - (0.5 * np.cos(np.pi * ramp))
+      if index != 0:
+        weights[:band_size] = np.minimum(weights[:band_size], ramp)
+      if index != count - 1:
+        weights[-band_size:] = np.minimum(weights[-band_size:], ramp[::-1])
+    return weights
+
+  @staticmethod
+  def stitch(
+      tiled_predictions, prediction_names, height, width, tiles_bounds,
+      height_count, width_count, tile_size, tile_overlap_size, tile_blending='crop'):
+    # The placement of the tiles is the same for all the predictions, so it is only computed once.
+    tiles_placement = []
+    for tile_index, (lower_height, upper_height, lower_width, upper_width) in enumerate(tiles_bounds):
+      height_index = tile_index // width_count
+      width_index = tile_index % width_count
+      if tile_blending == 'crop':
+        crop_lower_height, crop_upper_height = Tiling.stitching_crop(
+            height_index, height_count, tile_size, tile_overlap_size, height)
+        crop_lower_width, crop_upper_width = Tiling.stitching_crop(
+            width_index, width_count, tile_size, tile_overlap_size, width)
+        tiles_placement.append((
+            slice(lower_height + crop_lower_height, lower_height + crop_upper_height),
+            slice(lower_width + crop_lower_width, lower_width + crop_upper_width),
+            slice(crop_lower_height, crop_upper_height),
+            slice(crop_lower_width, crop_upper_width),
+            None))
+      else:
+        tile_weights = np.outer(
+            Tiling.blending_weights(height_index, height_count, tile_size, tile_overlap_size, tile_blending),
+            Tiling.blending_weights(width_index, width_count, tile_size, tile_overlap_size, tile_blending))
+        tiles_placement.append((
+            slice(lower_height, upper_height), slice(lower_width, upper_width),
+            slice(0, tile_size), slice(0, tile_size),
+            tile_weights[:, :, np.newaxis]))
+
+    if tile_blending != 'crop':
+      weights_sum = np.zeros([height, width, 1], dtype=np.float32)
+      for image_height, image_width, _, _, tile_weights in tiles_placement:
+        weights_sum[image_height, image_width] += tile_weights
+
+    # Each prediction is written into a preallocated image.
+    predictions = {}
+    for prediction_name in prediction_names:
+      first_prediction = tiled_predictions[0][prediction_name]
+      shape = [height, width] + list(first_prediction.shape[2:])
+
+      if tile_blending == 'crop':
+        prediction = np.empty(shape, dtype=first_prediction.dtype)
+        for tile_predictions, (image_height, image_width, tile_height, tile_width, _) in zip(
+            tiled_predictions, tiles_placement):
+          prediction[image_height, image_width] = tile_predictions[prediction_name][tile_height, tile_width]
+      else:
+        prediction = np.zeros(shape, dtype=first_prediction.dtype)
+        for tile_predictions, (image_height, image_width, _, _, tile_weights) in zip(
+            tiled_predictions, tiles_placement):
+          prediction[image_height, image_width] += tile_weights * tile_predictions[prediction_name]
+        prediction /= weights_sum
+
+      predictions[prediction_name] = prediction
+
+    return predictions
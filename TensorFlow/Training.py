@@ -5,10 +5,12 @@ from __future__ import print_function
 import argparse
 import os
 import sys
+import glob
 import json
 import random
 
 import tensorflow as tf
+import numpy as np
 import multiprocessing
 
 from FeatureFlags import FeatureFlags
@@ -28,7 +30,12 @@ from LossDifference import LossDifference
 from LossDifference import LossDifferenceEnum
 from Naming import Naming
 from RenderPasses import RenderPasses
+from RenderPassesPrecision import RenderPassesPrecision
 from FeatureEngineering import FeatureEngineering
+import Utilities
+from TileCache import TileCache
+from TileContainer import TileContainer
+from TileContainer import TileContainerReader
 
 parser = argparse.ArgumentParser(description='Training for the DeepDenoiser.')
 
@@ -52,6 +59,24 @@ parser.add_argument(
     '--validation_interval', type=int, default=1,
     help='Number of epochs after which a validation is made.')
 
+parser.add_argument(
+    '--continuous', action="store_true",
+    help='Train all the epochs with one graph and session, instead of restarting them for every epoch. '
+         'The validations are made in memory every --validation_steps steps.')
+
+parser.add_argument(
+    '--validation_steps', type=int, default=5000,
+    help='Number of steps after which a validation is made in continuous training.')
+
+parser.add_argument(
+    '--tile_cache_size', type=int, default=0,
+    help='Megabytes of memory used to cache the decoded training tiles, which avoids decompressing and '
+         'parsing them again in later epochs.')
+
+parser.add_argument(
+    '--tile_cache_directory', type=str, default=None,
+    help='Directory in which the decoded training tiles are cached in addition to the memory.')
+
 parser.add_argument(
     '--data_format', type=str, default='channels_first',
     choices=['channels_first', 'channels_last'],
@@ -508,44 +533,85 @@ class FeatureTrainingLoader:
       if self.feature_prediction.is_target:
         dictionary[Naming.target_feature_name(self.feature_prediction.name)] = tf.FixedLenFeature([], tf.string)
 
-  def deserialize(self, parsed_features, source_samples_per_pixel_list, required_indices, height, width):
+  def deserialize(
+      self, parsed_features, source_samples_per_pixel_list, required_indices, height, width, batched=False,
+      render_passes_precision=None):
+    # With batched, the parsed features contain a batch of serialized tiles, which are decoded at once.
+    # Render passes which are stored with a reduced precision are upcast to float32.
+    if render_passes_precision == None:
+      render_passes_precision = RenderPassesPrecision()
+    precision = render_passes_precision.precision(self.feature_prediction.name)
+    shape = [height, width, self.feature_prediction.number_of_channels]
+    if batched:
+      shape = [-1] + shape
+    
     self.source = {}
     if self.feature_prediction.load_data:
       for samples_per_pixel in source_samples_per_pixel_list:
         internal_source = {}
         self.source[samples_per_pixel] = internal_source
         for index in required_indices:
-          internal_source[index] = tf.decode_raw(
-              parsed_features[Naming.source_feature_name(self.feature_prediction.name, samples_per_pixel=samples_per_pixel, index=index)], tf.float32)
-          internal_source[index] = tf.reshape(internal_source[index], [height, width, self.feature_prediction.number_of_channels])
+          internal_source[index] = RenderPassesPrecision.decode_raw(
+              parsed_features[Naming.source_feature_name(self.feature_prediction.name, samples_per_pixel=samples_per_pixel, index=index)], precision)
+          internal_source[index] = tf.reshape(internal_source[index], shape)
 
       if self.feature_prediction.is_target:
-        self.target = tf.decode_raw(parsed_features[Naming.target_feature_name(self.feature_prediction.name)], tf.float32)
-        self.target = tf.reshape(self.target, [height, width, self.feature_prediction.number_of_channels])
+        self.target = RenderPassesPrecision.decode_raw(
+            parsed_features[Naming.target_feature_name(self.feature_prediction.name)], precision)
+        self.target = tf.reshape(self.target, shape)
   
-  def add_to_sources_dictionary(self, sources, samples_per_pixel, index_tuple, height, width):
+  def add_to_decoded_layout(self, layout, source_samples_per_pixel_list, indices, height, width):
+    # The names and shapes of the features as they are stored by the tile cache.
+    if self.feature_prediction.load_data:
+      shape = [height, width, self.feature_prediction.number_of_channels]
+      for samples_per_pixel in source_samples_per_pixel_list:
+        for index in indices:
+          layout.append((Naming.source_feature_name(
+              self.feature_prediction.name, samples_per_pixel=samples_per_pixel, index=index), shape))
+      if self.feature_prediction.is_target:
+        layout.append((Naming.target_feature_name(self.feature_prediction.name), shape))
+
+  def initialize_from_decoded(self, decoded_features, source_samples_per_pixel_list, required_indices):
+    self.source = {}
+    if self.feature_prediction.load_data:
+      for samples_per_pixel in source_samples_per_pixel_list:
+        internal_source = {}
+        self.source[samples_per_pixel] = internal_source
+        for index in required_indices:
+          internal_source[index] = decoded_features[
+              Naming.source_feature_name(self.feature_prediction.name, samples_per_pixel=samples_per_pixel, index=index)]
+
+      if self.feature_prediction.is_target:
+        self.target = decoded_features[Naming.target_feature_name(self.feature_prediction.name)]
+
+  def add_to_sources_dictionary(self, sources, samples_per_pixel, index_tuple, height, width, batch_size=None):
     for i in range(len(index_tuple)):
       if self.feature_prediction.load_data:
         index = index_tuple[i]
         sources[Naming.source_feature_name(self.feature_prediction.name, index=i)] = self.source[samples_per_pixel][index]
       else:
         assert self.feature_prediction.feature_prediction_type != FeaturePredictionType.AUXILIARY
-        source = tf.ones([height, width, self.feature_prediction.number_of_channels])
+        source = tf.ones(self._shape(height, width, batch_size))
         if self.feature_prediction.feature_prediction_type != FeaturePredictionType.COLOR:
           # Direct and indirect need to be 0.5.
           source = tf.scalar_mul(0.5, source)
         sources[Naming.source_feature_name(self.feature_prediction.name, index=i)] = source
     
-  def add_to_targets_dictionary(self, targets, height, width):
+  def add_to_targets_dictionary(self, targets, height, width, batch_size=None):
     if self.feature_prediction.is_target:
       if self.feature_prediction.load_data:
         targets[Naming.target_feature_name(self.feature_prediction.name)] = self.target
       else:
-        target = tf.ones([height, width, self.feature_prediction.number_of_channels])
+        target = tf.ones(self._shape(height, width, batch_size))
         if self.feature_prediction.feature_prediction_type != FeaturePredictionType.COLOR:
           # Direct and indirect need to be 0.5.
           target = tf.scalar_mul(0.5, target)
         targets[Naming.target_feature_name(self.feature_prediction.name)] = target
+  
+  def _shape(self, height, width, batch_size):
+    if batch_size == None:
+      return [height, width, self.feature_prediction.number_of_channels]
+    return [batch_size, height, width, self.feature_prediction.number_of_channels]
 
 
 class FeatureTrainingAugmentation:
@@ -555,53 +621,110 @@ class FeatureTrainingAugmentation:
     self.is_target = is_target
     self.number_of_channels = number_of_channels
     self.name = name
-  
-  def intialize_from_dictionaries(self, sources, targets):
-    self.source = {}
-    index = 0
-    for i in range(self.number_of_sources):
-      self.source[index] = sources[Naming.source_feature_name(self.name, index=i)]
-      index = index + 1
-    if self.is_target:
-      self.target = targets[Naming.target_feature_name(self.name)]
-  
-  def flip_left_right(self, flip, data_format):
-    if data_format != 'channels_last':
-      raise Exception('Channel last is the only supported format.')
-    for index in range(len(self.source)):
-      self.source[index] = DataAugmentation.flip_left_right(self.source[index], self.name, flip)
-    if self.is_target:
-      self.target = DataAugmentation.flip_left_right(self.target, self.name, flip)
-  
-  def rotate_90(self, k, data_format):
-    for index in range(len(self.source)):
-      self.source[index] = DataAugmentation.rotate_90(self.source[index], k, self.name)
-    if self.is_target:
-      self.target = DataAugmentation.rotate_90(self.target, k, self.name)
-  
-  def permute_rgb(self, permute, data_format):
-    if RenderPasses.is_rgb_color_render_pass(self.name):
-      for index in range(len(self.source)):
-        self.source[index] = DataAugmentation.permute_rgb(self.source[index], permute, self.name)
-      if self.is_target:
-        self.target = DataAugmentation.permute_rgb(self.target, permute, self.name)
-  
-  def rotate_normal(self, normal_rotation, data_format):
-    if self.name == RenderPasses.NORMAL:
-      for index in range(len(self.source)):
-        self.source[index] = DataAugmentation.rotate_normal(self.source[index], normal_rotation, data_format)
-      if self.is_target:
-        self.target = DataAugmentation.rotate_normal(self.target, normal_rotation, data_format)
-  
-  def add_to_sources_dictionary(self, sources):
-    i = 0
-    for index in range(self.number_of_sources):
-      sources[Naming.source_feature_name(self.name, index=index)] = self.source[i]
-      i = i + 1
+
+
+class FusedFeatureTrainingAugmentation:
+
+  # Augments the sources and targets of all the features at once. They are concatenated along the channels,
+  # such that flipping, rotating and permuting are each done once for the whole batch. The channels which need
+  # special treatment, like the screen space normals, are handled with channel indices and signs.
+
+  RGB_PERMUTATIONS = [[0, 2, 1], [1, 0, 2], [1, 2, 0], [2, 0, 1], [2, 1, 0]]
+
+  def __init__(self, feature_trainings_augmentation):
+    self.feature_trainings_augmentation = feature_trainings_augmentation
+  
+  def augment(self, sources, targets, flip, rotate, permute, normal_rotation, data_augmentation_usage):
+    dictionaries = []
+    names = []
+    render_passes = []
+    inputs = []
+    for feature_training_augmentation in self.feature_trainings_augmentation:
+      for index in range(feature_training_augmentation.number_of_sources):
+        dictionaries.append(sources)
+        names.append(Naming.source_feature_name(feature_training_augmentation.name, index=index))
+      if feature_training_augmentation.is_target:
+        dictionaries.append(targets)
+        names.append(Naming.target_feature_name(feature_training_augmentation.name))
+      while len(render_passes) < len(names):
+        render_passes.append(feature_training_augmentation.name)
+    for dictionary, name in zip(dictionaries, names):
+      inputs.append(dictionary[name])
+    
+    number_of_channels = [int(Conv2dUtilities.number_of_channels(feature, 'channels_last')) for feature in inputs]
+    offsets = [sum(number_of_channels[:index]) for index in range(len(inputs))]
+    total_number_of_channels = sum(number_of_channels)
+    
+    screen_space_normal_offsets = []
+    rgb_offsets = []
+    normal_indices = []
+    for index, render_pass in enumerate(render_passes):
+      if render_pass == RenderPasses.SCREEN_SPACE_NORMAL:
+        screen_space_normal_offsets.append(offsets[index])
+      elif render_pass == RenderPasses.NORMAL:
+        normal_indices.append(index)
+      elif RenderPasses.is_rgb_color_render_pass(render_pass):
+        assert number_of_channels[index] == 3
+        rgb_offsets.append(offsets[index])
+    
+    inputs = tf.concat(inputs, 3)
+    
+    if data_augmentation_usage.use_flip_left_right:
+      if len(normal_indices) > 0:
+        raise Exception('Flipping for normals is not supported.')
+      
+      # x -> -x
+      channel_signs = [1.] * total_number_of_channels
+      for offset in screen_space_normal_offsets:
+        channel_signs[offset] = -1.
+      inputs = DataAugmentation.flip_left_right_fused(inputs, flip, channel_signs)
+    
+    if data_augmentation_usage.use_rotate_90:
+      # 90: x -> -y, y -> x
+      # 180: x -> -x, y -> -y
+      # 270: x -> y, y -> -x
+      channel_indices_list = []
+      channel_signs_list = []
+      for rotation in range(1, 4):
+        channel_indices = list(range(total_number_of_channels))
+        channel_signs = [1.] * total_number_of_channels
+        for offset in screen_space_normal_offsets:
+          if rotation != 2:
+            channel_indices[offset], channel_indices[offset + 1] = offset + 1, offset
+          if rotation == 1 or rotation == 2:
+            channel_signs[offset] = -1.
+          if rotation == 2 or rotation == 3:
+            channel_signs[offset + 1] = -1.
+        channel_indices_list.append(channel_indices)
+        channel_signs_list.append(channel_signs)
+      inputs = DataAugmentation.rotate_90_fused(inputs, rotate, channel_indices_list, channel_signs_list)
     
-  def add_to_targets_dictionary(self, targets):
-    if self.is_target:
-      targets[Naming.target_feature_name(self.name)] = self.target
+    if data_augmentation_usage.use_rgb_permutation and len(rgb_offsets) > 0:
+      channel_indices_list = []
+      for permutation in FusedFeatureTrainingAugmentation.RGB_PERMUTATIONS:
+        channel_indices = list(range(total_number_of_channels))
+        for offset in rgb_offsets:
+          for channel in range(3):
+            channel_indices[offset + channel] = offset + permutation[channel]
+        channel_indices_list.append(channel_indices)
+      inputs = DataAugmentation.permute_fused(inputs, permute, channel_indices_list)
+    
+    inputs = tf.split(inputs, number_of_channels, 3)
+    
+    if data_augmentation_usage.use_normal_rotation and len(normal_indices) > 0:
+      # All the normals are rotated with one matrix multiplication per example.
+      normals = tf.concat([inputs[index] for index in normal_indices], 3)
+      height, width = Conv2dUtilities.height_width(normals, 'channels_last')
+      number_of_normal_channels = int(Conv2dUtilities.number_of_channels(normals, 'channels_last'))
+      normals = tf.reshape(normals, [-1, height * width * (number_of_normal_channels // 3), 3])
+      normals = tf.matmul(normals, normal_rotation)
+      normals = tf.reshape(normals, [-1, height, width, number_of_normal_channels])
+      normals = tf.split(normals, [number_of_channels[index] for index in normal_indices], 3)
+      for normal_index, index in enumerate(normal_indices):
+        inputs[index] = normals[normal_index]
+    
+    for dictionary, name, feature in zip(dictionaries, names, inputs):
+      dictionary[name] = feature
 
 
 def model_fn(features, labels, mode, params):
@@ -728,95 +851,160 @@ def model_fn(features, labels, mode, params):
 def input_fn_tfrecords(
     files, feature_trainings_loader, feature_flags, feature_trainings_augmentation,
     number_of_epochs, source_samples_per_pixel_list, index_tuples, required_indices, data_augmentation_usage,
-    tiles_height_width, batch_size, threads, data_format='channels_last'):
+    tiles_height_width, batch_size, threads, compression_type='GZIP', data_format='channels_last', tile_cache=None,
+    tile_container_reader=None, render_passes_precision=None):
+  
+  dataset = dataset_tfrecords(
+      files, feature_trainings_loader, feature_flags, feature_trainings_augmentation,
+      number_of_epochs, source_samples_per_pixel_list, index_tuples, required_indices, data_augmentation_usage,
+      tiles_height_width, batch_size, threads, compression_type, data_format, tile_cache, tile_container_reader,
+      render_passes_precision)
+  
+  iterator = dataset.make_one_shot_iterator()
+  
+  # `features` is a dictionary in which each value is a batch of values for
+  # that feature; `target` is a batch of targets.
+  features, targets = iterator.get_next()
+  return features, targets
 
-  def fast_feature_parser(serialized_example):
-    assert len(index_tuples) == 1
-    assert len(source_samples_per_pixel_list) == 1
-    
-    # Load all the required indices.
+
+def dataset_tfrecords(
+    files, feature_trainings_loader, feature_flags, feature_trainings_augmentation,
+    number_of_epochs, source_samples_per_pixel_list, index_tuples, required_indices, data_augmentation_usage,
+    tiles_height_width, batch_size, threads, compression_type='GZIP', data_format='channels_last', tile_cache=None,
+    tile_container_reader=None, render_passes_precision=None):
+
+  def batch_feature_parser(serialized_examples):
+    # Load all the required indices for the whole batch at once.
     features = {}
     for feature_training_loader in feature_trainings_loader:
       feature_training_loader.add_to_parse_dictionary(features, source_samples_per_pixel_list, required_indices)
     
-    parsed_features = tf.parse_single_example(serialized_example, features)
+    parsed_features = tf.parse_example(serialized_examples, features)
     
     for feature_training_loader in feature_trainings_loader:
-      feature_training_loader.deserialize(parsed_features, source_samples_per_pixel_list, required_indices, tiles_height_width, tiles_height_width)
+      feature_training_loader.deserialize(
+          parsed_features, source_samples_per_pixel_list, required_indices, tiles_height_width, tiles_height_width,
+          batched=True, render_passes_precision=render_passes_precision)
     
-    # Prepare the examples.
-    index_tuple = index_tuples[0]
-    samples_per_pixel = source_samples_per_pixel_list[0]
-    
-    sources = {}
-    targets = {}
+    # The last batch might be smaller.
+    current_batch_size = tf.shape(serialized_examples)[0]
+    return prepare_examples(current_batch_size)
+  
+  # The tile cache and the tile containers provide decoded tiles, in which the features are concatenated.
+  if tile_container_reader != None or tile_cache != None:
+    # The cache keeps all the sources, such that it works for any index tuples.
+    decoded_indices = required_indices
+    if tile_container_reader == None:
+      decoded_indices = range(tile_cache.number_of_sources_per_example)
+    decoded_layout = []
     for feature_training_loader in feature_trainings_loader:
-      feature_training_loader.add_to_sources_dictionary(sources, samples_per_pixel, index_tuple, tiles_height_width, tiles_height_width)
-      feature_training_loader.add_to_targets_dictionary(targets, tiles_height_width, tiles_height_width)
-
-      if feature_flags != None:
-        feature_flags.add_to_source_dictionary(sources, tiles_height_width, tiles_height_width)
-
-    return sources, targets
+      feature_training_loader.add_to_decoded_layout(
+          decoded_layout, source_samples_per_pixel_list, decoded_indices, tiles_height_width, tiles_height_width)
+    decoded_names = [name for name, _ in decoded_layout]
+    decoded_sizes = [int(np.prod(shape)) for _, shape in decoded_layout]
+    tfrecord_options = tf.python_io.TFRecordOptions(Utilities.tfrecords_compression_type(compression_type))
   
-  def feature_parser(serialized_example):
-    dataset = None
+  if render_passes_precision == None:
+    render_passes_precision = RenderPassesPrecision()
+  
+  def load_cached_tiles(filename):
+    filename = filename.decode('utf-8')
     
-    # Load all the required indices.
-    features = {}
-    for feature_training_loader in feature_trainings_loader:
-      feature_training_loader.add_to_parse_dictionary(features, source_samples_per_pixel_list, required_indices)
+    def load_tiles():
+      tiles = []
+      for serialized_example in tf.python_io.tf_record_iterator(filename, options=tfrecord_options):
+        example = tf.train.Example.FromString(serialized_example)
+        tiles.append(np.concatenate([
+            decode_cached_feature(example.features.feature[name].bytes_list.value[0], name)
+            for name in decoded_names]))
+      return np.stack(tiles)
     
-    parsed_features = tf.parse_single_example(serialized_example, features)
+    return tile_cache.tiles(filename, decoded_names, load_tiles)
+  
+  def decode_cached_feature(serialized_feature, name):
+    # The cache always keeps float32 values.
+    precision = render_passes_precision.feature_precision(name)
+    feature = np.frombuffer(serialized_feature, dtype=RenderPassesPrecision.numpy_dtype(precision))
+    return RenderPassesPrecision.decode_numpy(feature, precision)
+  
+  def cached_tiles_dataset(filename):
+    tiles = tf.py_func(load_cached_tiles, [filename], tf.float32, stateful=False)
+    tiles.set_shape([None, sum(decoded_sizes)])
+    return tf.data.Dataset.from_tensor_slices(tiles)
+  
+  def read_tile_container(indices):
+    return tile_container_reader.read(indices, decoded_names)
+  
+  def batch_tile_container_parser(indices):
+    tiles = tf.py_func(read_tile_container, [indices], tf.float32, stateful=False)
+    tiles.set_shape([None, sum(decoded_sizes)])
+    return batch_decoded_tiles_parser(tiles)
+  
+  def batch_decoded_tiles_parser(tiles):
+    decoded_features = {}
+    for name, feature, (_, shape) in zip(decoded_names, tf.split(tiles, decoded_sizes, 1), decoded_layout):
+      decoded_features[name] = tf.reshape(feature, [-1] + shape)
     
     for feature_training_loader in feature_trainings_loader:
-      feature_training_loader.deserialize(parsed_features, source_samples_per_pixel_list, required_indices, tiles_height_width, tiles_height_width)
+      feature_training_loader.initialize_from_decoded(decoded_features, source_samples_per_pixel_list, required_indices)
     
-    # Prepare the examples.
+    # The last batch might be smaller.
+    current_batch_size = tf.shape(tiles)[0]
+    return prepare_examples(current_batch_size)
+  
+  def prepare_examples(current_batch_size):
+    # Prepare the examples. There is one per samples per pixel and index tuple for each serialized example.
+    examples_sources = []
+    examples_targets = []
     for samples_per_pixel in source_samples_per_pixel_list:
       for index_tuple in index_tuples:
         sources = {}
         targets = {}
         for feature_training_loader in feature_trainings_loader:
-          feature_training_loader.add_to_sources_dictionary(sources, samples_per_pixel, index_tuple, tiles_height_width, tiles_height_width)
-          feature_training_loader.add_to_targets_dictionary(targets, tiles_height_width, tiles_height_width)
+          feature_training_loader.add_to_sources_dictionary(
+              sources, samples_per_pixel, index_tuple, tiles_height_width, tiles_height_width, current_batch_size)
+          feature_training_loader.add_to_targets_dictionary(
+              targets, tiles_height_width, tiles_height_width, current_batch_size)
 
           if feature_flags != None:
-            feature_flags.add_to_source_dictionary(sources, tiles_height_width, tiles_height_width)
+            feature_flags.add_to_source_dictionary(sources, tiles_height_width, tiles_height_width, current_batch_size)
         
-        if dataset == None:
-          dataset = tf.data.Dataset.from_tensors((sources, targets))
-        else:
-          dataset = dataset.concatenate(tf.data.Dataset.from_tensors((sources, targets)))
+        examples_sources.append(sources)
+        examples_targets.append(targets)
     
-    return dataset
+    if len(examples_sources) == 1:
+      return examples_sources[0], examples_targets[0]
+    return stack_examples(examples_sources), stack_examples(examples_targets)
+  
+  def stack_examples(examples):
+    # The examples of each serialized example end up next to each other, in the same order as they are
+    # created.
+    result = {}
+    for name in examples[0]:
+      stacked = tf.stack([example[name] for example in examples], axis=1)
+      result[name] = tf.reshape(stacked, [-1] + examples[0][name].shape.as_list()[1:])
+    return result
   
-  def data_augmentation(sources, targets):
+  fused_feature_training_augmentation = FusedFeatureTrainingAugmentation(feature_trainings_augmentation)
+  
+  def batch_data_augmentation(sources, targets):
     with tf.name_scope('data_augmentation'):
-      flip = tf.random_uniform([1], minval=0, maxval=2, dtype=tf.int32)[0]
-      rotate = tf.random_uniform([1], minval=0, maxval=4, dtype=tf.int32)[0]
-      permute = tf.random_uniform([1], minval=0, maxval=6, dtype=tf.int32)[0]
+      # Each example of the batch is augmented on its own.
+      current_batch_size = tf.shape(next(iter(sources.values())))[0]
+      flip = tf.random_uniform([current_batch_size], minval=0, maxval=2, dtype=tf.int32)
+      rotate = tf.random_uniform([current_batch_size], minval=0, maxval=4, dtype=tf.int32)
+      permute = tf.random_uniform([current_batch_size], minval=0, maxval=6, dtype=tf.int32)
       if data_augmentation_usage.use_normal_rotation:
-        normal_rotation = tf.random_uniform([3], dtype=tf.float32)
+        normal_rotation = tf.random_uniform([3, current_batch_size], dtype=tf.float32)
         normal_rotation = DataAugmentation.random_rotation_matrix(normal_rotation)
+      else:
+        normal_rotation = None
       
-      for feature_training_augmentation in feature_trainings_augmentation:
-        feature_training_augmentation.intialize_from_dictionaries(sources, targets)
-        
-        if data_augmentation_usage.use_flip_left_right:
-          feature_training_augmentation.flip_left_right(flip, data_format)
-        
-        if data_augmentation_usage.use_rotate_90:
-          feature_training_augmentation.rotate_90(rotate, data_format)
-
-        if data_augmentation_usage.use_rgb_permutation:
-          feature_training_augmentation.permute_rgb(permute, data_format)
-        
-        if data_augmentation_usage.use_normal_rotation:
-          feature_training_augmentation.rotate_normal(normal_rotation, data_format)
-    
-        feature_training_augmentation.add_to_sources_dictionary(sources)
-        feature_training_augmentation.add_to_targets_dictionary(targets)
+      if data_format != 'channels_last':
+        raise Exception('Channel last is the only supported format.')
+      fused_feature_training_augmentation.augment(
+          sources, targets, flip, rotate, permute, normal_rotation, data_augmentation_usage)
     
     return sources, targets
   
@@ -827,33 +1015,50 @@ def input_fn_tfrecords(
   files = files.repeat(number_of_epochs)
   files = files.shuffle(buffer_size=shuffle_buffer_size)
   
-  dataset = tf.data.TFRecordDataset(files, compression_type='GZIP', buffer_size=None, num_parallel_reads=threads)
-  if len(index_tuples) == 1 and len(source_samples_per_pixel_list) == 1:
-    dataset = dataset.map(map_func=fast_feature_parser, num_parallel_calls=threads)
-  else:
-    dataset = dataset.flat_map(map_func=feature_parser)
-  dataset = dataset.map(map_func=data_augmentation, num_parallel_calls=threads)
-  
   shuffle_buffer_size = 20 * batch_size
-  dataset = dataset.shuffle(buffer_size=shuffle_buffer_size)
-  
-  dataset = dataset.batch(batch_size)
+  if tile_container_reader != None:
+    # The tiles are directly read from the memory mapped tile containers. Only their indices need to be shuffled,
+    # which is cheap enough to do it for all of them.
+    dataset = tf.data.Dataset.range(tile_container_reader.number_of_tiles)
+    dataset = dataset.shuffle(buffer_size=tile_container_reader.number_of_tiles)
+    dataset = dataset.repeat(number_of_epochs)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(map_func=batch_tile_container_parser, num_parallel_calls=threads)
+  elif tile_cache != None:
+    # The decoded tiles are taken from the cache, only the first epoch has to read and parse the tfrecords files.
+    dataset = files.apply(tf.contrib.data.parallel_interleave(cached_tiles_dataset, cycle_length=threads))
+    dataset = dataset.shuffle(buffer_size=shuffle_buffer_size)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(map_func=batch_decoded_tiles_parser, num_parallel_calls=threads)
+  else:
+    dataset = tf.data.TFRecordDataset(
+        files, compression_type=Utilities.tfrecords_compression_type(compression_type), buffer_size=None,
+        num_parallel_reads=threads)
+    
+    # The serialized examples are batched before they are parsed, decoded and augmented. Each of those ops then
+    # runs once per batch instead of once per example.
+    dataset = dataset.shuffle(buffer_size=shuffle_buffer_size)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(map_func=batch_feature_parser, num_parallel_calls=threads)
+  dataset = dataset.map(map_func=batch_data_augmentation, num_parallel_calls=threads)
+  
+  if len(index_tuples) > 1 or len(source_samples_per_pixel_list) > 1:
+    # Several examples are created from each serialized example. They are split up and shuffled,
+    # such that they don't end up in the same batch.
+    dataset = dataset.apply(tf.contrib.data.unbatch())
+    dataset = dataset.shuffle(buffer_size=shuffle_buffer_size)
+    dataset = dataset.batch(batch_size)
   
   prefetch_buffer_size = 5
   dataset = dataset.prefetch(buffer_size=prefetch_buffer_size)
-  
-  iterator = dataset.make_one_shot_iterator()
-  
-  # `features` is a dictionary in which each value is a batch of values for
-  # that feature; `target` is a batch of targets.
-  features, targets = iterator.get_next()
-  return features, targets
+  return dataset
 
 
 def train(
     tfrecords_directory, estimator, feature_trainings_loader, feature_flags, feature_trainings_augmentation,
     number_of_epochs, source_samples_per_pixel_list, index_tuples, required_indices, data_augmentation_usage,
-    tiles_height_width, batch_size, threads):
+    tiles_height_width, batch_size, threads, compression_type='GZIP', hooks=None, tile_cache=None,
+    render_passes_precision=None):
   
   files = tf.data.Dataset.list_files(tfrecords_directory + '/*')
 
@@ -861,12 +1066,14 @@ def train(
   estimator.train(input_fn=lambda: input_fn_tfrecords(
       files, feature_trainings_loader, feature_flags, feature_trainings_augmentation,
       number_of_epochs, source_samples_per_pixel_list, index_tuples, required_indices, data_augmentation_usage,
-      tiles_height_width, batch_size, threads))
+      tiles_height_width, batch_size, threads, compression_type, tile_cache=tile_cache,
+      tile_container_reader=tile_container_reader(tfrecords_directory),
+      render_passes_precision=render_passes_precision), hooks=hooks)
 
 def evaluate(
     tfrecords_directory, estimator, feature_trainings_loader, feature_flags, feature_trainings_augmentation,
     source_samples_per_pixel_list, index_tuples, required_indices, data_augmentation_usage,
-    tiles_height_width, batch_size, threads, name):
+    tiles_height_width, batch_size, threads, name, compression_type='GZIP', render_passes_precision=None):
   
   files = tf.data.Dataset.list_files(tfrecords_directory + '/*')
 
@@ -874,7 +1081,35 @@ def evaluate(
   estimator.evaluate(input_fn=lambda: input_fn_tfrecords(
       files, feature_trainings_loader, feature_flags, feature_trainings_augmentation,
       1, source_samples_per_pixel_list, index_tuples, required_indices, data_augmentation_usage,
-      tiles_height_width, batch_size, threads), name=name)
+      tiles_height_width, batch_size, threads, compression_type,
+      tile_container_reader=tile_container_reader(tfrecords_directory),
+      render_passes_precision=render_passes_precision), name=name)
+
+def evaluator_hook(
+    tfrecords_directory, estimator, feature_trainings_loader, feature_flags, feature_trainings_augmentation,
+    source_samples_per_pixel_list, index_tuples, required_indices, data_augmentation_usage,
+    tiles_height_width, batch_size, threads, name, every_n_steps, compression_type='GZIP',
+    render_passes_precision=None):
+  
+  # The evaluation graph and session are created once and kept alive during the training. The trained variables
+  # are copied over for each evaluation, which is why the input function has to return the dataset itself.
+  files = tf.data.Dataset.list_files(tfrecords_directory + '/*')
+  
+  return tf.contrib.estimator.InMemoryEvaluatorHook(
+      estimator, lambda: dataset_tfrecords(
+          files, feature_trainings_loader, feature_flags, feature_trainings_augmentation,
+          1, source_samples_per_pixel_list, index_tuples, required_indices, data_augmentation_usage,
+          tiles_height_width, batch_size, threads, compression_type,
+          tile_container_reader=tile_container_reader(tfrecords_directory),
+          render_passes_precision=render_passes_precision),
+      name=name, every_n_iter=every_n_steps)
+
+def tile_container_reader(tfrecords_directory):
+  # Tile containers are used instead of tfrecords files if the directory contains them.
+  filenames = glob.glob(os.path.join(tfrecords_directory, '*' + TileContainer.EXTENSION))
+  if len(filenames) == 0:
+    return None
+  return TileContainerReader(filenames)
 
 def source_index_tuples(number_of_sources_per_example, number_of_source_index_tuples, number_of_sources_per_target):
   if number_of_sources_per_example < number_of_sources_per_target:
@@ -922,6 +1157,7 @@ def evaluation_jsons(base_tfrecords_directory, mode_name):
         filename.startswith(mode_name) and
         extension == '.json' and
         not 'statistics' in filename and
+        not 'manifest' in filename and
         os.path.isfile(os.path.join(base_tfrecords_directory, file))):
       result.append(file)
   return result
@@ -937,8 +1173,13 @@ def extract_evaluation_json_information(base_tfrecords_directory, json_filename)
   source_samples_per_pixel_list = settings['source_samples_per_pixel_list']
   tiles_height_width = settings['tiles_height_width']
   number_of_sources_per_example = settings['number_of_sources_per_example']
+  # tfrecords created before the compression became configurable are gzipped.
+  compression_type = settings.get('compression_type', 'GZIP')
+  render_passes_precision = RenderPassesPrecision(settings.get('render_passes_precision', {}))
   
-  return name, source_samples_per_pixel_list, tiles_height_width, number_of_sources_per_example
+  return (
+      name, source_samples_per_pixel_list, tiles_height_width, number_of_sources_per_example, compression_type,
+      render_passes_precision)
 
 
 def main(parsed_arguments):
@@ -1003,6 +1244,15 @@ def main(parsed_arguments):
   training_source_samples_per_pixel_list = training_settings['source_samples_per_pixel_list']
   training_tiles_height_width = training_settings['tiles_height_width']
   training_number_of_sources_per_example = training_settings['number_of_sources_per_example']
+  training_compression_type = training_settings.get('compression_type', 'GZIP')
+  training_render_passes_precision = RenderPassesPrecision(training_settings.get('render_passes_precision', {}))
+  
+  # The same cache is used for all the epochs.
+  training_tile_cache = None
+  if parsed_arguments.tile_cache_size > 0 or parsed_arguments.tile_cache_directory != None:
+    training_tile_cache = TileCache(
+        training_number_of_sources_per_example, parsed_arguments.tile_cache_size * 1024 * 1024,
+        parsed_arguments.tile_cache_directory)
   
 
   # Training features.
@@ -1239,7 +1489,7 @@ def main(parsed_arguments):
       validation_data_augmentation_usage = DataAugmentationUsage(False, False, False, False)
 
       # TODO: It is assumed that group_by_samples_per_pixel is used. (DeepBlender)
-      name, samples_per_pixel_list, validation_tiles_height_width, validation_number_of_sources_per_example = extract_evaluation_json_information(base_tfrecords_directory, file)
+      name, samples_per_pixel_list, validation_tiles_height_width, validation_number_of_sources_per_example, validation_compression_type, validation_render_passes_precision = extract_evaluation_json_information(base_tfrecords_directory, file)
       samples_per_pixel = samples_per_pixel_list[0]
       validation_tfrecords_directory = os.path.join(base_tfrecords_directory, mode_name, str(samples_per_pixel))
 
@@ -1247,7 +1497,38 @@ def main(parsed_arguments):
           validation_number_of_sources_per_example, number_of_source_index_tuples, architecture.number_of_sources_per_target)
       evaluate(validation_tfrecords_directory, estimator, feature_trainings_loader, architecture.feature_flags, feature_trainings_augmentation,
           samples_per_pixel_list, index_tuples, required_indices, validation_data_augmentation_usage, validation_tiles_height_width,
-          batch_size, parsed_arguments.threads, name)
+          batch_size, parsed_arguments.threads, name, validation_compression_type, validation_render_passes_precision)
+  elif parsed_arguments.continuous:
+    
+    # The validations run within the training, which keeps the graph, session and compiled kernels alive for
+    # all the epochs.
+    evaluator_hooks = []
+    mode_name = 'validation'
+    files = evaluation_jsons(base_tfrecords_directory, mode_name)
+    for file in files:
+      validation_data_augmentation_usage = DataAugmentationUsage(False, False, False, False)
+
+      # TODO: It is assumed that group_by_samples_per_pixel is used. (DeepBlender)
+      name, samples_per_pixel_list, validation_tiles_height_width, validation_number_of_sources_per_example, validation_compression_type, validation_render_passes_precision = extract_evaluation_json_information(base_tfrecords_directory, file)
+      samples_per_pixel = samples_per_pixel_list[0]
+      validation_tfrecords_directory = os.path.join(base_tfrecords_directory, mode_name, str(samples_per_pixel))
+
+      index_tuples, required_indices = source_index_tuples(
+          validation_number_of_sources_per_example, number_of_source_index_tuples, architecture.number_of_sources_per_target)
+      evaluator_hooks.append(evaluator_hook(
+          validation_tfrecords_directory, estimator, feature_trainings_loader, architecture.feature_flags, feature_trainings_augmentation,
+          samples_per_pixel_list, index_tuples, required_indices, validation_data_augmentation_usage, validation_tiles_height_width,
+          batch_size, parsed_arguments.threads, name, parsed_arguments.validation_steps, validation_compression_type,
+          validation_render_passes_precision))
+    
+    # The index tuples are only chosen once, instead of once per epoch.
+    index_tuples, required_indices = source_index_tuples(
+        training_number_of_sources_per_example, number_of_source_index_tuples, architecture.number_of_sources_per_target)
+    train(
+        training_tfrecords_directory, estimator, feature_trainings_loader, architecture.feature_flags, feature_trainings_augmentation,
+        parsed_arguments.train_epochs, training_source_samples_per_pixel_list, index_tuples, required_indices, data_augmentation_usage, training_tiles_height_width,
+        batch_size, parsed_arguments.threads, training_compression_type, evaluator_hooks, training_tile_cache,
+        training_render_passes_precision)
   else:
     remaining_number_of_epochs = parsed_arguments.train_epochs
     while remaining_number_of_epochs > 0:
@@ -1262,7 +1543,8 @@ def main(parsed_arguments):
         train(
             training_tfrecords_directory, estimator, feature_trainings_loader, architecture.feature_flags, feature_trainings_augmentation,
             epochs_to_train, training_source_samples_per_pixel_list, index_tuples, required_indices, data_augmentation_usage, training_tiles_height_width,
-            batch_size, parsed_arguments.threads)
+            batch_size, parsed_arguments.threads, training_compression_type, tile_cache=training_tile_cache,
+            render_passes_precision=training_render_passes_precision)
       
       # Vaidation
       mode_name = 'validation'
@@ -1271,7 +1553,7 @@ def main(parsed_arguments):
         validation_data_augmentation_usage = DataAugmentationUsage(False, False, False, False)
 
         # TODO: It is assumed that group_by_samples_per_pixel is used. (DeepBlender)
-        name, samples_per_pixel_list, validation_tiles_height_width, validation_number_of_sources_per_example = extract_evaluation_json_information(base_tfrecords_directory, file)
+        name, samples_per_pixel_list, validation_tiles_height_width, validation_number_of_sources_per_example, validation_compression_type, validation_render_passes_precision = extract_evaluation_json_information(base_tfrecords_directory, file)
         samples_per_pixel = samples_per_pixel_list[0]
         validation_tfrecords_directory = os.path.join(base_tfrecords_directory, mode_name, str(samples_per_pixel))
 
@@ -1279,7 +1561,8 @@ def main(parsed_arguments):
             validation_number_of_sources_per_example, number_of_source_index_tuples, architecture.number_of_sources_per_target)
         evaluate(validation_tfrecords_directory, estimator, feature_trainings_loader, architecture.feature_flags, feature_trainings_augmentation,
             samples_per_pixel_list, index_tuples, required_indices, validation_data_augmentation_usage, validation_tiles_height_width,
-            batch_size, parsed_arguments.threads, name)
+            batch_size, parsed_arguments.threads, name, validation_compression_type,
+            validation_render_passes_precision)
       
       remaining_number_of_epochs = remaining_number_of_epochs - number_of_training_epochs
 
@@ -9,4 +9,10 @@ def signed_expm1(inputs):
 def heaviside(inputs):
   result = tf.sign(inputs)
   result = tf.minimum(result, 0.)
-  return result
\ No newline at end of file
+  return result
+
+def tfrecords_compression_type(compression_type):
+  # 'NONE' is used in the settings for uncompressed tfrecords, while TensorFlow expects an empty string.
+  if compression_type == None or compression_type == 'NONE':
+    return ''
+  return compression_type
\ No newline at end of file
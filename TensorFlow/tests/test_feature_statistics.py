@@ -0,0 +1,185 @@
+import numpy as np
+import pytest
+
+from FeatureStatistics import FeatureRunningStatistics
+from FeatureStatistics import QuantileSketch
+from FeatureStatistics import RatioStatistics
+from FeatureStatistics import RunningStatistics
+
+
+def _values():
+  # A large offset makes a naive sum of squares lose the variance.
+  return np.random.RandomState(0).standard_normal([10000]) * 0.1 + 1e6
+
+
+def test_chunks_match_numpy():
+  values = _values()
+  running_statistics = RunningStatistics()
+  for chunk in np.array_split(values, 37):
+    running_statistics.add(chunk)
+  assert running_statistics.count == values.size
+  assert running_statistics.mean == pytest.approx(np.mean(values), rel=1e-12)
+  assert running_statistics.variance() == pytest.approx(np.var(values), rel=1e-6)
+  assert running_statistics.minimum == np.min(values)
+  assert running_statistics.maximum == np.max(values)
+
+
+def test_merge_does_not_depend_on_the_order():
+  values = _values()
+  parts = []
+  for chunk in np.array_split(values, [10, 11, 5000]):
+    part = RunningStatistics()
+    part.add(chunk)
+    part.add_coverage(chunk.size, np.count_nonzero(chunk > 1e6))
+    parts.append(part)
+
+  forward = RunningStatistics()
+  for part in parts:
+    forward.merge(part)
+  backward = RunningStatistics()
+  for part in reversed(parts):
+    backward.merge(part)
+
+  for running_statistics in [forward, backward]:
+    assert running_statistics.count == values.size
+    assert running_statistics.mean == pytest.approx(np.mean(values), rel=1e-12)
+    assert running_statistics.variance() == pytest.approx(np.var(values), rel=1e-6)
+    assert running_statistics.coverage() == np.count_nonzero(values > 1e6) / values.size
+
+
+def test_empty_parts_are_ignored():
+  running_statistics = RunningStatistics()
+  running_statistics.add([])
+  running_statistics.merge(RunningStatistics())
+  statistics = running_statistics.statistics()
+  assert statistics.mean == 0. and statistics.variance == 0. and statistics.coverage == 0.
+
+  running_statistics.add([2., 4.])
+  running_statistics.merge(RunningStatistics())
+  assert running_statistics.mean == 3.
+  assert running_statistics.variance() == 1.
+
+
+def _log1p_values():
+  random_state = np.random.RandomState(0)
+  values = random_state.standard_normal([20000]) * np.exp(random_state.uniform(-3., 3., [20000]))
+  values[:5000] = 0.
+  return np.sign(values) * np.log1p(np.abs(values))
+
+
+def test_quantiles_are_within_a_bin():
+  values = _log1p_values()
+  sketch = QuantileSketch()
+  sketch.add(values)
+  # The quantile lies in the bin of the value with its rank.
+  sorted_values = np.sort(values)
+  for percentile in FeatureRunningStatistics.PERCENTILES:
+    rank = int(np.ceil(percentile / 100. * values.size)) - 1
+    assert abs(sketch.quantile(percentile / 100.) - sorted_values[rank]) <= 1. / QuantileSketch.BINS_PER_UNIT
+  assert sketch.quantile(0.) == np.min(values)
+  assert sketch.quantile(1.) == np.max(values)
+
+
+def test_zeros_are_exact():
+  sketch = QuantileSketch()
+  sketch.add(np.zeros([100]))
+  sketch.add(np.ones([10]))
+  assert sketch.quantile(0.5) == 0.
+  assert sketch.percentiles([50])['50'] == 0.
+
+
+def test_merged_sketches_match_one_sketch():
+  values = _log1p_values()
+  sketch = QuantileSketch()
+  sketch.add(values)
+  merged_sketch = QuantileSketch()
+  for chunk in np.array_split(values, 7):
+    part = QuantileSketch()
+    part.add(chunk)
+    merged_sketch.merge(part)
+  np.testing.assert_array_equal(merged_sketch.counts, sketch.counts)
+  assert merged_sketch.zeros == sketch.zeros
+  assert merged_sketch.percentiles([1, 50, 99]) == sketch.percentiles([1, 50, 99])
+
+
+def _units():
+  random_state = np.random.RandomState(0)
+  x = random_state.randint(1, 100, [500]).astype(np.float64)
+  y = x * 0.3 + random_state.standard_normal([500]) * 5.
+  return x, y
+
+
+def test_ratio_confidence_interval():
+  x, y = _units()
+  ratio_statistics = RatioStatistics()
+  ratio_statistics.add(x, y)
+  ratio = np.sum(y) / np.sum(x)
+  assert ratio_statistics.ratio() == pytest.approx(ratio, rel=1e-12)
+
+  residuals = y - ratio * x
+  half_width = 1.96 * np.sqrt(np.sum(np.square(residuals)) / (x.size - 1) / x.size) / np.mean(x)
+  lower, upper = ratio_statistics.confidence_interval(1.96)
+  assert lower == pytest.approx(ratio - half_width, rel=1e-9)
+  assert upper == pytest.approx(ratio + half_width, rel=1e-9)
+
+
+def test_merged_ratio_statistics_match_one_pass():
+  x, y = _units()
+  ratio_statistics = RatioStatistics()
+  ratio_statistics.add(x, y)
+  merged_ratio_statistics = RatioStatistics()
+  merged_ratio_statistics.merge(RatioStatistics())
+  for x_chunk, y_chunk in zip(np.array_split(x, [1, 200]), np.array_split(y, [1, 200])):
+    part = RatioStatistics()
+    part.add(x_chunk, y_chunk)
+    merged_ratio_statistics.merge(part)
+  assert merged_ratio_statistics.count == ratio_statistics.count
+  for name in ['mean_x', 'mean_y', 'm2_x', 'm2_y', 'c_xy']:
+    assert getattr(merged_ratio_statistics, name) == pytest.approx(getattr(ratio_statistics, name), rel=1e-9)
+
+
+def test_single_unit_has_no_interval():
+  ratio_statistics = RatioStatistics()
+  ratio_statistics.add([10.], [4.])
+  assert ratio_statistics.confidence_interval(1.96) == [0.4, 0.4]
+  assert RatioStatistics().confidence_interval(1.96) == [0., 0.]
+
+
+def _add_shard(feature_running_statistics, tiles):
+  for tile in tiles:
+    covered = tile != 0.
+    feature_running_statistics.add(
+        tile, np.log1p(tile), covered, [tile.size], [np.sum(tile)], [tile.size], [np.count_nonzero(covered)])
+  feature_running_statistics.end_shard()
+
+
+def test_feature_statistics_of_merged_shards():
+  random_state = np.random.RandomState(0)
+  shards = [[np.maximum(random_state.standard_normal([4, 4]), 0.) for _ in range(3)] for _ in range(4)]
+  values = np.concatenate([tile.ravel() for tiles in shards for tile in tiles])
+
+  feature_running_statistics = FeatureRunningStatistics()
+  for tiles in shards[:2]:
+    _add_shard(feature_running_statistics, tiles)
+  other = FeatureRunningStatistics()
+  for tiles in shards[2:]:
+    _add_shard(other, tiles)
+  feature_running_statistics.merge(other)
+
+  assert feature_running_statistics.tile_means.count == 12
+  assert feature_running_statistics.shard_means.count == 4
+
+  feature_statistics = feature_running_statistics.feature_statistics(1)
+  assert feature_statistics.statistics.mean == pytest.approx(np.mean(values), rel=1e-12)
+  assert feature_statistics.statistics.coverage == np.count_nonzero(values) / values.size
+  assert feature_statistics.statistics_log1p.coverage == feature_statistics.statistics.coverage
+  assert feature_statistics.statistics.mean_confidence_interval == None
+  assert sorted(feature_statistics.statistics_log1p.percentiles.keys()) == sorted(
+      str(percentile) for percentile in FeatureRunningStatistics.PERCENTILES)
+
+  for sampling in ['tiles', 'shards']:
+    statistics = feature_running_statistics.feature_statistics(1, sampling).statistics
+    lower, upper = statistics.mean_confidence_interval
+    assert lower < statistics.mean < upper
+    lower, upper = statistics.coverage_confidence_interval
+    assert lower < statistics.coverage < upper
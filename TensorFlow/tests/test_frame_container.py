@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from FrameContainer import FrameContainer
+
+
+def test_round_trip(tmp_path):
+  random_state = np.random.RandomState(0)
+  images = {
+      'Prediction Diffuse Direct': random_state.rand(20, 30, 3).astype(np.float32),
+      'Prediction Alpha': random_state.rand(20, 30),
+      'Prediction Depth': random_state.rand(20, 30, 1).astype(np.float64)}
+  filename = str(tmp_path / ('Prediction' + FrameContainer.EXTENSION))
+  FrameContainer.write(filename, images)
+
+  result = FrameContainer.read(filename)
+  assert sorted(result.keys()) == sorted(images.keys())
+  for name in images:
+    assert result[name].shape == images[name].shape
+    assert result[name].dtype == np.float32
+    np.testing.assert_array_equal(result[name], images[name].astype(np.float32))
+
+
+def test_render_passes_are_aligned(tmp_path):
+  filename = str(tmp_path / ('Prediction' + FrameContainer.EXTENSION))
+  FrameContainer.write(filename, {'Prediction Combined': np.ones([4, 5, 3], dtype=np.float32)})
+  with open(filename, 'rb') as frame_container_file:
+    content = frame_container_file.read()
+  data_size = 4 * 5 * 3 * 4
+  assert (len(content) - data_size) % FrameContainer.ALIGNMENT == 0
+
+
+def test_rejects_other_files(tmp_path):
+  filename = str(tmp_path / 'Prediction.npz')
+  with open(filename, 'wb') as other_file:
+    other_file.write(b'PK\x03\x04' + b'\x00' * 32)
+  with pytest.raises(Exception):
+    FrameContainer.read(filename)
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from RenderPassesPrecision import RenderPassesPrecision
+
+
+def _image():
+  # High dynamic range values with both signs and zeros.
+  random_state = np.random.RandomState(0)
+  image = random_state.standard_normal([16, 16, 3]) * np.exp(random_state.uniform(-8., 8., [16, 16, 3]))
+  image[0, 0] = 0.
+  return image.astype(np.float32)
+
+
+def test_unknown_precision_is_rejected():
+  with pytest.raises(Exception):
+    RenderPassesPrecision({'Diffuse Direct': 'float8'})
+
+
+def test_feature_precision():
+  render_passes_precision = RenderPassesPrecision({'Diffuse Direct': RenderPassesPrecision.LOG_FLOAT16})
+  assert render_passes_precision.feature_precision('source/Diffuse Direct') == RenderPassesPrecision.LOG_FLOAT16
+  assert render_passes_precision.feature_precision('target/Diffuse Direct') == RenderPassesPrecision.LOG_FLOAT16
+  assert render_passes_precision.feature_precision('source/Alpha') == RenderPassesPrecision.FLOAT32
+  assert RenderPassesPrecision().__json__() == {}
+
+
+def test_float32_is_lossless():
+  image = _image()
+  encoded = RenderPassesPrecision.encode(image, RenderPassesPrecision.FLOAT32)
+  assert encoded.dtype == np.float32
+  np.testing.assert_array_equal(RenderPassesPrecision.decode_numpy(encoded, RenderPassesPrecision.FLOAT32), image)
+
+
+@pytest.mark.parametrize('precision', [RenderPassesPrecision.FLOAT16, RenderPassesPrecision.LOG_FLOAT16])
+def test_float16_round_trip(precision):
+  image = np.clip(_image(), -1000., 1000.)
+  encoded = RenderPassesPrecision.encode(image, precision)
+  assert encoded.dtype == RenderPassesPrecision.numpy_dtype(precision)
+  decoded = RenderPassesPrecision.decode_numpy(encoded, precision)
+  assert decoded.dtype == np.float32
+  assert decoded[0, 0, 0] == 0.
+  assert (np.sign(decoded) == np.sign(image)).all()
+  # log1p loses a bit more of the relative precision close to zero, so both stay within a few float16 steps.
+  np.testing.assert_allclose(decoded, image, rtol=1e-2, atol=1e-6)
+
+
+@pytest.mark.parametrize('precision', [RenderPassesPrecision.FLOAT16, RenderPassesPrecision.LOG_FLOAT16])
+def test_large_values_stay_finite(precision):
+  image = np.array([1e6, -1e6, 3e38], dtype=np.float32)
+  decoded = RenderPassesPrecision.decode_numpy(RenderPassesPrecision.encode(image, precision), precision)
+  assert np.isfinite(decoded).all()
+  if precision == RenderPassesPrecision.LOG_FLOAT16:
+    np.testing.assert_allclose(decoded[:2], image[:2], rtol=1e-2)
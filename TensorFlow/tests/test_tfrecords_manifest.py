@@ -0,0 +1,77 @@
+import os
+
+from TFRecordsManifest import TFRecordsManifest
+
+SETTINGS = {'tiles_height_width': 128, 'tiles_per_tfrecords': 100}
+
+
+def _manifest_filename(tmp_path):
+  return str(tmp_path / 'manifest.json')
+
+
+def _saved_manifest(tmp_path):
+  manifest = TFRecordsManifest(_manifest_filename(tmp_path), SETTINGS)
+  manifest.start_scene('Scene_a')
+  manifest.add_scene('Scene_a', 'fingerprint_a', ['Scene_a_0.tfrecords', 'Scene_a_1.tfrecords'], 150)
+  manifest.start_scene('Scene_b')
+  manifest.save()
+  return manifest
+
+
+def test_new_manifest_is_empty(tmp_path):
+  manifest = TFRecordsManifest(_manifest_filename(tmp_path), SETTINGS)
+  assert manifest.scene_names() == []
+  assert manifest.pending_scene_names() == []
+  assert not manifest.settings_changed
+  assert not manifest.is_up_to_date('Scene_a', 'fingerprint_a')
+
+
+def test_round_trip(tmp_path):
+  _saved_manifest(tmp_path)
+  assert not os.path.exists(_manifest_filename(tmp_path) + '.tmp')
+
+  manifest = TFRecordsManifest(_manifest_filename(tmp_path), SETTINGS)
+  assert not manifest.settings_changed
+  assert manifest.scene_names() == ['Scene_a']
+  assert manifest.pending_scene_names() == ['Scene_b']
+  assert manifest.tfrecords_filenames() == set(['Scene_a_0.tfrecords', 'Scene_a_1.tfrecords'])
+
+
+def test_changed_fingerprint_is_outdated(tmp_path):
+  _saved_manifest(tmp_path)
+  manifest = TFRecordsManifest(_manifest_filename(tmp_path), SETTINGS)
+  assert manifest.is_up_to_date('Scene_a', 'fingerprint_a')
+  assert not manifest.is_up_to_date('Scene_a', 'fingerprint_changed')
+  assert not manifest.is_up_to_date('Scene_b', 'fingerprint_b')
+
+
+def test_changed_settings_invalidate_all_scenes(tmp_path):
+  _saved_manifest(tmp_path)
+  settings = dict(SETTINGS)
+  settings['tiles_height_width'] = 64
+  manifest = TFRecordsManifest(_manifest_filename(tmp_path), settings)
+  assert manifest.settings_changed
+  assert manifest.scene_names() == []
+  assert manifest.pending_scene_names() == []
+  assert not manifest.is_up_to_date('Scene_a', 'fingerprint_a')
+
+
+def test_rebuild_ignores_the_saved_manifest(tmp_path):
+  _saved_manifest(tmp_path)
+  manifest = TFRecordsManifest(_manifest_filename(tmp_path), SETTINGS, rebuild=True)
+  assert not manifest.settings_changed
+  assert manifest.scene_names() == []
+  assert not manifest.is_up_to_date('Scene_a', 'fingerprint_a')
+
+
+def test_finished_scene_is_no_longer_pending(tmp_path):
+  manifest = _saved_manifest(tmp_path)
+  manifest.add_scene('Scene_b', 'fingerprint_b', ['Scene_b_0.tfrecords'], 10)
+  assert manifest.pending_scene_names() == []
+  manifest.remove_scene('Scene_a')
+  manifest.save()
+
+  manifest = TFRecordsManifest(_manifest_filename(tmp_path), SETTINGS)
+  assert manifest.scene_names() == ['Scene_b']
+  assert manifest.tfrecords_filenames() == set(['Scene_b_0.tfrecords'])
+  assert manifest.is_up_to_date('Scene_b', 'fingerprint_b')
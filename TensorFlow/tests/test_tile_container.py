@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from RenderPassesPrecision import RenderPassesPrecision
+from TileContainer import TileContainer
+from TileContainer import TileContainerReader
+from TileContainer import TileContainerWriter
+
+TILE_SIZE = 8
+
+
+def _tiles(number_of_tiles, seed):
+  random_state = np.random.RandomState(seed)
+  return [{
+      'source/Diffuse Direct': random_state.rand(TILE_SIZE, TILE_SIZE, 3).astype(np.float32) * 100.,
+      'source/Alpha': random_state.rand(TILE_SIZE, TILE_SIZE).astype(np.float32),
+      'target/Diffuse Direct': random_state.rand(TILE_SIZE, TILE_SIZE, 3).astype(np.float32) * 100.}
+      for _ in range(number_of_tiles)]
+
+
+def _write(filename, tiles, render_passes_precision=None):
+  writer = TileContainerWriter(
+      filename, TILE_SIZE, description={'scene': 'Scene_a'}, render_passes_precision=render_passes_precision)
+  for tile in tiles:
+    writer.write(tile)
+  writer.close()
+
+
+def test_round_trip(tmp_path):
+  filename = str(tmp_path / ('Scene_a' + TileContainer.EXTENSION))
+  tiles = _tiles(5, 0)
+  _write(filename, tiles)
+
+  reader = TileContainerReader([filename])
+  assert reader.number_of_tiles == 5
+  assert reader.header['scene'] == 'Scene_a'
+  assert reader.names() == sorted(tiles[0].keys())
+  for index, tile in enumerate(tiles):
+    result = reader.tile(index)
+    np.testing.assert_array_equal(result['source/Diffuse Direct'], tile['source/Diffuse Direct'])
+    np.testing.assert_array_equal(result['source/Alpha'][:, :, 0], tile['source/Alpha'])
+
+
+def test_read_across_containers(tmp_path):
+  filenames = [str(tmp_path / ('Scene_' + str(index) + TileContainer.EXTENSION)) for index in range(2)]
+  tiles = _tiles(3, 0) + _tiles(4, 1)
+  _write(filenames[0], tiles[:3])
+  _write(filenames[1], tiles[3:])
+
+  reader = TileContainerReader(filenames)
+  assert reader.number_of_tiles == 7
+  names = ['target/Diffuse Direct', 'source/Alpha']
+  indices = [6, 0, 3, 2]
+  result = reader.read(indices, names)
+  assert result.shape == (4, TILE_SIZE * TILE_SIZE * 4)
+  for row, index in enumerate(indices):
+    expected = np.concatenate([tiles[index][name].reshape([-1]) for name in names])
+    np.testing.assert_array_equal(result[row], expected)
+
+
+def test_precision_is_stored_per_feature(tmp_path):
+  filename = str(tmp_path / ('Scene_a' + TileContainer.EXTENSION))
+  tiles = _tiles(2, 0)
+  _write(filename, tiles, RenderPassesPrecision({'Diffuse Direct': RenderPassesPrecision.LOG_FLOAT16}))
+
+  reader = TileContainerReader([filename])
+  layout = {entry['name']: entry for entry in reader.layout}
+  assert layout['source/Diffuse Direct']['dtype'] == 'float16'
+  assert layout['source/Alpha']['dtype'] == 'float32'
+  result = reader.tile(1)
+  assert result['source/Diffuse Direct'].dtype == np.float32
+  np.testing.assert_allclose(result['source/Diffuse Direct'], tiles[1]['source/Diffuse Direct'], rtol=1e-2)
+  np.testing.assert_array_equal(result['source/Alpha'][:, :, 0], tiles[1]['source/Alpha'])
+
+
+def test_different_layouts_are_rejected(tmp_path):
+  filenames = [str(tmp_path / ('Scene_' + str(index) + TileContainer.EXTENSION)) for index in range(2)]
+  _write(filenames[0], _tiles(1, 0))
+  tiles = _tiles(1, 1)
+  del tiles[0]['source/Alpha']
+  _write(filenames[1], tiles)
+  with pytest.raises(Exception):
+    TileContainerReader(filenames)
+
+
+def test_no_containers_are_rejected():
+  with pytest.raises(Exception):
+    TileContainerReader([])
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from Tiling import Tiling
+
+
+def _tiled_image(height, width, tile_size, tile_overlap_size):
+  image = np.random.RandomState(0).rand(height, width, 3).astype(np.float32)
+  tiles_bounds, height_count, width_count = Tiling.bounds_and_counts(height, width, tile_size, tile_overlap_size)
+  tiles = Tiling.split({'image': image}, tiles_bounds)
+  tiled_predictions = [{'image': tile} for tile in tiles['image']]
+  return image, tiled_predictions, tiles_bounds, height_count, width_count
+
+
+def test_bounds_cover_the_image():
+  tiles_bounds, height_count, width_count = Tiling.bounds_and_counts(100, 150, 32, 4)
+  assert len(tiles_bounds) == height_count * width_count
+  covered = np.zeros([100, 150], dtype=bool)
+  for lower_height, upper_height, lower_width, upper_width in tiles_bounds:
+    assert upper_height - lower_height == 32
+    assert upper_width - lower_width == 32
+    assert lower_height >= 0 and upper_height <= 100
+    assert lower_width >= 0 and upper_width <= 150
+    covered[lower_height:upper_height, lower_width:upper_width] = True
+  assert covered.all()
+
+
+def test_single_tile():
+  tiles_bounds, height_count, width_count = Tiling.bounds_and_counts(32, 32, 32, 4)
+  assert tiles_bounds == [(0, 32, 0, 32)]
+  assert height_count == 1 and width_count == 1
+
+
+@pytest.mark.parametrize('tile_blending', ['crop', 'linear', 'cosine'])
+@pytest.mark.parametrize('height, width', [(100, 150), (32, 70), (64, 64)])
+def test_stitching_restores_the_image(tile_blending, height, width):
+  image, tiled_predictions, tiles_bounds, height_count, width_count = _tiled_image(height, width, 32, 4)
+  predictions = Tiling.stitch(
+      tiled_predictions, ['image'], height, width, tiles_bounds,
+      height_count, width_count, 32, 4, tile_blending)
+  assert predictions['image'].shape == image.shape
+  assert predictions['image'].dtype == image.dtype
+  if tile_blending == 'crop':
+    np.testing.assert_array_equal(predictions['image'], image)
+  else:
+    np.testing.assert_allclose(predictions['image'], image, rtol=1e-5, atol=1e-6)
+
+
+def test_crop_places_every_pixel_once():
+  # Each tile is filled with its index, such that the stitched image shows which tile a pixel came from.
+  height, width, tile_size, tile_overlap_size = 90, 120, 32, 4
+  tiles_bounds, height_count, width_count = Tiling.bounds_and_counts(height, width, tile_size, tile_overlap_size)
+  tiled_predictions = [
+      {'index': np.full([tile_size, tile_size, 1], tile_index, dtype=np.float32)}
+      for tile_index in range(len(tiles_bounds))]
+  predictions = Tiling.stitch(
+      tiled_predictions, ['index'], height, width, tiles_bounds,
+      height_count, width_count, tile_size, tile_overlap_size, 'crop')
+  expected = np.full([height, width], -1, dtype=np.int64)
+  for tile_index, (lower_height, upper_height, lower_width, upper_width) in enumerate(tiles_bounds):
+    height_index = tile_index // width_count
+    width_index = tile_index % width_count
+    crop_lower_height, crop_upper_height = Tiling.stitching_crop(
+        height_index, height_count, tile_size, tile_overlap_size, height)
+    crop_lower_width, crop_upper_width = Tiling.stitching_crop(
+        width_index, width_count, tile_size, tile_overlap_size, width)
+    region = expected[
+        lower_height + crop_lower_height:lower_height + crop_upper_height,
+        lower_width + crop_lower_width:lower_width + crop_upper_width]
+    assert (region == -1).all()
+    region[...] = tile_index
+  assert (expected != -1).all()
+  np.testing.assert_array_equal(predictions['index'][:, :, 0], expected)
+
+
+@pytest.mark.parametrize('tile_blending', ['linear', 'cosine'])
+def test_blending_weights_of_neighbors_add_up_to_one(tile_blending):
+  tile_size, tile_overlap_size = 32, 4
+  band_size = 2 * tile_overlap_size
+  first = Tiling.blending_weights(0, 3, tile_size, tile_overlap_size, tile_blending)
+  middle = Tiling.blending_weights(1, 3, tile_size, tile_overlap_size, tile_blending)
+  last = Tiling.blending_weights(2, 3, tile_size, tile_overlap_size, tile_blending)
+
+  assert (first > 0.).all() and (middle > 0.).all() and (last > 0.).all()
+  assert (first[:-band_size] == 1.).all()
+  assert (last[band_size:] == 1.).all()
+  assert (middle[band_size:-band_size] == 1.).all()
+  np.testing.assert_allclose(first[-band_size:] + middle[:band_size], 1., rtol=1e-6)
+  np.testing.assert_allclose(middle[-band_size:] + last[:band_size], 1., rtol=1e-6)
+
+
+def test_blending_weights_without_overlap():
+  weights = Tiling.blending_weights(1, 3, 32, 0, 'linear')
+  np.testing.assert_array_equal(weights, np.ones([32], dtype=np.float32))